@@ -11,15 +11,24 @@ import yaml
 app = Flask(__name__)
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# Request metrics are hooked in first so they cover everything registered below
+from app import metrics
+
 # Import secrets
-secrets_file = os.path.join(basedir, 'secrets.yaml')
+# SIGNALTRACKER_SECRETS can point at an alternative secrets file, e.g. for the benchmarks
+secrets_file = os.environ.get('SIGNALTRACKER_SECRETS', os.path.join(basedir, 'secrets.yaml'))
 secrets = yaml.load(open(secrets_file), Loader=yaml.SafeLoader)
-driver = secrets['database']['driver']
-username = secrets['database']['username']
-password = secrets['database']['password']
-fqdn = secrets['database']['fqdn']
-port = secrets['database']['port']
-dbname = secrets['database']['dbname']
+if 'uri' in secrets['database']:
+    # A complete SQLAlchemy database uri can be given instead of the individual settings
+    database_uri = secrets['database']['uri']
+else:
+    driver = secrets['database']['driver']
+    username = secrets['database']['username']
+    password = secrets['database']['password']
+    fqdn = secrets['database']['fqdn']
+    port = secrets['database']['port']
+    dbname = secrets['database']['dbname']
+    database_uri = f"{driver}://{username}:{password}@{fqdn}:{port}/{dbname}"
 
 # Get the SECRET_KEY we will use for flask-wtf to prevent CSRF attaches
 app.config['SECRET_KEY'] = secrets['secret_key']
@@ -33,10 +42,95 @@ app.config['MAPS_API_KEY'] = secrets['maps_api_key']
 # Get the opencell id api key
 app.config['OPENCELLID_API_KEY'] = secrets['opencellid_api_key']
 
+# OpenCellID celltower geolocation lookups, see app/geolocation.py
+app.config['OPENCELLID_URL'] = 'http://opencellid.org/cell/get'
+app.config['OPENCELLID_TIMEOUT'] = 5                            # seconds per lookup
+app.config['OPENCELLID_MAX_WORKERS'] = 8                        # concurrent lookups
+app.config['CELLTOWER_LOCATION_CACHE_SIZE'] = 10000             # in-process LRU entries
+app.config['CELLTOWER_LOCATION_CACHE_TTL'] = 24 * 60 * 60       # seconds
+app.config['CELLTOWER_LOCATION_NEGATIVE_TTL'] = 7 * 24 * 60 * 60  # seconds before an unknown cell is looked up again
+# Offline copy of an OpenCellID dump, loaded by 'flask opencellid import', see app/opencellid.py
+app.config['OPENCELLID_DB_DIR'] = secrets.get('opencellid_db_dir', os.path.join(basedir, os.pardir, 'opencellid'))
+
 # Configure the SQLAlchemy part of the app instance
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['SQLALCHEMY_DATABASE_URI'] = f"{driver}://{username}:{password}@{fqdn}:{port}/{dbname}"
+# Logging every SQL statement is expensive, so it is now opt in from the secrets file.
+# Request, SQL and connection pool metrics are available at /metrics instead, see app/metrics.py
+app.config['SQLALCHEMY_ECHO'] = secrets.get('sqlalchemy_echo', False)
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if not database_uri.startswith('sqlite'):
+    # Pool that records how long requests wait to check out a database connection
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': metrics.TimedQueuePool}
+
+# /metrics is switched off unless a metrics_token is set in the secrets file, and then only
+# answers requests with an 'Authorization: Bearer <metrics_token>' header
+app.config['METRICS_TOKEN'] = secrets.get('metrics_token')
+
+# Maximum number of readings the mobile app may upload in a single batch request
+app.config['READINGS_BATCH_MAX'] = 10000
+
+# How new readings are written: 'sync' commits them before the API responds, 'queue' answers 202
+# and writes them behind in batches from a bounded queue, see app/ingest.py
+app.config['READINGS_INGEST_MODE'] = secrets.get('readings_ingest_mode', 'sync')
+app.config['READINGS_INGEST_QUEUE_SIZE'] = 100000     # readings, beyond which the API answers 429
+app.config['READINGS_INGEST_BATCH'] = 1000            # readings written per transaction
+app.config['READINGS_INGEST_INTERVAL'] = 0.5          # seconds a queued reading may wait for its batch
+
+# Monthly partitions of the reading table on Postgres, see app/partitions.py. Partitions are
+# created this many months ahead, and with a retention period set those of months older than it
+# are dropped; without one readings are kept forever.
+app.config['READINGS_PARTITION_MONTHS_AHEAD'] = 3
+app.config['READINGS_RETENTION_MONTHS'] = secrets.get('readings_retention_months')
+
+# Whole months of readings older than READINGS_ARCHIVE_AFTER_DAYS are moved out of the database
+# into per device-month files under READINGS_ARCHIVE_DIR by 'flask archive export', see app/archive.py
+app.config['READINGS_ARCHIVE_DIR'] = secrets.get('readings_archive_dir', os.path.join(basedir, os.pardir, 'archive'))
+app.config['READINGS_ARCHIVE_AFTER_DAYS'] = 90
+
+# Page sizes for the list endpoints when the caller asks for a page with ?limit=
+app.config['LIST_DEFAULT_LIMIT'] = 100
+app.config['LIST_MAX_LIMIT'] = 10000
+# Number of rows fetched from the database cursor at a time when a list is streamed
+app.config['LIST_STREAM_BATCH'] = 1000
+
+# Users per page of the admin overview, see app/overview.py
+app.config['OVERVIEW_PAGE_SIZE'] = 100
+
+# Number of changes returned by one GET /api/v1.0/sync call, see app/sync.py
+app.config['SYNC_DEFAULT_LIMIT'] = 1000
+app.config['SYNC_MAX_LIMIT'] = 10000
+
+# In-process grid index of celltower locations behind the nearest / within endpoints, see
+# app/celltower_index.py
+app.config['CELLTOWER_INDEX_CELL_SIZE'] = 0.02            # degrees, roughly 2km
+app.config['CELLTOWER_INDEX_REFRESH_INTERVAL'] = 5        # seconds between checks for other processes' writes
+app.config['CELLTOWER_NEAREST_MAX'] = 100                 # most towers a nearest query may ask for
+app.config['CELLTOWER_WITHIN_MAX'] = 10000                # most towers a within query returns
+
+# Most points the map view's track of a date range is thinned to, see app/track.py
+app.config['MAP_TRACK_BUDGET'] = 3000
+
+# Coverage heatmap tiles for the map view, cached on disk under TILE_CACHE_DIR, see app/tiles.py
+app.config['TILE_CACHE_DIR'] = secrets.get('tile_cache_dir', os.path.join(basedir, os.pardir, 'tile_cache'))
+app.config['TILE_RADIUS'] = 24                  # pixels from the nearest reading the surface extends to
+app.config['TILE_SAMPLE'] = 4                   # pixels between interpolated values
+app.config['TILE_CACHE_MAX_BYTES'] = secrets.get('tile_cache_max_bytes', 1024 ** 3)
+app.config['TILE_CACHE_PRUNE_INTERVAL'] = 300     # seconds between checks of the cache's size
+
+# Raise rather than log a warning when a relationship would load all of its rows, see app/loading.py
+# (always raised while testing)
+app.config['RAISE_ON_UNBOUNDED_LOADS'] = secrets.get('raise_on_unbounded_loads', False)
+
+# Readings deleted per transaction when purging a user or device in the background, see app/purge.py
+app.config['PURGE_CHUNK_SIZE'] = 10000
+
+# signal_value statistics of ranges that have ended are cached, see app/stats.py
+app.config['STATS_CACHE_SIZE'] = 1000
+app.config['STATS_CACHE_TTL'] = 600            # seconds
+
+# Verified REST API credentials are cached so the slow password hash is not re-run on every call
+app.config['CREDENTIAL_CACHE_SIZE'] = 10000
+app.config['CREDENTIAL_CACHE_TTL'] = 300       # seconds
 
 
 # Create the SQLAlchemy db instance
@@ -47,5 +141,5 @@ login = LoginManager(app)
 login.login_view = 'login'
 bootstrap = Bootstrap(app)
 
-from app import web_routes, api_routes, models
+from app import web_routes, api_routes, models, commands
 
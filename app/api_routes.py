@@ -1,21 +1,68 @@
 from flask import request, abort, url_for, g
 from flask.json import jsonify
-from app import app, db, auth
-from app.models import User, Device, Reading, CellTower
+from app import app, db, auth, metrics, ingest, archive, sync, etags, celltower_index, stats, purge, overview
+from app.models import User, Device, Reading, CellTower, Purge
+from app.cache import TTLCache
+from app.pagination import list_response, datetime_arg, parse_datetime
+from app.dialects import insert_or_select
+from app.serialization import user_projection, device_projection, reading_projection, celltower_projection, numeric_text
+from app.authorization import owned_device, owned_reading, check_new_reading, user_version, device_version, reading_version
+from app.rollups import add_readings, remove_readings, reading_values
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
 import functools
+import hashlib
+import hmac
+
+
+# Cache of credentials that have already passed the password hash check, so the slow hash
+# only has to run once per TTL for each user rather than on every api call
+credential_cache = TTLCache(app.config['CREDENTIAL_CACHE_SIZE'], app.config['CREDENTIAL_CACHE_TTL'])
+metrics.register(metrics.Gauge('signaltracker_credential_cache_hits_total',
+                               'API calls authenticated from the credential cache without a password hash.',
+                               lambda: credential_cache.hits, type='counter'))
+metrics.register(metrics.Gauge('signaltracker_credential_cache_misses_total',
+                               'API calls that had to verify the password hash.',
+                               lambda: credential_cache.misses, type='counter'))
+
+
+# The cache is keyed on a keyed digest of the credentials so no plaintext passwords are held in memory
+def credential_key(email, password):
+    message = '{}\0{}'.format(email, password).encode('utf-8')
+    return hmac.new(app.config['SECRET_KEY'].encode('utf-8'), message, hashlib.sha256).digest()
 
 
 # Verification of user creds supplied in HTTPBasic authorization header
 # Saves the authenticated user details in the Flask 'g' session object
 @auth.verify_password
 def verify_password(email, password):
+    key = credential_key(email, password)
+    cached = credential_cache.peek(key)
+    if cached is not None:
+        user_id, pwd_hash = cached
+        user = User.query.get(user_id)
+        # Only trust the cache while the user still has the same email and password hash, which
+        # also covers changes made through other worker processes that couldn't invalidate our cache
+        if user is not None and user.email == email and user.pwd_hash == pwd_hash:
+            credential_cache.count(hit=True)
+            g.user = user
+            return True
+        credential_cache.pop(key)
+
+    credential_cache.count(hit=False)
     user = User.query.filter_by(email=email).one_or_none()
     if user is None or not user.verify_password(password):
         return False
+    credential_cache.set(key, (user.user_id, user.pwd_hash))
     g.user = user
     return True
 
 
+# Drop any cached credentials for a user whose login details have changed or who has been deleted
+def invalidate_credentials(user_id):
+    credential_cache.invalidate_if(lambda cached: cached[0] == user_id)
+
+
 # Decorator function that protects any api route by ensuring 
 # that a valid api key is provided in the x-api-key header
 def require_api_key(f):
@@ -51,15 +98,36 @@ def require_admin_role(f):
 
 """
 USERS > GET(ALL)
+Supports keyset pagination with ?limit= and ?after=<user_id>, see app/pagination.py
 """
 @app.route('/api/v1.0/users', methods=['GET'])
 @auth.login_required
 @require_api_key
 @require_admin_role
 def get_users():
-    users = User.query.all()
-    return jsonify([u.serialize() for u in users])
+    return list_response(User.query, User.user_id, user_projection)
+
+
 
+"""
+USERS > OVERVIEW
+Each user's devices, total readings, first and last reading and readings in the last 24 hours,
+see app/overview.py. Paged like the list endpoints with ?limit= and ?after=<user_id>.
+"""
+@app.route('/api/v1.0/overview/users', methods=['GET'])
+@auth.login_required
+@require_api_key
+@require_admin_role
+def get_users_overview():
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    if 'after' in request.args and after is None:
+        abort(400)  # bad cursor
+    if 'limit' in request.args and (limit is None or limit < 1):
+        abort(400)  # bad limit
+    limit = min(limit or app.config['LIST_DEFAULT_LIMIT'], app.config['LIST_MAX_LIMIT'])
+    items, next_after = overview.activity_page(after, limit)
+    return jsonify({'items': items, 'next_after': next_after})
 
 
 """
@@ -69,13 +137,19 @@ USERS > GET(ID)
 @auth.login_required
 @require_api_key
 def get_user(id):
+    # A conditional GET is answered from the user's version without loading the user
+    if request.if_none_match:
+        response = etags.not_modified(user_version(User.user_id == id))
+        if response:
+            return response
+
     user = User.query.get(id)
     if not user:
         abort(404)
     # A non-admin level user is only permitted to retrieve their own user record
     if g.user.role != "ADMIN" and user.email != g.user.email:
         abort(403)  # forbidden
-    return jsonify(user.serialize())
+    return etags.tagged(jsonify(user.serialize()), user.change_seq)
 
 
 """
@@ -85,13 +159,18 @@ USERS > GET(EMAIL)
 @auth.login_required
 @require_api_key
 def get_user_by_email(email):
+    if request.if_none_match:
+        response = etags.not_modified(user_version(User.email == email))
+        if response:
+            return response
+
     user = User.query.filter_by(email = email).one_or_none()
     if user is None:
         abort(404)
     # A non-admin level user is only permitted to retrieve their own user record
     if g.user.role != "ADMIN" and user.email != g.user.email:
         abort(403)  # forbidden
-    return jsonify(user.serialize())
+    return etags.tagged(jsonify(user.serialize()), user.change_seq)
 
 
 """
@@ -148,7 +227,8 @@ def update_user(id):
     # A non-admin level user is only permitted to retrieve their own user record
     if g.user.role != "ADMIN" and user.email != g.user.email:
         abort(403)  # forbidden
-    
+    etags.check_if_match(User, id)
+
     if first_name is not None:
         user.first_name = first_name
     if last_name is not None:
@@ -163,11 +243,15 @@ def update_user(id):
         user.role = role
 
     db.session.commit()
-    return jsonify(user.serialize())
+    if email is not None or password is not None or role is not None:
+        invalidate_credentials(user.user_id)
+    return etags.tagged(jsonify(user.serialize()), user.change_seq)
 
 
 """
 USERS > DELETE(ID)
+With ?async=1 the user's readings are deleted in the background and 202 is returned with the
+purge's progress, see app/purge.py
 """
 @app.route('/api/v1.0/users/<int:id>', methods=['DELETE'])
 @auth.login_required
@@ -179,9 +263,14 @@ def delete_user(id):
     # A non-admin level user is only permitted to retrieve their own user record
     if g.user.role != "ADMIN" and user.email != g.user.email:
         abort(403)  # forbidden
+    etags.check_if_match(User, id)
 
-    db.session.delete(user)
+    if request.args.get('async', 0, type=int):
+        return purge_response(purge.start('user', id, id))
+    device_ids = purge.delete('user', user)
     db.session.commit()
+    purge.deleted(device_ids)
+    invalidate_credentials(id)
     return jsonify({}), 204
 
 
@@ -192,14 +281,14 @@ def delete_user(id):
 
 """
 DEVICES > GET(ALL)
+Supports keyset pagination with ?limit= and ?after=<device_id>, see app/pagination.py
 """
 @app.route('/api/v1.0/devices', methods=['GET'])
 @auth.login_required
 @require_api_key
 @require_admin_role
 def get_devices():
-    devices = Device.query.all()
-    return jsonify([d.serialize() for d in devices])
+    return list_response(Device.query, Device.device_id, device_projection)
 
 
 
@@ -210,18 +299,37 @@ DEVICES > GET(ID)
 @require_api_key
 @auth.login_required
 def get_device(id):
-    device = Device.query.get(id)
-    if not device:
-        abort(404)
     # A non-admin level user is only permitted to retrieve devices that belong to that user
-    if g.user.role != "ADMIN":
-        user = User.query.get(device.user_id)
-        if not user:
-            abort(404)
-        if user.email != g.user.email:
-            abort(403)  # forbidden
+    if request.if_none_match:
+        response = etags.not_modified(device_version(id, missing_owner=404))
+        if response:
+            return response
+
+    device = owned_device(id, missing_owner=404)
+    return etags.tagged(jsonify(device.serialize()), device.change_seq)
+
+
+"""
+DEVICES > STATS
+signal_value statistics of the device's readings with ?start= <= timestamp < ?end= (both
+optional), per signal_type and per hour, see app/stats.py
+"""
+@app.route('/api/v1.0/devices/<int:id>/stats', methods=['GET'])
+@require_api_key
+@auth.login_required
+def get_device_stats(id):
+    # A non-admin level user is only permitted statistics of devices that belong to that user
+    owned_device(id, missing_owner=404)
+    start, end = stats_range()
+    return jsonify(stats.device_stats(id, start, end))
+
 
-    return jsonify(device.serialize())
+def stats_range():
+    start = datetime_arg('start')
+    end = datetime_arg('end')
+    if start is not None and end is not None and start >= end:
+        abort(400)  # empty range
+    return start, end
 
 
 """
@@ -240,30 +348,32 @@ def new_device():
     if user_id is None or manufacturer is None or model is None or serial_no is None or android_version is None:
         abort(400)  # missing args
 
-    user = User.query.get(user_id)
-    if not user:
-        abort(404)   # specified user_id does not exist
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        abort(400)  # bad user_id
 
-    # A non-admin level user is only permitted to retrieve devices that belong to that user
-    if g.user.role != "ADMIN" and user.email != g.user.email:
-        abort(403)  # forbidden
+    # A non-admin level user is only permitted to create devices that belong to that user,
+    # which needs no lookup as that user is already loaded
+    if g.user.role != "ADMIN":
+        if user_id != g.user.user_id:
+            abort(403)  # forbidden
+    elif User.query.get(user_id) is None:
+        abort(404)   # specified user_id does not exist
 
-    # Check if the device already exists
-    device = Device.query.filter_by(serial_no = serial_no).one_or_none()
-    if device is not None:
-        return jsonify(device.serialize()), 201, {'Location': url_for('new_device', id = device.device_id, _external = True)}
-
-    # Create the new device
-    device = Device(user_id = user_id, 
-                manufacturer = manufacturer,
-                model = model,
-                serial_no = serial_no,
-                android_version = android_version)
-    
-    db.session.add(device)
+    # Create the new device, or if one with this serial_no already exists return that instead, in
+    # a single atomic statement so concurrent uploads from the phone can't create duplicates
+    row = insert_or_select(Device.__table__,
+                {'user_id': user_id,
+                 'manufacturer': manufacturer,
+                 'model': model,
+                 'serial_no': serial_no,
+                 'android_version': android_version},
+                ['serial_no'], device_projection.columns)
     db.session.commit()
+    device = device_projection.items([row])[0]
 
-    return jsonify(device.serialize()), 201, {'Location': url_for('new_device', id = device.device_id, _external = True)}
+    return jsonify(device), 201, {'Location': url_for('new_device', id = device['device_id'], _external = True)}
 
 
 """
@@ -281,17 +391,9 @@ def update_device(id):
     if manufacturer is None and model is None and serial_no is None and android_version is None:
         abort(400)  # missing args
 
-    device = Device.query.get(id)
-    if not device:
-        abort(404)  # device doesn't exist
-
-    # A non-admin level user is only permitted to retrieve devices that belong to that user
-    if g.user.role != "ADMIN":
-        user = User.query.get(device.user_id)
-        if not user:
-            abort(409)
-        if user.email != g.user.email:
-            abort(403)  # forbidden
+    # A non-admin level user is only permitted to update devices that belong to that user
+    device = owned_device(id)
+    etags.check_if_match(Device, id)
 
     if manufacturer is not None:
         device.manufacturer = manufacturer
@@ -302,34 +404,60 @@ def update_device(id):
     if android_version is not None:
         device.android_version = android_version
 
-    db.session.commit()
-    return jsonify(device.serialize())
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(409)  # another device already has this serial_no
+    return etags.tagged(jsonify(device.serialize()), device.change_seq)
 
 
 """
 DEVICES > DELETE(ID)
+With ?async=1 the device's readings are deleted in the background and 202 is returned with the
+purge's progress, see app/purge.py
 """
 @app.route('/api/v1.0/devices/<int:id>', methods=['DELETE'])
 @auth.login_required
 @require_api_key
 def delete_device(id):
-    device = Device.query.get(id)
-    if not device:
-        abort(404)
-
-    # A non-admin level user is only permitted to retrieve devices that belong to that user
-    if g.user.role != "ADMIN":
-        user = User.query.get(device.user_id)
-        if not user:
-            abort(409)
-        if user.email != g.user.email:
-            abort(403)  # forbidden
+    # A non-admin level user is only permitted to delete devices that belong to that user
+    device = owned_device(id)
+    etags.check_if_match(Device, id)
 
-    db.session.delete(device)
+    if request.args.get('async', 0, type=int):
+        return purge_response(purge.start('device', id, device.user_id))
+    device_ids = purge.delete('device', device)
     db.session.commit()
+    purge.deleted(device_ids)
     return jsonify({}), 204
 
 
+def purge_response(started):
+    return jsonify(started.serialize()), 202, {'Location': url_for('get_purge', id = started.purge_id, _external = True)}
+
+
+
+### PURGES ###
+
+
+"""
+PURGES > GET(ID)
+Progress of a user or device being deleted in the background
+"""
+@app.route('/api/v1.0/purges/<int:id>', methods=['GET'])
+@auth.login_required
+@require_api_key
+def get_purge(id):
+    progress = Purge.query.get(id)
+    if not progress:
+        abort(404)      #doesn't exist
+    # A non-admin level user is only permitted to follow the purges of their own user and devices
+    if g.user.role != "ADMIN" and progress.user_id != g.user.user_id:
+        abort(403)  # forbidden
+    return jsonify(progress.serialize())
+
+
 
 
 ### READINGS ###
@@ -337,14 +465,29 @@ def delete_device(id):
 
 """
 READINGS > GET(ALL)
+Supports keyset pagination with ?limit= and ?after=<reading_id>, see app/pagination.py, and
+filtering with ?device_id= and a ?start= / ?end= ISO 8601 time range (start inclusive, end exclusive)
 """
 @app.route('/api/v1.0/readings', methods=['GET'])
 @auth.login_required
 @require_api_key
 @require_admin_role
 def get_readings():
-    readings = Reading.query.all()
-    return jsonify([r.serialize() for r in readings])
+    device_id = request.args.get('device_id', type=int)
+    start = datetime_arg('start')
+    end = datetime_arg('end')
+
+    readings = Reading.query
+    archived = None
+    if device_id is not None:
+        readings = readings.filter(Reading.device_id == device_id)
+        # The archive files are per device, so a device's archived readings are included too
+        archived = lambda after: archive.items(device_id, start, end, after)
+    if start is not None:
+        readings = readings.filter(Reading.timestamp >= start)
+    if end is not None:
+        readings = readings.filter(Reading.timestamp < end)
+    return list_response(readings, Reading.reading_id, reading_projection, archived)
 
 
 
@@ -355,22 +498,14 @@ READINGS > GET(ID)
 @auth.login_required
 @require_api_key
 def get_reading(id):
-    reading = Reading.query.get(id)
-    if not reading:
-        abort(404)
-
     # A non-admin level user is only permitted to retrieve readings that belong to that user
-    if g.user.role != "ADMIN":
-        device = Device.query.get(reading.device_id)
-        if not device:
-            abort(404)
-        user = User.query.get(device.user_id)
-        if not user:
-            abort(409)
-        if user.email != g.user.email:
-            abort(403)  # forbidden
+    if request.if_none_match:
+        response = etags.not_modified(reading_version(id, missing_device=404))
+        if response:
+            return response
 
-    return jsonify(reading.serialize())
+    reading, owner_id = owned_reading(id, missing_device=404)
+    return etags.tagged(jsonify(reading.serialize()), reading.change_seq)
 
 
 """
@@ -391,22 +526,11 @@ def new_reading():
              or signal_type is None or signal_value is None:
         abort(400)  # missing args
 
-    device = Device.query.get(device_id)
-    if not device:
-        abort(400)   # specified device_id does not exist
-
-    celltower = CellTower.query.get(celltower_id)
-    if not celltower:
-        abort(400)   # specified celltower_id does not exist
+    if app.config['READINGS_INGEST_MODE'] == 'queue':
+        return queue_reading()
 
     # A non-admin level user is only permitted to create readings that belong to that user
-    if g.user.role != "ADMIN":
-        user = User.query.get(device.user_id)
-        if not user:
-            abort(409)
-        if user.email != g.user.email:
-            abort(403)  # forbidden
-
+    check_new_reading(device_id, celltower_id)
 
     reading = Reading(device_id = device_id, 
                 celltower_id = celltower_id,
@@ -416,11 +540,133 @@ def new_reading():
                 signal_value = signal_value)
     
     db.session.add(reading)
+    db.session.flush()
+    add_readings([reading_values(reading)])
     db.session.commit()
 
     return jsonify(reading.serialize()), 201, {'Location': url_for('get_user', id = reading.reading_id, _external = True)}
 
 
+# READINGS > CREATE when READINGS_INGEST_MODE is 'queue'. The reading is validated as it would be
+# in a batch and acknowledged with 202 once queued, it has no reading_id until it is written.
+def queue_reading():
+    reading = parse_batch_reading(request.json)
+    if reading is None:
+        abort(400)  # invalid args
+
+    # A non-admin level user is only permitted to create readings that belong to that user
+    check_new_reading(reading['device_id'], reading['celltower_id'])
+
+    if not ingest.submit([reading]):
+        abort(429)  # ingest queue full
+
+    return jsonify({
+        'device_id': reading['device_id'],
+        'celltower_id': reading['celltower_id'],
+        'latitude': numeric_text(reading['latitude']),
+        'longitude': numeric_text(reading['longitude']),
+        'signal_type': reading['signal_type'],
+        'signal_value': reading['signal_value'],
+        'timestamp': str(reading['timestamp'])
+    }), 202
+
+
+"""
+READINGS > CREATE(BATCH)
+Accepts a JSON array of readings, each in the same format as READINGS > CREATE, so the mobile app
+can upload the readings it collected while offline in one call. Each may give the time it was
+taken as an ISO 8601 timestamp (UTC unless it has an offset), otherwise it is stamped on arrival.
+Device ownership and celltower existence are checked once per distinct id in the batch, all valid
+readings are inserted with a single bulk statement, and a status is returned for each item in the
+order it was supplied.
+When READINGS_INGEST_MODE is 'queue' the valid readings are queued instead and get status 202.
+"""
+@app.route('/api/v1.0/readings/batch', methods = ['POST'])
+@auth.login_required
+@require_api_key
+def new_readings_batch():
+    items = request.json
+    if not isinstance(items, list):
+        abort(400)  # expecting an array of readings
+    if len(items) > app.config['READINGS_BATCH_MAX']:
+        abort(413)  # batch too large
+
+    # First pass - parse every item so we know which devices and celltowers are referenced
+    parsed = []
+    for item in items:
+        parsed.append(parse_batch_reading(item))
+
+    device_ids = {p['device_id'] for p in parsed if p is not None}
+    celltower_ids = {p['celltower_id'] for p in parsed if p is not None}
+
+    # One query each for the owners of the devices and for the celltowers referenced in the batch
+    device_owners = {}
+    if device_ids:
+        device_owners = dict(db.session.query(Device.device_id, Device.user_id)
+                                .filter(Device.device_id.in_(device_ids)).all())
+    known_celltowers = set()
+    if celltower_ids:
+        known_celltowers = {c for (c,) in db.session.query(CellTower.celltower_id)
+                                .filter(CellTower.celltower_id.in_(celltower_ids)).all()}
+
+    # Second pass - validate each item against the lookups and build the rows to insert
+    results = []
+    rows = []
+    for index, reading in enumerate(parsed):
+        if reading is None:
+            results.append({'index': index, 'status': 400, 'error': 'missing or invalid args'})
+        elif reading['device_id'] not in device_owners:
+            results.append({'index': index, 'status': 400, 'error': 'device_id does not exist'})
+        elif reading['celltower_id'] not in known_celltowers:
+            results.append({'index': index, 'status': 400, 'error': 'celltower_id does not exist'})
+        # A non-admin level user is only permitted to create readings that belong to that user
+        elif g.user.role != "ADMIN" and device_owners[reading['device_id']] != g.user.user_id:
+            results.append({'index': index, 'status': 403, 'error': 'forbidden'})
+        else:
+            results.append({'index': index, 'status': 201})
+            rows.append(reading)
+
+    if rows and app.config['READINGS_INGEST_MODE'] == 'queue':
+        # Queued readings are acknowledged with 202, and the whole batch is refused if it won't fit
+        if not ingest.submit(rows):
+            abort(429)  # ingest queue full
+        for result in results:
+            if result['status'] == 201:
+                result['status'] = 202
+    elif rows:
+        db.session.execute(Reading.__table__.insert(), rows)
+        add_readings(rows)
+        db.session.commit()
+
+    return jsonify(results)
+
+
+# Parse and type check a single item of a batch upload, returning the column values
+# for the reading, with the time it was taken or else now, or None if anything is missing or
+# malformed. Unlike the single reading
+# endpoint the values are checked up front, as one bad row would otherwise fail the
+# bulk insert for the whole batch.
+def parse_batch_reading(item):
+    if not isinstance(item, dict):
+        return None
+    try:
+        reading = {
+            'device_id': int(item['device_id']),
+            'celltower_id': int(item['celltower_id']),
+            'latitude': float(item['latitude']),
+            'longitude': float(item['longitude']),
+            'signal_type': str(item['signal_type']),
+            'signal_value': int(item['signal_value'])
+        }
+        timestamp = item.get('timestamp')
+        reading['timestamp'] = datetime.utcnow() if timestamp is None else parse_datetime(timestamp)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if len(reading['signal_type']) > Reading.signal_type.type.length:
+        return None
+    return reading
+
+
 """
 READINGS > UPDATE(ID)
 """
@@ -436,21 +682,11 @@ def update_reading(id):
     if latitude is None and longitude is None and signal_type is None and signal_value is None:
         abort(400)  # missing args
 
-    reading = Reading.query.get(id)
-    if not reading:
-        abort(404)  # reading doesn't exist
-
-    # A non-admin level user is only permitted to retrieve readings that belong to that user
-    if g.user.role != "ADMIN":
-        device = Device.query.get(reading.device_id)
-        if not device:
-            abort(409)
-        user = User.query.get(device.user_id)
-        if not user:
-            abort(409)
-        if user.email != g.user.email:
-            abort(403)  # forbidden
+    # A non-admin level user is only permitted to update readings that belong to that user
+    reading, owner_id = owned_reading(id)
+    etags.check_if_match(Reading, id)
 
+    previous = reading_values(reading)
     if latitude is not None:
         reading.latitude = latitude
     if longitude is not None:
@@ -460,8 +696,11 @@ def update_reading(id):
     if signal_value is not None:
         reading.signal_value = signal_value
 
+    db.session.flush()
+    remove_readings([previous])
+    add_readings([reading_values(reading)])
     db.session.commit()
-    return jsonify(reading.serialize())
+    return etags.tagged(jsonify(reading.serialize()), reading.change_seq)
 
 
 """
@@ -471,22 +710,15 @@ READINGS > DELETE(ID)
 @auth.login_required
 @require_api_key
 def delete_reading(id):
-    reading = Reading.query.get(id)
-    if not reading:
-        abort(404)
-
-    # A non-admin level user is only permitted to retrieve readings that belong to that user
-    if g.user.role != "ADMIN":
-        device = Device.query.get(reading.device_id)
-        if not device:
-            abort(409)  # conflict
-        user = User.query.get(device.user_id)
-        if not user:
-            abort(409)  # conflict
-        if user.email != g.user.email:
-            abort(403)  # forbidden
+    # A non-admin level user is only permitted to delete readings that belong to that user
+    reading, owner_id = owned_reading(id)
+    etags.check_if_match(Reading, id)
 
+    previous = reading_values(reading)
+    sync.tombstone('reading', reading.reading_id, owner_id)
     db.session.delete(reading)
+    db.session.flush()
+    remove_readings([previous])
     db.session.commit()
     return jsonify({}), 204
 
@@ -497,16 +729,83 @@ def delete_reading(id):
 
 """
 CELLTOWERS > GET(ALL)
+Supports keyset pagination with ?limit= and ?after=<celltower_id>, see app/pagination.py
 """
 @app.route('/api/v1.0/celltowers', methods=['GET'])
 @auth.login_required
 @require_api_key
 def get_celltowers():
-    celltowers = CellTower.query.all()
-    return jsonify([c.serialize() for c in celltowers])
+    # Celltowers rarely change, so phones revalidate their copy of the list with If-None-Match
+    version = etags.table_version(CellTower)
+    response = etags.not_modified(version)
+    if response:
+        return response
+    return etags.tagged(list_response(CellTower.query, CellTower.celltower_id, celltower_projection), version)
 
 
 
+"""
+CELLTOWERS > NEAREST
+The ?k= (default 10) celltowers nearest to ?latitude= / ?longitude=, nearest first, each with its
+distance from the point in metres, see app/celltower_index.py
+"""
+@app.route('/api/v1.0/celltowers/nearest', methods=['GET'])
+@auth.login_required
+@require_api_key
+def get_nearest_celltowers():
+    latitude = request.args.get('latitude', type=float)
+    longitude = request.args.get('longitude', type=float)
+    k = request.args.get('k', 10, type=int)
+    if latitude is None or longitude is None or not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        abort(400)  # missing or bad coordinates
+    if not 1 <= k <= app.config['CELLTOWER_NEAREST_MAX']:
+        abort(400)  # bad k
+
+    nearest = celltower_index.nearest(latitude, longitude, k)
+    celltowers = celltowers_by_id([celltower_id for d, celltower_id in nearest])
+    items = []
+    for d, celltower_id in nearest:
+        # Towers deleted behind the index's back are left out
+        if celltower_id in celltowers:
+            items.append(dict(celltowers[celltower_id], distance=round(d, 1)))
+    return jsonify({'items': items})
+
+
+"""
+CELLTOWERS > WITHIN
+The celltowers inside the bounding box ?south= / ?west= / ?north= / ?east= (west > east for a box
+crossing the antimeridian), in celltower_id order. At most CELLTOWER_WITHIN_MAX are returned,
+with "truncated" set if there were more.
+"""
+@app.route('/api/v1.0/celltowers/within', methods=['GET'])
+@auth.login_required
+@require_api_key
+def get_celltowers_within():
+    south = request.args.get('south', type=float)
+    west = request.args.get('west', type=float)
+    north = request.args.get('north', type=float)
+    east = request.args.get('east', type=float)
+    if south is None or west is None or north is None or east is None:
+        abort(400)  # missing bounds
+    if not -90 <= south <= north <= 90 or not -180 <= west <= 180 or not -180 <= east <= 180:
+        abort(400)  # bad bounds
+
+    celltower_ids = celltower_index.within(south, west, north, east)
+    limit = app.config['CELLTOWER_WITHIN_MAX']
+    celltowers = celltowers_by_id(celltower_ids[:limit])
+    items = [celltowers[celltower_id] for celltower_id in celltower_ids[:limit] if celltower_id in celltowers]
+    return jsonify({'items': items, 'truncated': len(celltower_ids) > limit})
+
+
+# Serialized celltowers by celltower_id, for the ids the spatial index found
+def celltowers_by_id(celltower_ids):
+    if not celltower_ids:
+        return {}
+    query = CellTower.query.filter(CellTower.celltower_id.in_(celltower_ids))
+    rows = db.session.execute(celltower_projection.select(query)).all()
+    return {item['celltower_id']: item for item in celltower_projection.items(rows)}
+
+
 """
 CELLTOWERS > GET(ID)
 """
@@ -514,10 +813,31 @@ CELLTOWERS > GET(ID)
 @auth.login_required
 @require_api_key
 def get_celltower(id):
+    if request.if_none_match:
+        response = etags.not_modified(etags.version(CellTower, id))
+        if response:
+            return response
+
     celltower = CellTower.query.get(id)
     if not celltower:
         abort(404)
-    return jsonify(celltower.serialize())
+    return etags.tagged(jsonify(celltower.serialize()), celltower.change_seq)
+
+
+"""
+CELLTOWERS > STATS
+signal_value statistics of every device's readings through the celltower with ?start= <=
+timestamp < ?end= (both optional), per signal_type and per hour, see app/stats.py
+"""
+@app.route('/api/v1.0/celltowers/<int:id>/stats', methods=['GET'])
+@auth.login_required
+@require_api_key
+@require_admin_role
+def get_celltower_stats(id):
+    if not db.session.query(CellTower.query.filter_by(celltower_id=id).exists()).scalar():
+        abort(404)
+    start, end = stats_range()
+    return jsonify(stats.celltower_stats(id, start, end))
 
 
 """
@@ -538,23 +858,22 @@ def new_celltower():
              or latitude is None or longitude is None:
         abort(400)  # missing args
 
-    # If the celltower already exists, just return that instead
-    celltower = CellTower.query.filter_by(celltower_name = celltower_name).one_or_none()
-    if celltower is not None:
-        return jsonify(celltower.serialize()), 201, {'Location': url_for('new_celltower', id = celltower.celltower_id, _external = True)}
-
-    # If the celltower does not exist, then lets create it
-    celltower = CellTower(celltower_name = celltower_name, 
-                location_area_code = location_area_code,
-                mobile_country_code = mobile_country_code,
-                mobile_network_code = mobile_network_code,
-                latitude = latitude,
-                longitude = longitude)
-    
-    db.session.add(celltower)
+    # Create the celltower, or if it already exists just return that instead, in a single atomic
+    # statement so concurrent uploads from phones can't create duplicates
+    row = insert_or_select(CellTower.__table__,
+                {'celltower_name': celltower_name,
+                 'location_area_code': location_area_code,
+                 'mobile_country_code': mobile_country_code,
+                 'mobile_network_code': mobile_network_code,
+                 'latitude': latitude,
+                 'longitude': longitude},
+                ['mobile_country_code', 'mobile_network_code', 'location_area_code', 'celltower_name'],
+                celltower_projection.columns)
     db.session.commit()
+    celltower_index.changed()
+    celltower = celltower_projection.items([row])[0]
 
-    return jsonify(celltower.serialize()), 201, {'Location': url_for('new_celltower', id = celltower.celltower_id, _external = True)}
+    return jsonify(celltower), 201, {'Location': url_for('new_celltower', id = celltower['celltower_id'], _external = True)}
 
 
 """
@@ -578,6 +897,7 @@ def update_celltower(id):
     celltower = CellTower.query.get(id)
     if not celltower:
         abort(404)  # reading doesn't exist
+    etags.check_if_match(CellTower, id)
 
     if celltower_name is not None:
         celltower.celltower_name = celltower_name
@@ -590,8 +910,13 @@ def update_celltower(id):
     if longitude is not None:
         celltower.longitude = longitude
 
-    db.session.commit()
-    return jsonify(celltower.serialize())
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(409)  # another celltower already has this cell id in this area and network
+    celltower_index.changed()
+    return etags.tagged(jsonify(celltower.serialize()), celltower.change_seq)
 
 
 """
@@ -605,6 +930,35 @@ def delete_celltower(id):
     celltower = CellTower.query.get(id)
     if not celltower:
         abort(404)
+    etags.check_if_match(CellTower, id)
+    sync.unlink_celltower_readings(id)
+    sync.tombstone('celltower', celltower.celltower_id, None)
     db.session.delete(celltower)
     db.session.commit()
+    celltower_index.changed()
     return jsonify({}), 204
+
+
+
+
+### SYNC ###
+
+
+"""
+SYNC > GET
+Changes since ?since=<cursor> (0 or absent for everything) visible to the caller, at most ?limit=
+of them, with the cursor for the next call, see app/sync.py
+"""
+@app.route('/api/v1.0/sync', methods=['GET'])
+@auth.login_required
+@require_api_key
+def get_sync():
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', type=int)
+    if 'since' in request.args and (since is None or since < 0):
+        abort(400)  # bad cursor
+    if 'limit' in request.args and (limit is None or limit < 1):
+        abort(400)  # bad limit
+
+    limit = min(limit or app.config['SYNC_DEFAULT_LIMIT'], app.config['SYNC_MAX_LIMIT'])
+    return jsonify(sync.changes(g.user, since or 0, limit))
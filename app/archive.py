@@ -0,0 +1,259 @@
+from app import app, db
+from app.models import Reading
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+import numpy as np
+import os
+import shutil
+
+
+# Cold storage of old readings, moved out of the database by 'flask archive export'.
+#
+# Whole months of a device's readings are written to a directory of their own,
+#   READINGS_ARCHIVE_DIR/<device_id>/<YYYY-MM>/<column>.npy
+# holding one uncompressed NumPy array per column, sorted by timestamp. Uncompressed so the
+# arrays can be memory-mapped: reading one day of a month only pages in the parts of the files
+# it needs, found by binary search on the timestamp column, and the OS page cache is shared
+# between worker processes. Compact fixed width types keep the files small. The latitude and
+# longitude are stored as the text of their Decimal values, so archived readings serialize
+# exactly as they did from the database.
+#
+# The read paths (the map view, its bins and GET /api/v1.0/readings?device_id=) combine archived
+# readings with those still in the database, so which of the two a day is in is invisible to
+# callers. Readings by id, and the time range only listing, only cover the database. The daily
+# rollups are left alone when readings are archived, so the zoomed out map doesn't change.
+
+
+COLUMNS = ('reading_id', 'celltower_id', 'latitude', 'longitude', 'signal_type', 'signal_value', 'timestamp')
+NO_CELLTOWER = -1       # stored for a NULL celltower_id
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def month_directory(device_id, month):
+    return os.path.join(app.config['READINGS_ARCHIVE_DIR'], str(device_id), month.strftime('%Y-%m'))
+
+
+# The archived months of a device, oldest first
+def archived_months(device_id):
+    try:
+        names = os.listdir(os.path.join(app.config['READINGS_ARCHIVE_DIR'], str(device_id)))
+    except FileNotFoundError:
+        return []
+    months = []
+    for name in names:
+        try:
+            months.append(datetime.strptime(name, '%Y-%m').date())
+        except ValueError:
+            pass    # an interrupted export's temporary directory
+    return sorted(months)
+
+
+# Memory-mapped column arrays of one archived month, or None if it isn't archived
+def load_month(device_id, month):
+    directory = month_directory(device_id, month)
+    if not os.path.isdir(directory):
+        return None
+    return {column: np.load(os.path.join(directory, column + '.npy'), mmap_mode='r') for column in COLUMNS}
+
+
+# Column arrays of a device's archived readings with start <= timestamp < end (either may be
+# None for no limit), sorted by timestamp. Returns None if there are none.
+def load_readings(device_id, start=None, end=None):
+    parts = []
+    for month in archived_months(device_id):
+        month_begin = datetime(month.year, month.month, 1)
+        month_end = datetime.combine(next_month(month), datetime.min.time())
+        if (end is not None and month_begin >= end) or (start is not None and month_end <= start):
+            continue
+        columns = load_month(device_id, month)
+        if columns is None:
+            continue
+        timestamps = columns['timestamp']
+        first = 0 if start is None else np.searchsorted(timestamps, np.datetime64(start, 'us'), 'left')
+        last = len(timestamps) if end is None else np.searchsorted(timestamps, np.datetime64(end, 'us'), 'left')
+        if last > first:
+            parts.append({column: values[first:last] for column, values in columns.items()})
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return {column: np.concatenate([part[column] for part in parts]) for column in COLUMNS}
+
+
+# Number of readings and the distinct celltower_ids of a device's archived readings in a range
+def summary(device_id, start, end):
+    readings = load_readings(device_id, start, end)
+    if readings is None:
+        return 0, []
+    celltower_ids = np.unique(readings['celltower_id'])
+    return len(readings['timestamp']), [int(c) for c in celltower_ids if c != NO_CELLTOWER]
+
+
+# Bin the archived readings of devices in a range the way mapdata.reading_bin_query() does.
+# Returns {(x, y): [count, sum, min, max]}.
+def bins(device_ids, start, end, scale, bounds=None):
+    result = {}
+    for device_id in device_ids:
+        readings = load_readings(device_id, start, end)
+        if readings is None:
+            continue
+        latitude = readings['latitude'].astype(np.float64)
+        longitude = readings['longitude'].astype(np.float64)
+        values = np.asarray(readings['signal_value'], dtype=np.int64)
+        if bounds is not None:
+            south, west, north, east = bounds
+            inside = (latitude >= south) & (latitude <= north) & (longitude >= west) & (longitude <= east)
+            latitude, longitude, values = latitude[inside], longitude[inside], values[inside]
+        if len(values) == 0:
+            continue
+
+        cells = np.stack([np.floor(longitude * scale), np.floor(latitude * scale)], axis=1).astype(np.int64)
+        keys, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=values)
+        minimums = np.full(len(keys), np.iinfo(np.int64).max)
+        maximums = np.full(len(keys), np.iinfo(np.int64).min)
+        np.minimum.at(minimums, inverse, values)
+        np.maximum.at(maximums, inverse, values)
+
+        for (x, y), count, total, minimum, maximum in zip(keys.tolist(), counts.tolist(), sums.tolist(),
+                                                          minimums.tolist(), maximums.tolist()):
+            merge_bin(result, (x, y), [count, int(total), minimum, maximum])
+    return result
+
+
+def merge_bin(bins, key, values):
+    existing = bins.get(key)
+    if existing is None:
+        bins[key] = values
+    else:
+        existing[0] += values[0]
+        existing[1] += values[1]
+        existing[2] = min(existing[2], values[2])
+        existing[3] = max(existing[3], values[3])
+
+
+# A device's archived readings in a range as serialized dicts, in the format of
+# serialization.reading_projection, sorted by reading_id and limited to reading_id > after
+def items(device_id, start=None, end=None, after=None):
+    readings = load_readings(device_id, start, end)
+    if readings is None:
+        return []
+    order = np.argsort(readings['reading_id'], kind='stable')
+    if after is not None:
+        order = order[np.asarray(readings['reading_id'])[order] > after]
+
+    reading_ids = readings['reading_id'][order].tolist()
+    celltower_ids = readings['celltower_id'][order].tolist()
+    latitudes = readings['latitude'][order].tolist()
+    longitudes = readings['longitude'][order].tolist()
+    signal_types = readings['signal_type'][order].tolist()
+    signal_values = readings['signal_value'][order].tolist()
+    timestamps = readings['timestamp'][order].tolist()
+    return [{
+        'reading_id': reading_id,
+        'device_id': device_id,
+        'celltower_id': None if celltower_id == NO_CELLTOWER else celltower_id,
+        'latitude': latitude.decode(),
+        'longitude': longitude.decode(),
+        'signal_type': signal_type.decode(),
+        'signal_value': signal_value,
+        'timestamp': str(timestamp)
+    } for reading_id, celltower_id, latitude, longitude, signal_type, signal_value, timestamp
+        in zip(reading_ids, celltower_ids, latitudes, longitudes, signal_types, signal_values, timestamps)]
+
+
+# Column arrays for reading rows (reading_id, celltower_id, latitude, longitude, signal_type,
+# signal_value, timestamp) sorted by timestamp
+def to_columns(rows):
+    rows = sorted(rows, key=lambda row: (row[6], row[0]))
+    latitudes = [str(row[2]).encode() for row in rows]
+    longitudes = [str(row[3]).encode() for row in rows]
+    return {
+        'reading_id': np.array([row[0] for row in rows], dtype=np.int64),
+        'celltower_id': np.array([NO_CELLTOWER if row[1] is None else row[1] for row in rows], dtype=np.int64),
+        'latitude': np.array(latitudes, dtype='S{}'.format(max(map(len, latitudes)))),
+        'longitude': np.array(longitudes, dtype='S{}'.format(max(map(len, longitudes)))),
+        'signal_type': np.array([row[4].encode() for row in rows], dtype='S{}'.format(Reading.signal_type.type.length)),
+        'signal_value': np.array([row[5] for row in rows], dtype=np.int32),
+        'timestamp': np.array([row[6] for row in rows], dtype='datetime64[us]')
+    }
+
+
+def from_columns(columns):
+    return list(zip(columns['reading_id'].tolist(),
+                    [None if c == NO_CELLTOWER else c for c in columns['celltower_id'].tolist()],
+                    [v.decode() for v in columns['latitude'].tolist()],
+                    [v.decode() for v in columns['longitude'].tolist()],
+                    [v.decode() for v in columns['signal_type'].tolist()],
+                    columns['signal_value'].tolist(),
+                    columns['timestamp'].tolist()))
+
+
+# Write a device-month's readings, merged with any already archived for it. The new files are
+# written to a temporary directory and swapped in, so readers never see a partly written month.
+def write_month(device_id, month, rows):
+    directory = month_directory(device_id, month)
+    existing = load_month(device_id, month)
+    if existing is not None:
+        archived = {row[0]: row for row in from_columns(existing)}
+        archived.update((row[0], row) for row in rows)
+        rows = list(archived.values())
+
+    temporary = directory + '.new'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for column, values in to_columns(rows).items():
+        np.save(os.path.join(temporary, column + '.npy'), values)
+    if existing is not None:
+        os.rename(directory, directory + '.old')
+    os.rename(temporary, directory)
+    shutil.rmtree(directory + '.old', ignore_errors=True)
+
+
+# Move every whole month of readings before the month of cutoff out of the database, one
+# device-month at a time, each month being written to its files before its rows are deleted.
+# Returns the number of readings archived.
+def export(cutoff):
+    cutoff = datetime.combine(month_start(cutoff), datetime.min.time())
+    devices = db.session.query(Reading.device_id, func.min(Reading.timestamp)) \
+                .filter(Reading.timestamp < cutoff, Reading.device_id.isnot(None)) \
+                .group_by(Reading.device_id).all()
+    db.session.commit()
+
+    archived = 0
+    for device_id, first in devices:
+        month = month_start(first)
+        while month < cutoff.date():
+            start = datetime.combine(month, datetime.min.time())
+            end = datetime.combine(next_month(month), datetime.min.time())
+            in_month = Reading.query.filter(Reading.device_id == device_id,
+                                            Reading.timestamp >= start, Reading.timestamp < end)
+            rows = in_month.with_entities(*(getattr(Reading, column) for column in COLUMNS)).all()
+            if rows:
+                write_month(device_id, month, rows)
+                in_month.delete(synchronize_session=False)
+                db.session.commit()
+                archived += len(rows)
+            month = next_month(month)
+    return archived
+
+
+# Remove the archived readings of deleted devices
+def delete_devices(device_ids):
+    for device_id in device_ids:
+        shutil.rmtree(os.path.join(app.config['READINGS_ARCHIVE_DIR'], str(device_id)), ignore_errors=True)
+
+
+# Cutoff for 'flask archive export' when none is given: months that ended more than
+# READINGS_ARCHIVE_AFTER_DAYS days ago are archived
+def default_cutoff():
+    return month_start(date.today() - timedelta(days=app.config['READINGS_ARCHIVE_AFTER_DAYS']))
@@ -0,0 +1,92 @@
+from flask import abort, g
+from app import db
+from app.models import User, Device, Reading, CellTower
+
+
+# Ownership checks for the REST API.
+#
+# A non-admin level user may only touch devices, and the readings of devices, that belong to them.
+# Each loader here fetches the requested row together with the user_id of its owner in a single
+# query and compares that with the authenticated user already loaded into g.user, rather than
+# loading the device and its user one query at a time. They abort with 404 if the row doesn't
+# exist and with missing_owner if the row isn't attached to a user, or for a reading with
+# missing_device if it isn't attached to a device.
+
+
+# Abort with 403 unless g.user is an admin or the owner
+def check_owner(owner_id, missing_owner=409):
+    if g.user.role == "ADMIN":
+        return
+    if owner_id is None:
+        abort(missing_owner)
+    if owner_id != g.user.user_id:
+        abort(403)  # forbidden
+
+
+def owned_device(device_id, missing_owner=409):
+    device = Device.query.get(device_id)
+    if device is None:
+        abort(404)
+    check_owner(device.user_id, missing_owner)
+    return device
+
+
+# Returns the reading and the user_id of its device's owner
+def owned_reading(reading_id, missing_device=409, missing_owner=409):
+    row = db.session.query(Reading, Device.device_id, Device.user_id) \
+            .outerjoin(Device, Device.device_id == Reading.device_id) \
+            .filter(Reading.reading_id == reading_id) \
+            .one_or_none()
+    if row is None:
+        abort(404)
+    reading, device_id, owner_id = row
+    check_owner(owner_id, missing_device if device_id is None else missing_owner)
+    return reading, owner_id
+
+
+# The change_seq of a row, after the same checks as the loaders, without loading the row. Lets
+# conditional requests be answered from the version alone, see app/etags.py
+
+# A non-admin level user may only see their own user record
+def user_version(criterion):
+    row = db.session.query(User.email, User.change_seq).filter(criterion).one_or_none()
+    if row is None:
+        abort(404)
+    if g.user.role != "ADMIN" and row.email != g.user.email:
+        abort(403)  # forbidden
+    return row.change_seq
+
+
+def device_version(device_id, missing_owner=409):
+    row = db.session.query(Device.user_id, Device.change_seq).filter(Device.device_id == device_id).one_or_none()
+    if row is None:
+        abort(404)
+    check_owner(row.user_id, missing_owner)
+    return row.change_seq
+
+
+def reading_version(reading_id, missing_device=409, missing_owner=409):
+    row = db.session.query(Device.device_id, Device.user_id, Reading.change_seq) \
+            .select_from(Reading) \
+            .outerjoin(Device, Device.device_id == Reading.device_id) \
+            .filter(Reading.reading_id == reading_id) \
+            .one_or_none()
+    if row is None:
+        abort(404)
+    check_owner(row.user_id, missing_device if row.device_id is None else missing_owner)
+    return row.change_seq
+
+
+# Check that a new reading may be created for device_id and that celltower_id exists, in one
+# query. Aborts with 400 if either doesn't exist.
+def check_new_reading(device_id, celltower_id):
+    device_exists, owner_id, celltower_exists = db.session.query(
+        db.session.query(Device).filter(Device.device_id == device_id).exists(),
+        db.session.query(Device.user_id).filter(Device.device_id == device_id).scalar_subquery(),
+        db.session.query(CellTower).filter(CellTower.celltower_id == celltower_id).exists()
+    ).one()
+    if not device_exists:
+        abort(400)   # specified device_id does not exist
+    if not celltower_exists:
+        abort(400)   # specified celltower_id does not exist
+    check_owner(owner_id)
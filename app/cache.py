@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+# Bounded, thread safe LRU cache whose entries expire a fixed number of seconds after they
+# were stored. Hit and miss counters are kept so the benefit of each cache can be monitored.
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Return the cached value for key, or default if it is missing or has expired
+    def get(self, key, default=None):
+        value = self.peek(key, MISSING)
+        self.count(value is not MISSING)
+        return default if value is MISSING else value
+
+    # Like get, but without counting a hit or miss, for callers that have to check a cached value
+    # before it counts as a hit. They call count() once they know.
+    def peek(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+            return default
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # Store value against key, evicting the least recently used entry if the cache is full
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Remove a single entry
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    # Remove every entry whose value matches the predicate, returning how many were removed
+    def invalidate_if(self, predicate):
+        with self._lock:
+            stale = [key for key, (value, expires) in self._entries.items() if predicate(value)]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Snapshot of the counters for monitoring
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._entries)
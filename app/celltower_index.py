@@ -0,0 +1,202 @@
+from app import app, db, sync
+from app.models import CellTower, Tombstone
+import heapq
+import math
+import threading
+import time
+
+
+# In-process spatial index of celltower locations, for the nearest and within endpoints.
+#
+# Towers are bucketed into a grid of square cells CELLTOWER_INDEX_CELL_SIZE degrees across,
+# keyed on the cell's integer (x, y) position as in app/spatial.py, with x wrapping around at the
+# antimeridian. A bounding box query only visits the cells that overlap the box; a k-nearest
+# query searches rings of cells outwards from the point's cell until no unvisited cell can hold
+# anything nearer than the k-th tower found so far. Either way only a few cells' worth of towers
+# are looked at, however many there are in total.
+#
+# Each process builds its index from the celltower table on first use, then keeps it up to date
+# from the change sequence: at most every CELLTOWER_INDEX_REFRESH_INTERVAL seconds, or on the next
+# query after this process wrote a celltower, the towers with a newer change_seq are re-indexed
+# and the newer celltower tombstones removed, so towers written by other processes show up too.
+# Like a sync, a refresh only goes as far as sync.safe_change_seq(), so a write that commits after
+# one with a higher change_seq isn't skipped.
+# Only ids and coordinates are held; the towers themselves are read from the database by id.
+
+
+EARTH_RADIUS = 6371008.8        # metres, mean radius
+
+
+# Great circle distance between two points in metres
+def distance(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Position of a point on the unit sphere. The squared straight line distance between two of
+# these orders points the same as the great circle distance, for a fraction of the arithmetic.
+def unit_vector(lat, lng):
+    lat, lng = math.radians(lat), math.radians(lng)
+    return math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat)
+
+
+def chord_to_distance(squared_chord):
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+
+def distance_to_chord(metres):
+    return (2 * math.sin(min(math.pi, metres / EARTH_RADIUS) / 2)) ** 2
+
+
+class GridIndex:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.columns = int(round(360 / cell_size))      # cells around a line of latitude
+        self.cells = {}         # (x, y) -> {celltower_id: (lat, lng, unit vector x, y, z)}
+        self.positions = {}     # celltower_id -> (x, y)
+
+    def cell(self, lat, lng):
+        return int(math.floor(lng / self.cell_size)) % self.columns, int(math.floor(lat / self.cell_size))
+
+    def add(self, celltower_id, lat, lng):
+        self.remove(celltower_id)
+        key = self.cell(lat, lng)
+        self.cells.setdefault(key, {})[celltower_id] = (lat, lng) + unit_vector(lat, lng)
+        self.positions[celltower_id] = key
+
+    def remove(self, celltower_id):
+        key = self.positions.pop(celltower_id, None)
+        if key is not None:
+            cell = self.cells[key]
+            del cell[celltower_id]
+            if not cell:
+                del self.cells[key]
+
+    def __len__(self):
+        return len(self.positions)
+
+    # Ids of the towers inside a bounding box, sorted. west > east for a box that crosses the
+    # antimeridian.
+    def within(self, south, west, north, east):
+        crosses = west > east
+        first_y, last_y = self.cell(south, 0)[1], self.cell(north, 0)[1]
+        first_x = int(math.floor(west / self.cell_size))
+        last_x = int(math.floor(east / self.cell_size)) + (self.columns if crosses else 0)
+        width = min(last_x - first_x + 1, self.columns)
+
+        # For boxes covering more cells than are in use, checking the cells in use is quicker
+        if width * (last_y - first_y + 1) > len(self.cells):
+            keys = [key for key in self.cells if first_y <= key[1] <= last_y]
+        else:
+            keys = [((first_x + i) % self.columns, y) for i in range(width) for y in range(first_y, last_y + 1)]
+
+        found = []
+        for key in keys:
+            for celltower_id, (lat, lng, _, _, _) in self.cells.get(key, {}).items():
+                if south <= lat <= north and ((west <= lng or lng <= east) if crosses else west <= lng <= east):
+                    found.append(celltower_id)
+        return sorted(found)
+
+    # The k towers nearest a point as (distance in metres, celltower_id), nearest first
+    def nearest(self, lat, lng, k):
+        x, y = self.cell(lat, lng)
+        point_x, point_y, point_z = unit_vector(lat, lng)
+        best = []       # heap of (-squared chord, -celltower_id) of the k nearest so far
+        ring = 0
+        while True:
+            # Once the search has grown past the number of cells in use, finish with all of them
+            everything = (2 * ring + 1) ** 2 > len(self.cells) or 2 * ring + 1 >= self.columns
+            if everything:
+                best = []
+                keys = list(self.cells)
+            else:
+                keys = self.ring(x, y, ring)
+            for key in keys:
+                for celltower_id, (_, _, tower_x, tower_y, tower_z) in self.cells.get(key, {}).items():
+                    dx, dy, dz = tower_x - point_x, tower_y - point_y, tower_z - point_z
+                    candidate = (-(dx * dx + dy * dy + dz * dz), -celltower_id)
+                    if len(best) < k:
+                        heapq.heappush(best, candidate)
+                    elif candidate > best[0]:
+                        heapq.heapreplace(best, candidate)
+            if everything or (len(best) == k and distance_to_chord(self.unvisited_distance(lat, ring)) >= -best[0][0]):
+                break
+            ring += 1
+        return sorted((chord_to_distance(-c), -celltower_id) for c, celltower_id in best)
+
+    # The cells of the square ring at distance ring from (x, y)
+    def ring(self, x, y, ring):
+        if ring == 0:
+            return [(x, y)]
+        keys = []
+        for i in range(-ring, ring + 1):
+            keys.append(((x + i) % self.columns, y - ring))
+            keys.append(((x + i) % self.columns, y + ring))
+        for j in range(-ring + 1, ring):
+            keys.append(((x - ring) % self.columns, y + j))
+            keys.append(((x + ring) % self.columns, y + j))
+        return keys
+
+    # A lower bound on the distance from a point at lat to any tower outside the rings up to ring.
+    # Such a tower is at least ring cells away in latitude, or else within (ring + 1) cells of
+    # lat and at least ring cells away in longitude, where the haversine formula gives
+    # hav(d) >= cos(max lat)^2 * hav(dlng).
+    def unvisited_distance(self, lat, ring):
+        delta = math.radians(ring * self.cell_size)
+        highest = math.radians(min(90.0, abs(lat) + (ring + 1) * self.cell_size))
+        across = 2 * math.asin(min(1.0, math.cos(highest) * math.sin(min(delta, math.pi) / 2)))
+        return EARTH_RADIUS * min(delta, across)
+
+
+index = None
+seen = 0            # highest change_seq applied to the index
+checked = 0.0       # time.monotonic() of the last refresh
+lock = threading.Lock()
+
+
+# Bring the index up to date if it is due a refresh. Called with the lock held.
+def refresh():
+    global index, seen, checked
+    now = time.monotonic()
+    if index is not None and now - checked < app.config['CELLTOWER_INDEX_REFRESH_INTERVAL']:
+        return
+    # Taken before reading, so writes made meanwhile are applied again by the next refresh
+    safe = sync.safe_change_seq()
+    if index is None:
+        rows = db.session.query(CellTower.celltower_id, CellTower.latitude, CellTower.longitude).all()
+        built = GridIndex(app.config['CELLTOWER_INDEX_CELL_SIZE'])
+        for celltower_id, lat, lng in rows:
+            built.add(celltower_id, float(lat), float(lng))
+        index, seen = built, safe
+    elif safe > seen:
+        rows = db.session.query(CellTower.celltower_id, CellTower.latitude, CellTower.longitude) \
+                .filter(CellTower.change_seq > seen, CellTower.change_seq <= safe).all()
+        deleted = db.session.query(Tombstone.row_id) \
+                .filter(Tombstone.table_name == CellTower.__tablename__,
+                        Tombstone.change_seq > seen, Tombstone.change_seq <= safe).all()
+        for celltower_id, lat, lng in rows:
+            index.add(celltower_id, float(lat), float(lng))
+        for (celltower_id,) in deleted:
+            index.remove(celltower_id)
+        seen = safe
+    checked = now
+
+
+# Called after this process creates, updates or deletes celltowers, so its next query sees them
+def changed():
+    global checked
+    with lock:
+        checked = float('-inf')
+
+
+def nearest(lat, lng, k):
+    with lock:
+        refresh()
+        return index.nearest(lat, lng, k)
+
+
+def within(south, west, north, east):
+    with lock:
+        refresh()
+        return index.within(south, west, north, east)
@@ -0,0 +1,104 @@
+from flask.cli import AppGroup
+from app import app, db
+from app import rollups, partitions, archive, opencellid, purge
+import click
+
+
+# Flask CLI commands, run with e.g. 'flask rollups rebuild'
+
+
+rollups_cli = AppGroup('rollups', help='Maintain the daily reading rollups.')
+
+
+@rollups_cli.command('rebuild')
+def rebuild_rollups():
+    """Recreate every reading rollup from the raw readings."""
+    count = rollups.rebuild()
+    click.echo('Rebuilt {} rollup rows'.format(count))
+
+
+partitions_cli = AppGroup('partitions', help='Manage the monthly partitions of the reading table (Postgres only).')
+
+
+def require_postgres():
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('Reading partitions need Postgres, not {}'.format(db.engine.dialect.name))
+
+
+def require_partitioned():
+    require_postgres()
+    if not partitions.is_partitioned():
+        raise click.ClickException("The reading table isn't partitioned, run 'flask partitions convert' first")
+
+
+@partitions_cli.command('convert')
+def convert_partitions():
+    """Convert the reading table into monthly partitions."""
+    require_postgres()
+    if partitions.is_partitioned():
+        raise click.ClickException('The reading table is already partitioned')
+    copied = partitions.convert(app.config['READINGS_PARTITION_MONTHS_AHEAD'])
+    click.echo('Copied {} readings into {} partitions'.format(copied, len(partitions.partition_months())))
+
+
+@partitions_cli.command('maintain')
+def maintain_partitions():
+    """Create upcoming partitions and drop those past the retention period."""
+    require_partitioned()
+    for month in partitions.create_ahead(app.config['READINGS_PARTITION_MONTHS_AHEAD']):
+        click.echo('Created {}'.format(partitions.partition_name(month)))
+    retention = app.config['READINGS_RETENTION_MONTHS']
+    if retention is not None:
+        for month in partitions.drop_expired(retention):
+            click.echo('Dropped {}'.format(partitions.partition_name(month)))
+
+
+@partitions_cli.command('list')
+def list_partitions():
+    """List the reading partitions."""
+    require_partitioned()
+    for month in partitions.partition_months():
+        click.echo(partitions.partition_name(month))
+
+
+archive_cli = AppGroup('archive', help='Move old readings out of the database into archive files.')
+
+
+@archive_cli.command('export')
+@click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Archive the whole months before the month of this date (default: READINGS_ARCHIVE_AFTER_DAYS ago).')
+def export_archive(before):
+    """Archive whole months of readings and delete them from the database."""
+    cutoff = before.date() if before is not None else archive.default_cutoff()
+    count = archive.export(cutoff)
+    click.echo('Archived {} readings from before {}'.format(count, archive.month_start(cutoff)))
+
+
+opencellid_cli = AppGroup('opencellid', help='Manage the offline copy of the OpenCellID cell database.')
+
+
+@opencellid_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', type=int, default=1000000, show_default=True,
+              help='CSV rows parsed per batch, bounding the memory used.')
+def import_opencellid(path, chunk_size):
+    """Replace the offline cell database with an OpenCellID CSV dump (.csv or .csv.gz)."""
+    imported, skipped = opencellid.import_dump(path, chunk_size)
+    click.echo('Imported {} cells, skipped {} unusable rows'.format(imported, skipped))
+
+
+purge_cli = AppGroup('purge', help='Manage background deletes of users and devices.')
+
+
+@purge_cli.command('resume')
+def resume_purges():
+    """Finish the purges left running by a process that exited."""
+    count = purge.resume()
+    click.echo('Resumed {} purges'.format(count))
+
+
+app.cli.add_command(rollups_cli)
+app.cli.add_command(partitions_cli)
+app.cli.add_command(archive_cli)
+app.cli.add_command(opencellid_cli)
+app.cli.add_command(purge_cli)
@@ -0,0 +1,99 @@
+from app import db
+from sqlalchemy import event, func, select, and_, BigInteger, DDL
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+import sqlite3
+
+
+# Helpers for the few statements that need database specific SQL. Postgres is what the app
+# runs on; SQLite is supported as well so the benchmarks can run against a local file.
+
+
+def is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+
+# SQLite only enforces foreign keys, and so only cascades deletes along them, when each
+# connection asks it to
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+# INSERT construct for table supporting .on_conflict_do_update() / .on_conflict_do_nothing()
+def upsert(table):
+    if is_sqlite():
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+# Smaller / larger of two values (SQLite spells these as the multi-argument forms of min and max)
+def least(a, b):
+    if is_sqlite():
+        return func.min(a, b)
+    return func.least(a, b)
+
+
+def greatest(a, b):
+    if is_sqlite():
+        return func.max(a, b)
+    return func.greatest(a, b)
+
+
+# Insert a row made of values unless one with the same values for the unique key_columns already
+# exists, atomically, and return the stored row's columns. On Postgres this is one round trip:
+# a no-op ON CONFLICT DO UPDATE, so RETURNING also yields the existing row. SQLAlchemy has no
+# RETURNING for SQLite, so there the conflict is ignored and the row is selected afterwards.
+def insert_or_select(table, values, key_columns, columns):
+    insert = upsert(table).values(**values)
+    if is_sqlite():
+        db.session.execute(insert.on_conflict_do_nothing(index_elements=key_columns))
+        key = and_(*(table.c[name] == values[name] for name in key_columns))
+        return db.session.execute(select(*columns).where(key)).one()
+    insert = insert.on_conflict_do_update(index_elements=key_columns,
+                                          set_={key_columns[0]: insert.excluded[key_columns[0]]})
+    return db.session.execute(insert.returning(*columns)).one()
+
+
+# Next value of the change sequence shared by every synced table (see app/sync.py), used as the
+# default and onupdate of their change_seq columns. On Postgres it is the change_seq sequence,
+# taken through the next_change_seq() function below. SQLite has no sequences, but it only
+# allows one writer at a time, so one more than the highest change_seq in use is just as good
+# there.
+class next_change_seq(FunctionElement):
+    type = BigInteger()
+    inherit_cache = True
+
+
+CHANGE_SEQ_TABLES = ('"user"', 'device', 'reading', 'celltower', 'tombstone')
+
+# The transaction is given its id before it takes a value from the sequence, so every
+# change_seq handed out belongs to a transaction that shows up in snapshots taken from then on,
+# which is what sync.safe_change_seq() relies on. Created by migration 5e1f0b9c7a24, or with
+# the schema by create_all().
+NEXT_CHANGE_SEQ_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION next_change_seq() RETURNS bigint LANGUAGE plpgsql VOLATILE AS $$
+BEGIN
+    PERFORM txid_current();
+    RETURN nextval('change_seq');
+END
+$$
+""")
+event.listen(db.metadata, 'after_create', NEXT_CHANGE_SEQ_FUNCTION.execute_if(dialect='postgresql'))
+
+
+@compiles(next_change_seq)
+def compile_next_change_seq(element, compiler, **kw):
+    return 'next_change_seq()'
+
+
+@compiles(next_change_seq, 'sqlite')
+def compile_next_change_seq_sqlite(element, compiler, **kw):
+    highest = ' UNION ALL '.join('SELECT max(change_seq) AS change_seq FROM {}'.format(table)
+                                 for table in CHANGE_SEQ_TABLES)
+    return '(SELECT coalesce(max(change_seq), 0) + 1 FROM ({}))'.format(highest)
@@ -0,0 +1,61 @@
+from flask import Response, request, abort
+from app import db
+from app.models import Tombstone
+from app.dialects import greatest
+from sqlalchemy import func
+
+
+# Conditional requests for the REST API.
+#
+# A row's ETag is its change_seq (see app/sync.py): the sequence is shared by every synced
+# table and moves on with every write, so it identifies one version of one row. The celltower
+# list is tagged with the table's version, the highest change_seq of its rows and of its
+# tombstones, which moves on with every insert, update and delete through the API.
+#
+# GETs answer a matching If-None-Match with 304 after the usual ownership checks but before
+# loading or serializing anything, from a query of just the version. PUT and DELETE honour
+# If-Match for optimistic concurrency: a client that read a row can update or delete it only if
+# nobody else has written it since, and gets 412 otherwise.
+
+
+# Response for a GET whose If-None-Match matches the version, or None if it doesn't (or the
+# request isn't conditional) and the full response is needed
+def not_modified(version):
+    if not request.if_none_match.contains_weak(str(version)):
+        return None
+    response = Response(status=304)
+    response.set_etag(str(version))
+    return response
+
+
+def tagged(response, version):
+    response.set_etag(str(version))
+    return response
+
+
+# The change_seq of a row, aborting with 404 if it doesn't exist
+def version(model, row_id):
+    primary_key = model.__mapper__.primary_key[0]
+    change_seq = db.session.query(model.change_seq).filter(primary_key == row_id).scalar()
+    if change_seq is None:
+        abort(404)
+    return change_seq
+
+
+def table_version(model):
+    rows = db.session.query(func.max(model.change_seq)).scalar_subquery()
+    deleted = db.session.query(func.max(Tombstone.change_seq)) \
+                .filter(Tombstone.table_name == model.__tablename__).scalar_subquery()
+    return db.session.query(greatest(func.coalesce(rows, 0), func.coalesce(deleted, 0))).scalar()
+
+
+# For PUT and DELETE: abort with 412 unless the request has no If-Match or it matches the row's
+# current version. The row is locked (on Postgres) until the request commits, so it can't be
+# written by anyone else between the check and this request's own write.
+def check_if_match(model, row_id):
+    if not request.if_match:
+        return
+    primary_key = model.__mapper__.primary_key[0]
+    change_seq = db.session.query(model.change_seq).filter(primary_key == row_id).with_for_update().scalar()
+    if change_seq is None or not request.if_match.contains(str(change_seq)):
+        abort(412)  # precondition failed, the row has changed since the client read it
@@ -0,0 +1,172 @@
+from app import app, db, metrics, opencellid
+from app.models import CellTowerLocation
+from app.cache import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+import threading
+import time
+import requests
+
+
+# Celltower geolocation lookups for the map view.
+#
+# Locations are resolved in tiers, cheapest first:
+#   1. an in-process LRU of recently resolved towers
+#   2. the offline copy of an OpenCellID dump, if one has been imported (see app/opencellid.py),
+#      all the remaining towers in one lookup without touching the network
+#   3. the celltower_location table, which persists every OpenCellID answer (including
+#      'not found' answers, which are retried after CELLTOWER_LOCATION_NEGATIVE_TTL)
+#   4. the OpenCellID api, with all remaining towers looked up concurrently on a bounded pool
+#
+# Towers are identified by (mcc, mnc, lac, cellid) as that is what OpenCellID is keyed on.
+
+
+# Marker stored in the LRU for towers that OpenCellID doesn't know about
+NOT_FOUND = 'not found'
+
+location_cache = TTLCache(app.config['CELLTOWER_LOCATION_CACHE_SIZE'], app.config['CELLTOWER_LOCATION_CACHE_TTL'])
+lookup_pool = ThreadPoolExecutor(max_workers=app.config['OPENCELLID_MAX_WORKERS'],
+                                 thread_name_prefix='opencellid')
+
+# Each pool thread keeps its own http session so connections to OpenCellID are reused
+thread_local = threading.local()
+
+metrics.register(metrics.Gauge('signaltracker_celltower_location_cache_hits_total',
+                               'Celltower locations served from the in-process cache.',
+                               lambda: location_cache.hits, type='counter'))
+metrics.register(metrics.Gauge('signaltracker_celltower_location_cache_misses_total',
+                               'Celltower locations not in the in-process cache.',
+                               lambda: location_cache.misses, type='counter'))
+
+
+def celltower_key(celltower):
+    return (celltower.mobile_country_code, celltower.mobile_network_code,
+            celltower.location_area_code, celltower.celltower_name)
+
+
+# Resolve the location of each of the given celltowers (anything with the CellTower network
+# identifier attributes). Returns a dict of celltower_key -> (lat, lng) for the towers that
+# could be located; towers that are unknown or whose lookup failed are left out.
+def locate_celltowers(celltowers):
+    keys = {celltower_key(c) for c in celltowers}
+    locations = {}
+
+    # 1. In-process cache
+    misses = []
+    for key in keys:
+        location = location_cache.get(key)
+        if location is None:
+            misses.append(key)
+        elif location is not NOT_FOUND:
+            locations[key] = location
+
+    # 2. Offline OpenCellID database
+    if misses:
+        offline = opencellid.lookup(misses)
+        for key, location in offline.items():
+            locations[key] = location
+            location_cache.set(key, location)
+        misses = [key for key in misses if key not in offline]
+
+    # 3. Persistent cache
+    stored = {}
+    if misses:
+        stored = load_stored_locations(misses)
+    negative_cutoff = datetime.utcnow() - timedelta(seconds=app.config['CELLTOWER_LOCATION_NEGATIVE_TTL'])
+    to_fetch = []
+    for key in misses:
+        row = stored.get(key)
+        if row is None or (not row.found and row.timestamp < negative_cutoff):
+            to_fetch.append(key)
+        elif row.found:
+            locations[key] = (float(row.latitude), float(row.longitude))
+            location_cache.set(key, locations[key])
+        else:
+            location_cache.set(key, NOT_FOUND)
+
+    # 4. OpenCellID, concurrently
+    if to_fetch:
+        url = app.config['OPENCELLID_URL']
+        api_key = app.config['OPENCELLID_API_KEY']
+        timeout = app.config['OPENCELLID_TIMEOUT']
+        fetched = lookup_pool.map(lambda key: fetch_location(url, api_key, timeout, key), to_fetch)
+        resolved = {}
+        for key, location in zip(to_fetch, fetched):
+            if location is None:
+                continue    # transient failure, try again next time
+            resolved[key] = location
+            location_cache.set(key, location)
+            if location is not NOT_FOUND:
+                locations[key] = location
+        store_locations(resolved, stored)
+
+    return locations
+
+
+def load_stored_locations(keys):
+    key_columns = tuple_(CellTowerLocation.mobile_country_code, CellTowerLocation.mobile_network_code,
+                         CellTowerLocation.location_area_code, CellTowerLocation.celltower_name)
+    rows = CellTowerLocation.query.filter(key_columns.in_(keys)).all()
+    return {celltower_key(row): row for row in rows}
+
+
+# Save newly resolved locations, updating the stale negative entries we already loaded.
+# Another request may have stored the same towers in the meantime, in which case our
+# copy is simply discarded.
+def store_locations(resolved, stored):
+    for key, location in resolved.items():
+        row = stored.get(key)
+        if row is None:
+            row = CellTowerLocation(mobile_country_code=key[0], mobile_network_code=key[1],
+                                    location_area_code=key[2], celltower_name=key[3])
+            db.session.add(row)
+        row.found = location is not NOT_FOUND
+        row.latitude = location[0] if row.found else None
+        row.longitude = location[1] if row.found else None
+        row.timestamp = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+
+
+# Look up a single celltower with OpenCellID. Returns (lat, lng), NOT_FOUND if OpenCellID
+# doesn't know the cell, or None if the lookup failed and should be retried later.
+def fetch_location(url, api_key, timeout, key):
+    session = getattr(thread_local, 'session', None)
+    if session is None:
+        session = thread_local.session = requests.Session()
+
+    query = {
+        "key": api_key,
+        "mcc": key[0],
+        "mnc": key[1],
+        "lac": key[2],
+        "cellid": key[3],
+        "format": "json"
+    }
+    start = time.perf_counter()
+    location = parse_location(session, url, query, timeout)
+    result = 'error' if location is None else 'not_found' if location is NOT_FOUND else 'found'
+    metrics.opencellid_request_seconds.observe(time.perf_counter() - start, result)
+    return location
+
+
+def parse_location(session, url, query, timeout):
+    try:
+        response = session.get(url, params=query, timeout=timeout)
+        if response.status_code == 404:
+            return NOT_FOUND
+        if response.status_code != 200:
+            return None
+        location = response.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+    if 'lat' in location and 'lon' in location:
+        return (float(location['lat']), float(location['lon']))
+    if location.get('code') == 1:   # OpenCellID error code for 'cell not found'
+        return NOT_FOUND
+    return None
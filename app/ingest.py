@@ -0,0 +1,132 @@
+from app import app, db, metrics
+from app.models import Reading
+from app.rollups import add_readings
+from collections import deque
+import atexit
+import threading
+import time
+
+
+# Write-behind ingestion of new readings, used when READINGS_INGEST_MODE is 'queue'.
+#
+# The REST API validates new readings as usual, then hands their column values to submit() and
+# answers 202 without waiting for the database. A single writer thread takes them off the
+# queue and inserts them, together with their rollups, in one transaction per batch. A batch is
+# written once READINGS_INGEST_BATCH readings are waiting or the oldest waiting reading has been
+# queued for READINGS_INGEST_INTERVAL seconds, whichever comes first.
+#
+# The queue holds at most READINGS_INGEST_QUEUE_SIZE readings. submit() refuses readings that
+# don't fit, which the API turns into 429 so phones back off and retry rather than the process
+# buffering without limit while the database is slow. Readings still queued when the process
+# exits are written by an atexit handler; a process that is killed loses them.
+
+
+pending = deque()
+condition = threading.Condition()
+writer = None
+stopping = False
+
+queue_depth = metrics.register(metrics.Gauge(
+    'signaltracker_ingest_queue_depth', 'Readings waiting to be written by the ingest writer.', lambda: len(pending)))
+flush_seconds = metrics.register(metrics.Histogram(
+    'signaltracker_ingest_flush_duration_seconds', 'Time taken to write a batch of queued readings.'))
+flush_readings = metrics.register(metrics.Histogram(
+    'signaltracker_ingest_flush_readings', 'Readings written per batch by the ingest writer.',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)))
+dropped_readings = metrics.register(metrics.Counter(
+    'signaltracker_ingest_dropped_readings_total', 'Queued readings that could not be written.'))
+
+
+# Queue reading rows (dicts of Reading column values) to be written. Either all of them are
+# queued or, if there isn't room, none are and False is returned.
+def submit(rows):
+    with condition:
+        if stopping or len(pending) + len(rows) > app.config['READINGS_INGEST_QUEUE_SIZE']:
+            return False
+        start_writer()
+        now = time.monotonic()
+        pending.extend((now, row) for row in rows)
+        if len(pending) >= app.config['READINGS_INGEST_BATCH']:
+            condition.notify()
+    return True
+
+
+# Start the writer thread on first use, so processes that never ingest (the CLI, migrations)
+# don't run one. Called with the condition held.
+def start_writer():
+    global writer
+    if writer is None:
+        writer = threading.Thread(target=run_writer, name='ingest-writer', daemon=True)
+        writer.start()
+
+
+def run_writer():
+    while True:
+        rows = next_batch()
+        if rows is None:
+            return
+        # Whatever goes wrong the writer must carry on, or the queue would only ever fill up
+        try:
+            write_batch(rows)
+        except Exception:
+            app.logger.exception('Ingest writer failed')
+
+
+# Wait until a batch is due and take it off the queue. Returns None once stop() has been called
+# and the queue is empty.
+def next_batch():
+    batch_size = app.config['READINGS_INGEST_BATCH']
+    interval = app.config['READINGS_INGEST_INTERVAL']
+    with condition:
+        while True:
+            if pending:
+                wait = pending[0][0] + interval - time.monotonic()
+                if stopping or len(pending) >= batch_size or wait <= 0:
+                    return [pending.popleft()[1] for _ in range(min(batch_size, len(pending)))]
+                condition.wait(wait)
+            elif stopping:
+                return None
+            else:
+                condition.wait()
+
+
+# Insert a batch of readings and their rollups in one transaction. If the batch fails, e.g.
+# because a device was deleted after its reading was queued, the readings are retried one at a
+# time so only the bad ones are lost.
+def write_batch(rows):
+    start = time.perf_counter()
+    with app.app_context():
+        try:
+            insert(rows)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Writing %d queued readings failed, retrying them one at a time', len(rows))
+            for row in rows:
+                try:
+                    insert([row])
+                except Exception:
+                    db.session.rollback()
+                    dropped_readings.inc()
+                    app.logger.exception('Dropped queued reading %r', row)
+        finally:
+            db.session.remove()
+    flush_seconds.observe(time.perf_counter() - start)
+    flush_readings.observe(len(rows))
+
+
+def insert(rows):
+    db.session.execute(Reading.__table__.insert(), rows)
+    add_readings(rows)
+    db.session.commit()
+
+
+# Write everything still queued and stop the writer
+@atexit.register
+def stop():
+    global stopping
+    with condition:
+        stopping = True
+        condition.notify()
+        thread = writer
+    if thread is not None:
+        thread.join()
@@ -0,0 +1,38 @@
+from app import app
+from flask_sqlalchemy import BaseQuery
+
+
+# Loading of the one-to-many relationships on the models.
+#
+# A user's devices, and far more so a device's or a celltower's readings, can run to any number
+# of rows, so these relationships are lazy='dynamic': device.readings is a query to filter,
+# count, limit or paginate rather than a list that is loaded, and sorted, in full the first time
+# anything touches it. Deleting the parent doesn't load them either (passive_deletes).
+#
+# Iterating one of these queries, or calling .all() on it, without a limit would still load
+# every row, so they are BoundedQuerys, which raise UnboundedLoadError for that when
+# RAISE_ON_UNBOUNDED_LOADS is set or the app is testing, and log a warning otherwise.
+# count(), first(), paginate() and anything with .limit() are fine.
+
+
+class UnboundedLoadError(Exception):
+    pass
+
+
+class BoundedQuery(BaseQuery):
+    def __iter__(self):
+        self.check_bounded()
+        return super().__iter__()
+
+    # Through __iter__, so the load is checked (and logged) once whichever way it is made
+    def all(self):
+        return list(self)
+
+    def check_bounded(self):
+        if self._limit_clause is not None:
+            return
+        message = 'Unbounded load of {}, add a limit or paginate'.format(
+            ', '.join(str(entity['name']) for entity in self.column_descriptions))
+        if app.config['RAISE_ON_UNBOUNDED_LOADS'] or app.testing:
+            raise UnboundedLoadError(message)
+        app.logger.warning(message)
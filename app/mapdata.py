@@ -0,0 +1,91 @@
+from app import db, archive
+from app.models import Device, Reading, ReadingRollup
+from app.spatial import cells_per_degree, cell_bounds, grid_cell, ROLLUP_ZOOM
+from datetime import time
+from sqlalchemy import func, cast, Integer
+
+
+# Readings for the map view, binned server side into the grid from app/spatial.py so the browser
+# draws one shape per occupied cell instead of one per reading. The binning is a single GROUP BY
+# in the database; only the per-cell aggregates are returned.
+#
+# Whole days viewed at ROLLUP_ZOOM or further out are answered from the daily rollups, whose
+# cells nest exactly into the coarser grids, so the cost doesn't depend on the number of raw
+# readings. Closer zoom levels bin the raw readings, both those in the database and any that
+# have been archived (see app/archive.py).
+
+
+# Bin the readings of all of a user's devices between start (inclusive) and end (exclusive) at
+# the given zoom level, optionally limited to a (south, west, north, east) bounding box.
+# Returns a list of dicts with the cell's south west corner, size and signal_value statistics.
+def reading_bins(user_id, start, end, zoom, bounds=None):
+    if zoom <= ROLLUP_ZOOM and start.time() == time() and end.time() == time():
+        cells = {(x, y): [count, total, minimum, maximum]
+                 for x, y, count, total, minimum, maximum in rollup_bin_query(user_id, start, end, zoom, bounds)}
+    else:
+        # Readings moved out to the archive files are binned there and added in
+        device_ids = [device_id for (device_id,) in Device.query.with_entities(Device.device_id)
+                                                          .filter(Device.user_id == user_id)]
+        cells = archive.bins(device_ids, start, end, cells_per_degree(zoom), bounds)
+        for x, y, count, total, minimum, maximum in reading_bin_query(user_id, start, end, zoom, bounds):
+            archive.merge_bin(cells, (x, y), [count, total, minimum, maximum])
+
+    bins = []
+    for (x, y), (count, total, minimum, maximum) in cells.items():
+        lat, lng, size = cell_bounds(x, y, zoom)
+        bins.append({
+            'lat': lat,
+            'lng': lng,
+            'size': size,
+            'count': count,
+            'mean': round(float(total) / count, 2),
+            'min': minimum,
+            'max': maximum
+        })
+    return bins
+
+
+def reading_bin_query(user_id, start, end, zoom, bounds):
+    scale = cells_per_degree(zoom)
+    cell_x = grid_cell(Reading.longitude, scale).label('x')
+    cell_y = grid_cell(Reading.latitude, scale).label('y')
+
+    query = db.session.query(
+                cell_x,
+                cell_y,
+                func.count(Reading.signal_value),
+                func.sum(Reading.signal_value),
+                func.min(Reading.signal_value),
+                func.max(Reading.signal_value)) \
+            .join(Device, Device.device_id == Reading.device_id) \
+            .filter(Device.user_id == user_id, Reading.timestamp >= start, Reading.timestamp < end)
+    if bounds is not None:
+        south, west, north, east = bounds
+        query = query.filter(Reading.latitude >= south, Reading.latitude <= north,
+                             Reading.longitude >= west, Reading.longitude <= east)
+    return query.group_by(cell_x, cell_y)
+
+
+def rollup_bin_query(user_id, start, end, zoom, bounds):
+    # Each cell at this zoom is made up of factor x factor rollup cells
+    factor = float(2 ** (ROLLUP_ZOOM - zoom))
+    cell_x = cast(func.floor(ReadingRollup.cell_x / factor), Integer).label('x')
+    cell_y = cast(func.floor(ReadingRollup.cell_y / factor), Integer).label('y')
+
+    query = db.session.query(
+                cell_x,
+                cell_y,
+                func.sum(ReadingRollup.count),
+                func.sum(ReadingRollup.sum),
+                func.min(ReadingRollup.min),
+                func.max(ReadingRollup.max)) \
+            .join(Device, Device.device_id == ReadingRollup.device_id) \
+            .filter(Device.user_id == user_id, ReadingRollup.day >= start.date(), ReadingRollup.day < end.date())
+    if bounds is not None:
+        south, west, north, east = bounds
+        scale = cells_per_degree(ROLLUP_ZOOM)
+        query = query.filter(ReadingRollup.cell_y >= grid_cell(south, scale),
+                             ReadingRollup.cell_y <= grid_cell(north, scale),
+                             ReadingRollup.cell_x >= grid_cell(west, scale),
+                             ReadingRollup.cell_x <= grid_cell(east, scale))
+    return query.group_by(cell_x, cell_y)
@@ -0,0 +1,218 @@
+from flask import Response, request, g, abort, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from app import app
+from bisect import bisect_left
+import hmac
+import threading
+import time
+
+
+# Request level metrics, exposed at /metrics in the Prometheus text format.
+#
+# Recording is meant to stay switched on in production: every metric has its buckets allocated
+# up front, an observation is a bisect and a couple of additions under the metric's own lock,
+# and nothing is formatted until /metrics is scraped.
+#
+# /metrics is only served with METRICS_TOKEN set, to scrapers that send it as a bearer token.
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('{}="{}"'.format(name, value))
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name + format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    # Count the observation in the first bucket whose upper bound holds it; buckets are
+    # only made cumulative when rendered
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [per bucket counts..., +Inf count, sum]
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(label_values, list(values)) for label_values, values in self._series.items()]
+        bucket_labels = self.labels + ('le',)
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                yield self.name + '_bucket' + format_labels(bucket_labels, label_values + (format_value(bound),)), cumulative
+            yield self.name + '_sum' + format_labels(self.labels, label_values), values[-1]
+            yield self.name + '_count' + format_labels(self.labels, label_values), cumulative
+
+
+# Metric whose value is read from a callable when metrics are scraped, e.g. a queue length, or
+# with type='counter' a running total kept elsewhere such as a cache's hit count
+class Gauge:
+    def __init__(self, name, help, read, type='gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.type = type
+
+    def samples(self):
+        yield self.name, self.read()
+
+
+registry = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append('# HELP {} {}'.format(metric.name, metric.help))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+        for name, value in metric.samples():
+            lines.append('{} {}'.format(name, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+http_requests = register(Counter(
+    'signaltracker_http_requests_total', 'HTTP requests by endpoint, method and status code.',
+    labels=('endpoint', 'method', 'status')))
+http_request_seconds = register(Histogram(
+    'signaltracker_http_request_duration_seconds', 'Time taken to handle HTTP requests.',
+    labels=('endpoint', 'method')))
+http_request_sql_statements = register(Histogram(
+    'signaltracker_http_request_sql_statements', 'SQL statements executed per HTTP request.',
+    buckets=COUNT_BUCKETS, labels=('endpoint', 'method')))
+http_request_sql_seconds = register(Histogram(
+    'signaltracker_http_request_sql_duration_seconds', 'Total time spent executing SQL per HTTP request.',
+    labels=('endpoint', 'method')))
+sql_statement_seconds = register(Histogram(
+    'signaltracker_sql_statement_duration_seconds', 'Time taken by individual SQL statements.'))
+db_pool_checkout_seconds = register(Histogram(
+    'signaltracker_db_pool_checkout_wait_seconds', 'Time spent waiting to check a connection out of the pool.'))
+opencellid_request_seconds = register(Histogram(
+    'signaltracker_opencellid_request_duration_seconds', 'Time taken by OpenCellID celltower lookups.',
+    labels=('result',)))
+
+
+# Connection pool that records how long each checkout waited for a connection
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_seconds.observe(time.perf_counter() - start)
+
+
+# SQL statement timing, attributed to the current request when there is one
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_statement_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_statement_start'].pop()
+    sql_statement_seconds.observe(elapsed)
+    if has_request_context():
+        g.metrics_sql_statements = g.get('metrics_sql_statements', 0) + 1
+        g.metrics_sql_seconds = g.get('metrics_sql_seconds', 0.0) + elapsed
+
+
+# A statement that fails never reaches after_cursor_execute, so drop its start time here
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+    if context.connection is None or context.cursor is None:
+        return
+    starts = context.connection.info.get('metrics_statement_start')
+    if starts:
+        starts.pop()
+
+
+@app.before_request
+def start_request_timer():
+    g.metrics_request_start = time.perf_counter()
+
+
+@app.after_request
+def remember_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+# Recorded at teardown rather than after_request, as a streamed response (see app/pagination.py)
+# runs its SQL while the body is sent, after after_request. Its duration covers the sending too.
+@app.teardown_request
+def record_request_metrics(exception):
+    start = g.get('metrics_request_start')
+    if start is not None:
+        # Label by route pattern rather than path so ids in urls don't create new series
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method = request.method
+        http_requests.inc(endpoint, method, g.get('metrics_status', 500))
+        http_request_seconds.observe(time.perf_counter() - start, endpoint, method)
+        http_request_sql_statements.observe(g.get('metrics_sql_statements', 0), endpoint, method)
+        http_request_sql_seconds.observe(g.get('metrics_sql_seconds', 0.0), endpoint, method)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        abort(404)  # metrics are switched off
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+        abort(401)  # unauthorized
+    return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -1,4 +1,6 @@
 from app import db, login
+from app.dialects import next_change_seq
+from app.loading import BoundedQuery
 from datetime import datetime
 from passlib.apps import custom_app_context as pwd_context
 from flask_login import UserMixin
@@ -13,6 +15,10 @@ def load_user(user_id):
 
 # SQLAlchemy models for our Postgres database
 
+# Every write to a synced table takes the next value of this sequence into the row's change_seq,
+# so the mobile app can ask for just what changed since its last sync (see app/sync.py)
+change_seq = db.Sequence('change_seq', metadata=db.metadata)
+
 # Model for 'User' database table
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
@@ -25,11 +31,18 @@ class User(UserMixin, db.Model):
     login_failure_count = db.Column(db.Integer, default=0)
     login_locked_timestamp = db.Column(db.DateTime, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    change_seq = db.Column(db.BigInteger, nullable=False, index=True, default=next_change_seq(), onupdate=next_change_seq())
+    # Deleting a user deletes their devices and readings with ON DELETE CASCADE in the database,
+    # rather than SQLAlchemy loading them all to delete them one by one (see app/purge.py).
+    # user.devices is a query rather than a list, see app/loading.py
     devices = db.relationship(
         'Device',
         backref='user',
         cascade='all, delete, delete-orphan',
+        passive_deletes=True,
         single_parent=True,
+        lazy='dynamic',
+        query_class=BoundedQuery,
         order_by='desc(Device.timestamp)'
     )
 
@@ -67,17 +80,22 @@ class User(UserMixin, db.Model):
 class Device(db.Model):
     __tablename__ = 'device'
     device_id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete='CASCADE'), index=True)
     manufacturer = db.Column(db.String(32), nullable=False)
     model = db.Column(db.String(32), nullable=False)
-    serial_no = db.Column(db.String(64), nullable=False)
+    serial_no = db.Column(db.String(64), nullable=False, index=True, unique=True)
     android_version = db.Column(db.String(32), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    change_seq = db.Column(db.BigInteger, nullable=False, index=True, default=next_change_seq(), onupdate=next_change_seq())
+    # device.readings is a query rather than a list, see app/loading.py
     readings = db.relationship(
         'Reading',
         backref='device',
         cascade='all, delete, delete-orphan',
+        passive_deletes=True,
         single_parent=True,
+        lazy='dynamic',
+        query_class=BoundedQuery,
         order_by='desc(Reading.timestamp)'
     )
 
@@ -101,14 +119,21 @@ class Device(db.Model):
 # Model for 'Reading' database table
 class Reading(db.Model):
     __tablename__ = 'reading'
+    __table_args__ = (
+        # Readings are almost always fetched for one device over a time range (e.g. a day in the map view)
+        db.Index('ix_reading_device_id_timestamp', 'device_id', 'timestamp'),
+        # A non-admin's sync reads the changes to their devices' readings
+        db.Index('ix_reading_device_id_change_seq', 'device_id', 'change_seq'),
+    )
     reading_id = db.Column(db.Integer, primary_key=True)
-    device_id = db.Column(db.Integer, db.ForeignKey('device.device_id'))
-    celltower_id = db.Column(db.Integer, db.ForeignKey('celltower.celltower_id'))
+    device_id = db.Column(db.Integer, db.ForeignKey('device.device_id', ondelete='CASCADE'))
+    celltower_id = db.Column(db.Integer, db.ForeignKey('celltower.celltower_id'), index=True)
     latitude = db.Column(db.Numeric, nullable=False)
     longitude = db.Column(db.Numeric, nullable=False)
     signal_type = db.Column(db.String(8), nullable=False)
     signal_value = db.Column(db.Integer, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    change_seq = db.Column(db.BigInteger, nullable=False, index=True, default=next_change_seq(), onupdate=next_change_seq())
 
     # Serialize database content for JSON reply
     def serialize(self):
@@ -131,17 +156,28 @@ class Reading(db.Model):
 # Model for 'CellTower' database table
 class CellTower(db.Model):
     __tablename__ = 'celltower'
+    __table_args__ = (
+        # A celltower is identified by its cell id within its network's location area
+        db.UniqueConstraint('mobile_country_code', 'mobile_network_code', 'location_area_code', 'celltower_name',
+                            name='uq_celltower_natural_key'),
+    )
     celltower_id = db.Column(db.Integer, primary_key=True)
-    celltower_name = db.Column(db.String(32), nullable=False)
+    celltower_name = db.Column(db.String(32), nullable=False, index=True)
     location_area_code = db.Column(db.String(32), nullable=False)
     mobile_country_code = db.Column(db.String(32), nullable=False)
     mobile_network_code = db.Column(db.String(32), nullable=False)
     latitude = db.Column(db.Numeric, nullable=False)
     longitude = db.Column(db.Numeric, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    change_seq = db.Column(db.BigInteger, nullable=False, index=True, default=next_change_seq(), onupdate=next_change_seq())
+    # celltower.readings is a query rather than a list, see app/loading.py. Deleting a celltower
+    # doesn't load its readings to unlink them, see sync.unlink_celltower_readings().
     readings = db.relationship(
         'Reading',
         backref='celltower',
+        passive_deletes=True,
+        lazy='dynamic',
+        query_class=BoundedQuery,
         order_by='desc(Reading.timestamp)'
     )
 
@@ -161,4 +197,100 @@ class CellTower(db.Model):
     # Representation of python object for output
     def __repr__(self):
         return '<CellTower {}'.format(self.celltower_id)
- 
\ No newline at end of file
+ 
+
+# Model for 'CellTowerLocation' database table
+# Persistent cache of celltower geolocations looked up from OpenCellID, keyed on the celltower's
+# network identifiers. Cells that OpenCellID doesn't know are stored with found=False and no
+# coordinates so they aren't looked up again on every page view.
+class CellTowerLocation(db.Model):
+    __tablename__ = 'celltower_location'
+    mobile_country_code = db.Column(db.String(32), primary_key=True)
+    mobile_network_code = db.Column(db.String(32), primary_key=True)
+    location_area_code = db.Column(db.String(32), primary_key=True)
+    celltower_name = db.Column(db.String(32), primary_key=True)
+    found = db.Column(db.Boolean, nullable=False)
+    latitude = db.Column(db.Numeric, nullable=True)
+    longitude = db.Column(db.Numeric, nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Representation of python object for output
+    def __repr__(self):
+        return '<CellTowerLocation {}/{}/{}/{}>'.format(self.mobile_country_code, self.mobile_network_code,
+                                                       self.location_area_code, self.celltower_name)
+
+
+# Model for 'ReadingRollup' database table
+# Daily aggregates of signal_value per device, map grid cell (at spatial.ROLLUP_ZOOM) and
+# signal_type, kept up to date as readings are written so map views don't have to re-scan
+# the raw readings. See app/rollups.py
+class ReadingRollup(db.Model):
+    __tablename__ = 'reading_rollup'
+    device_id = db.Column(db.Integer, db.ForeignKey('device.device_id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    cell_x = db.Column(db.Integer, primary_key=True)
+    cell_y = db.Column(db.Integer, primary_key=True)
+    signal_type = db.Column(db.String(8), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    sum = db.Column(db.BigInteger, nullable=False)
+    min = db.Column(db.Integer, nullable=False)
+    max = db.Column(db.Integer, nullable=False)
+
+    # Representation of python object for output
+    def __repr__(self):
+        return '<ReadingRollup {} {} {},{} {}>'.format(self.device_id, self.day, self.cell_x, self.cell_y, self.signal_type)
+
+
+# Model for 'Tombstone' database table
+# A record of a deleted user, device, reading or celltower, so the mobile app's delta sync can
+# tell it to drop its copy. Only the row that was deleted gets one, not the rows deleted along
+# with it (a user's devices, a device's readings): clients drop those with their parent.
+# user_id is the user that could see the row, or NULL if every user could. See app/sync.py
+class Tombstone(db.Model):
+    __tablename__ = 'tombstone'
+    __table_args__ = (
+        # The version of a table's list is the latest of its rows' and its tombstones', see app/etags.py
+        db.Index('ix_tombstone_table_name_change_seq', 'table_name', 'change_seq'),
+    )
+    change_seq = db.Column(db.BigInteger, primary_key=True, autoincrement=False, default=next_change_seq())
+    table_name = db.Column(db.String(16), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, index=True, nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Representation of python object for output
+    def __repr__(self):
+        return '<Tombstone {} {}>'.format(self.table_name, self.row_id)
+
+
+# Model for 'Purge' database table
+# Progress of a user or device being deleted in the background, its readings in chunks before
+# the row itself. user_id is the user that may follow it. See app/purge.py
+class Purge(db.Model):
+    __tablename__ = 'purge'
+    purge_id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(16), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, index=True, nullable=True)
+    status = db.Column(db.String(16), nullable=False)       # 'running', 'done' or 'failed'
+    total = db.Column(db.BigInteger, nullable=False)        # readings to delete when the purge started
+    deleted = db.Column(db.BigInteger, nullable=False, default=0)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Serialize database content for JSON reply
+    def serialize(self):
+        return {
+            'purge_id': self.purge_id,
+            'table_name': self.table_name,
+            'row_id': self.row_id,
+            'status': self.status,
+            'total': self.total,
+            'deleted': self.deleted,
+            'created': str(self.created),
+            'timestamp': str(self.timestamp)
+        }
+
+    # Representation of python object for output
+    def __repr__(self):
+        return '<Purge {} {} {}>'.format(self.purge_id, self.table_name, self.row_id)
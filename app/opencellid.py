@@ -0,0 +1,210 @@
+from app import app
+import numpy as np
+import csv
+import gzip
+import io
+import itertools
+import os
+import shutil
+import threading
+
+
+# Offline copy of OpenCellID's cell location database, loaded from one of its CSV dumps by
+# 'flask opencellid import', so the map view can locate celltowers without calling the api.
+#
+# The cells are kept in NumPy arrays on disk, one directory per mobile country code:
+#   OPENCELLID_DB_DIR/<mcc>/{area,cell,latitude,longitude}.npy
+# area packs the network code and area code (mnc << 24 | lac, room for 5G's 24 bit tracking area
+# codes) and cell is the cell id, the rows sorted by (area, cell), so a tower is found by binary
+# search on area and then on cell within the area's rows. The files are memory-mapped, like the
+# reading archive (see app/archive.py), so a lookup only pages in the parts it searches and the
+# OS page cache is shared between worker processes.
+#
+# The dumps are too large to hold in memory, so an import streams the CSV through in chunks,
+# appending each chunk's rows to a raw file per country, then sorts the countries one at a time.
+# Where a dump has the same cell more than once (the same ids for different radio types), the
+# row with the most samples is kept. The new database is written to a temporary directory and
+# swapped in whole; running processes notice the swap on their next lookup.
+
+
+# Columns of the OpenCellID dumps, for dumps without a header row
+CSV_COLUMNS = ('radio', 'mcc', 'net', 'area', 'cell', 'unit', 'lon', 'lat', 'range', 'samples',
+               'changeable', 'created', 'updated', 'averageSignal')
+
+ROW = np.dtype([('area', '<u8'), ('cell', '<u8'), ('latitude', '<f4'), ('longitude', '<f4'), ('samples', '<u4')])
+COLUMNS = ('area', 'cell', 'latitude', 'longitude')
+
+MAX_NETWORK_CODE = 999
+MAX_AREA_CODE = (1 << 24) - 1
+MAX_CELL_ID = (1 << 63) - 1
+
+loaded = {}             # mcc -> memory-mapped columns, or None where the country has no cells
+loaded_from = None      # (device, inode) of the directory the loaded columns are from
+lock = threading.Lock()
+
+
+def area_key(mnc, lac):
+    return (mnc << 24) | lac
+
+
+# The numeric (mcc, area, cell) of a celltower key (mcc, mnc, lac, cellid), or None if it can't
+# be in the database
+def parse_key(key):
+    try:
+        mcc, mnc, lac, cell = (int(part) for part in key)
+    except (TypeError, ValueError):
+        return None
+    if min(mcc, mnc, lac, cell) < 0 or mnc > MAX_NETWORK_CODE or lac > MAX_AREA_CODE or cell > MAX_CELL_ID:
+        return None
+    return mcc, area_key(mnc, lac), cell
+
+
+# Locations of the given celltower keys as found in the database: a dict of key -> (lat, lng),
+# leaving out keys it doesn't have. Returns an empty dict if nothing has been imported.
+def lookup(keys):
+    by_country = {}
+    for key in keys:
+        parsed = parse_key(key)
+        if parsed is not None:
+            by_country.setdefault(parsed[0], []).append((key, parsed[1], parsed[2]))
+    if not by_country:
+        return {}
+
+    locations = {}
+    with lock:
+        if not refresh():
+            return {}
+        for mcc, wanted in by_country.items():
+            columns = country(mcc)
+            if columns is None:
+                continue
+            areas = np.array([area for key, area, cell in wanted], dtype=np.uint64)
+            firsts = np.searchsorted(columns['area'], areas, 'left')
+            lasts = np.searchsorted(columns['area'], areas, 'right')
+            for (key, area, cell), first, last in zip(wanted, firsts.tolist(), lasts.tolist()):
+                index = first + int(np.searchsorted(columns['cell'][first:last], np.uint64(cell)))
+                if index < last and int(columns['cell'][index]) == cell:
+                    locations[key] = (round(float(columns['latitude'][index]), 6),
+                                      round(float(columns['longitude'][index]), 6))
+    return locations
+
+
+# Drop the loaded columns if the database has been replaced since they were loaded. Returns False
+# if there is no database. Called with the lock held.
+def refresh():
+    global loaded_from
+    try:
+        stat = os.stat(app.config['OPENCELLID_DB_DIR'])
+    except FileNotFoundError:
+        return False
+    if (stat.st_dev, stat.st_ino) != loaded_from:
+        loaded.clear()
+        loaded_from = (stat.st_dev, stat.st_ino)
+    return True
+
+
+def country(mcc):
+    if mcc not in loaded:
+        directory = os.path.join(app.config['OPENCELLID_DB_DIR'], str(mcc))
+        if os.path.isdir(directory):
+            loaded[mcc] = {column: np.load(os.path.join(directory, column + '.npy'), mmap_mode='r')
+                           for column in COLUMNS}
+        else:
+            loaded[mcc] = None
+    return loaded[mcc]
+
+
+def open_dump(path):
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), newline='')
+    return open(path, newline='')
+
+
+# Replace the database with the cells of an OpenCellID CSV dump (optionally gzipped). Returns
+# the number of cells imported and the number of rows skipped as unusable.
+def import_dump(path, chunk_size=1000000):
+    directory = app.config['OPENCELLID_DB_DIR']
+    temporary = directory + '.new'
+    shutil.rmtree(temporary, ignore_errors=True)
+    raw = os.path.join(temporary, 'raw')
+    os.makedirs(raw)
+
+    skipped = 0
+    with open_dump(path) as f:
+        reader = csv.reader(f)
+        first = next(reader, [])
+        if first[:1] == ['radio']:
+            header = first
+        else:
+            header = CSV_COLUMNS
+            reader = itertools.chain([first] if first else [], reader)
+        positions = [header.index(column) for column in ('mcc', 'net', 'area', 'cell', 'lat', 'lon', 'samples')]
+
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                skipped += write_chunk(raw, chunk, positions)
+                chunk = []
+        if chunk:
+            skipped += write_chunk(raw, chunk, positions)
+
+    imported = 0
+    for name in os.listdir(raw):
+        imported += sort_country(os.path.join(raw, name), os.path.join(temporary, name[:-len('.bin')]))
+    shutil.rmtree(raw)
+
+    # An import that crashed part way through the swap may have left its .old behind
+    shutil.rmtree(directory + '.old', ignore_errors=True)
+    if os.path.isdir(directory):
+        os.rename(directory, directory + '.old')
+    os.rename(temporary, directory)
+    shutil.rmtree(directory + '.old', ignore_errors=True)
+    return imported, skipped
+
+
+# Parse a chunk of CSV rows and append them to their country's raw file. Returns the number of
+# rows skipped.
+def write_chunk(raw, chunk, positions):
+    mcc_at, net_at, area_at, cell_at, lat_at, lon_at, samples_at = positions
+    countries = []
+    parsed = []
+    for row in chunk:
+        try:
+            mcc, mnc, lac, cell = int(row[mcc_at]), int(row[net_at]), int(row[area_at]), int(row[cell_at])
+            lat, lng = float(row[lat_at]), float(row[lon_at])
+            samples = int(row[samples_at] or 0)
+        except (IndexError, ValueError):
+            continue
+        if parse_key((mcc, mnc, lac, cell)) is None or not -90 <= lat <= 90 or not -180 <= lng <= 180:
+            continue
+        countries.append(mcc)
+        parsed.append((area_key(mnc, lac), cell, lat, lng, min(max(samples, 0), 0xffffffff)))
+
+    if parsed:
+        rows = np.array(parsed, dtype=ROW)
+        countries = np.array(countries)
+        order = np.argsort(countries, kind='stable')
+        rows, countries = rows[order], countries[order]
+        codes, starts = np.unique(countries, return_index=True)
+        for mcc, first, last in zip(codes.tolist(), starts.tolist(), starts[1:].tolist() + [len(rows)]):
+            with open(os.path.join(raw, '{}.bin'.format(mcc)), 'ab') as f:
+                rows[first:last].tofile(f)
+    return len(chunk) - len(parsed)
+
+
+# Sort a country's raw rows by (area, cell), keep the row with the most samples of each cell and
+# save the columns. Returns the number of cells.
+def sort_country(raw_path, directory):
+    rows = np.fromfile(raw_path, dtype=ROW)
+    order = np.lexsort((-rows['samples'].astype(np.int64), rows['cell'], rows['area']))
+    rows = rows[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows['area'][1:] != rows['area'][:-1]) | (rows['cell'][1:] != rows['cell'][:-1])
+    rows = rows[first]
+
+    os.makedirs(directory)
+    for column in COLUMNS:
+        np.save(os.path.join(directory, column + '.npy'), np.ascontiguousarray(rows[column]))
+    os.remove(raw_path)
+    return len(rows)
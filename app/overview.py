@@ -0,0 +1,92 @@
+from app import db
+from app.models import User, Device, Reading, ReadingRollup
+from datetime import datetime, time, timedelta
+from sqlalchemy import func, select
+
+
+# Activity of each user for the admin overview: their number of devices, total readings, first
+# and last reading and readings in the last 24 hours.
+#
+# One page of users is answered by a single grouped query. The page is picked by keyset on
+# user_id, and only the devices of the users on it are looked at: each device's figures are
+# correlated subqueries that read the (device_id, timestamp) index on readings and the rollups'
+# primary key, so a page costs the same however many users, devices and readings there are.
+# Totals come from the daily rollups, so they include readings that have been archived or
+# dropped with old partitions. For a user whose earliest (or every) reading has left the
+# database the first (and last) reading is only known to the day, from the rollups.
+
+
+def activity_page(after, limit):
+    since = datetime.utcnow() - timedelta(hours=24)
+    page = db.session.query(User.user_id).filter(User.user_id > (after or 0)) \
+                .order_by(User.user_id).limit(limit + 1).subquery()
+
+    def per_device(*columns):
+        return select(*columns).where(Reading.device_id == Device.device_id).scalar_subquery()
+
+    def per_device_rollup(column):
+        return select(column).where(ReadingRollup.device_id == Device.device_id).scalar_subquery()
+
+    devices = db.session.query(
+                Device.user_id,
+                Device.device_id,
+                per_device_rollup(func.sum(ReadingRollup.count)).label('total'),
+                per_device(func.min(Reading.timestamp)).label('first'),
+                per_device(func.max(Reading.timestamp)).label('last'),
+                per_device_rollup(func.min(ReadingRollup.day)).label('first_day'),
+                per_device_rollup(func.max(ReadingRollup.day)).label('last_day'),
+                select(func.count()).where(Reading.device_id == Device.device_id, Reading.timestamp >= since)
+                    .scalar_subquery().label('recent')) \
+            .filter(Device.user_id.in_(select(page.c.user_id))).subquery()
+
+    rows = db.session.query(
+                User.user_id,
+                User.email,
+                User.first_name,
+                User.last_name,
+                User.role,
+                func.count(devices.c.device_id),
+                func.coalesce(func.sum(devices.c.total), 0),
+                func.min(devices.c.first),
+                func.max(devices.c.last),
+                func.min(devices.c.first_day),
+                func.max(devices.c.last_day),
+                func.coalesce(func.sum(devices.c.recent), 0)) \
+            .join(page, page.c.user_id == User.user_id) \
+            .outerjoin(devices, devices.c.user_id == User.user_id) \
+            .group_by(User.user_id, User.email, User.first_name, User.last_name, User.role) \
+            .order_by(User.user_id).all()
+
+    items = [activity(*row) for row in rows[:limit]]
+    next_after = items[-1]['user_id'] if len(rows) > limit else None
+    return items, next_after
+
+
+def activity(user_id, email, first_name, last_name, role, devices, total, first, last, first_day, last_day, recent):
+    # SQLite hands back the min / max of timestamps and days from a subquery as text
+    first, last = as_datetime(first), as_datetime(last)
+    first_day, last_day = as_datetime(first_day), as_datetime(last_day)
+    if first_day is not None and (first is None or first_day.date() < first.date()):
+        first = first_day
+    if last is None:
+        last = last_day
+    return {
+        'user_id': user_id,
+        'email': email,
+        'first_name': first_name,
+        'last_name': last_name,
+        'role': role,
+        'devices': devices,
+        'readings': int(total),
+        'first_reading': None if first is None else str(first),
+        'last_reading': None if last is None else str(last),
+        'readings_24h': int(recent)
+    }
+
+
+def as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return datetime.combine(value, time())
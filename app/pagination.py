@@ -0,0 +1,106 @@
+from flask import Response, request, abort, stream_with_context
+from flask.json import jsonify
+from app import app, db
+from app.serialization import encode_items
+from datetime import datetime, timezone
+from itertools import chain, islice
+from operator import itemgetter
+import heapq
+
+
+# Shared handling for the REST API list endpoints.
+#
+# With ?limit=N (and optionally ?after=<key>) a single page is returned, using keyset pagination
+# on the given key column so every page costs the same no matter how deep into the table it is:
+#   {"items": [...], "next_after": <key of the last item, or null on the last page>}
+#
+# Without paging parameters the whole collection is returned as a JSON array, as it always has
+# been, but the rows are streamed from a server side cursor so memory stays flat regardless of
+# the size of the table.
+#
+# Either way only the columns of the projection (see app/serialization.py) are selected, no ORM
+# instances are loaded.
+#
+# archived, if given, is called with the after cursor (or None) and returns serialized items
+# from outside the database, sorted by key, which are merged in key order with the query's.
+def list_response(query, key_column, projection, archived=None):
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    if 'after' in request.args and after is None:
+        abort(400)  # bad cursor
+    if 'limit' in request.args and (limit is None or limit < 1):
+        abort(400)  # bad limit
+
+    if after is not None:
+        query = query.filter(key_column > after)
+    query = query.order_by(key_column)
+    extra = archived(after) if archived is not None else []
+
+    if limit is None and after is None:
+        return stream_response(query, key_column, projection, extra)
+
+    limit = min(limit or app.config['LIST_DEFAULT_LIMIT'], app.config['LIST_MAX_LIMIT'])
+    rows = db.session.execute(projection.select(query.limit(limit + 1))).all()
+    items = projection.items(rows)
+    if extra:
+        items = list(islice(heapq.merge(items, extra, key=itemgetter(key_column.key)), limit + 1))
+    next_after = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_after = items[-1][key_column.key]
+    return jsonify({'items': items, 'next_after': next_after})
+
+
+# Stream the query results as a JSON array, fetching and encoding LIST_STREAM_BATCH rows at a time
+def stream_response(query, key_column, projection, extra):
+    batch_size = app.config['LIST_STREAM_BATCH']
+    if extra:
+        items = heapq.merge(chain.from_iterable(projection.item_batches(query, batch_size)), extra,
+                            key=itemgetter(key_column.key))
+        batches = (encode_items(batch) for batch in chunks(items, batch_size))
+    else:
+        batches = projection.json_batches(query, batch_size)
+
+    def generate():
+        yield '['
+        separator = ''
+        for batch in batches:
+            yield separator + batch
+            separator = ','
+        yield ']\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Read an optional ISO 8601 date/time query parameter, aborting with 400 if it is malformed
+def datetime_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        abort(400)
+
+
+# Parse an ISO 8601 date/time as the naive UTC datetime the timestamps are stored as. One with a
+# UTC offset (or Z) is converted to UTC, one without is taken to be UTC already. Raises ValueError
+# if it is malformed.
+def parse_datetime(value):
+    if not isinstance(value, str):
+        raise ValueError('expecting an ISO 8601 string')
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
@@ -0,0 +1,158 @@
+from app import db
+from datetime import date
+from sqlalchemy import text
+import re
+
+
+# Monthly range partitioning of the reading table on Postgres, managed with 'flask partitions'.
+#
+# Once converted, reading is a declarative partitioned table with one partition per calendar
+# month of timestamp, named reading_yYYYYmMM. The Reading model and every query on it are
+# unchanged: Postgres routes inserts to the right partition and prunes the partitions a query's
+# timestamp range can't touch, e.g. index() only ever reads the viewed day's month. As the
+# partition key must be part of the primary key, it becomes (reading_id, timestamp); reading_id
+# still comes from the same sequence so it stays unique on its own.
+#
+# Partitions are created a few months ahead of time by 'flask partitions maintain', run e.g.
+# daily from cron, which also applies the retention policy by dropping whole partitions that
+# have fallen out of it instead of deleting their rows one by one. The daily rollups of dropped
+# readings are kept, so the map still shows the coverage history for those days.
+#
+# A reading whose month has no partition, e.g. from a phone with its clock far off or when
+# 'maintain' hasn't run for months, goes into the DEFAULT partition reading_default rather than
+# failing the insert. When its month's partition is created the month's readings are moved out
+# of reading_default into it, and those older than the retention period are deleted from it.
+
+
+INDEXES = (
+    ('ix_reading_device_id_timestamp', 'device_id, timestamp'),
+    ('ix_reading_celltower_id', 'celltower_id'),
+    ('ix_reading_timestamp', 'timestamp'),
+    ('ix_reading_change_seq', 'change_seq'),
+    ('ix_reading_device_id_change_seq', 'device_id, change_seq')
+)
+
+PARTITION_NAME = re.compile(r'^reading_y(\d{4})m(\d{2})$')
+DEFAULT_PARTITION = 'reading_default'
+
+# Foreign keys of the reading table, under the names Postgres gives them by default, which the
+# migrations refer to them by
+FOREIGN_KEYS = (
+    ('reading_device_id_fkey', 'FOREIGN KEY (device_id) REFERENCES device (device_id) ON DELETE CASCADE'),
+    ('reading_celltower_id_fkey', 'FOREIGN KEY (celltower_id) REFERENCES celltower (celltower_id)')
+)
+
+
+def partition_name(month):
+    return 'reading_y{:04d}m{:02d}'.format(month.year, month.month)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def is_partitioned():
+    return db.session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.oid = 'reading'::regclass)")).scalar()
+
+
+# The months that have a partition, oldest first
+def partition_months():
+    names = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'reading'::regclass")).scalars()
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+# Create the partition of a month unless it exists. It is filled with the month's readings from
+# the default partition before it is attached, as Postgres won't attach it while the default
+# partition holds rows that belong in it.
+def create_partition(month):
+    name = partition_name(month)
+    if db.session.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar() is not None:
+        return
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    db.session.execute(text('CREATE TABLE {} (LIKE reading INCLUDING DEFAULTS)'.format(name)))
+    db.session.execute(text("WITH moved AS (DELETE FROM {0} WHERE timestamp >= '{2}' AND timestamp < '{3}' RETURNING *) "
+                            "INSERT INTO {1} SELECT * FROM moved".format(DEFAULT_PARTITION, name, start, end)))
+    db.session.execute(text("ALTER TABLE reading ATTACH PARTITION {} FOR VALUES FROM ('{}') TO ('{}')"
+                            .format(name, start, end)))
+
+
+# Create the partitions from the current month to months_ahead months after it that don't
+# exist yet. Returns the months created.
+def create_ahead(months_ahead, today=None):
+    current = month_start(today or date.today())
+    existing = set(partition_months())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month not in existing:
+            create_partition(month)
+            created.append(month)
+    db.session.commit()
+    return created
+
+
+# Drop the partitions of months that ended more than retention_months months before the
+# current month began. Returns the months dropped.
+def drop_expired(retention_months, today=None):
+    cutoff = add_months(month_start(today or date.today()), -retention_months)
+    dropped = []
+    for month in partition_months():
+        if month < cutoff:
+            db.session.execute(text('DROP TABLE {}'.format(partition_name(month))))
+            dropped.append(month)
+    db.session.execute(text("DELETE FROM {} WHERE timestamp < '{}'".format(DEFAULT_PARTITION, cutoff.isoformat())))
+    db.session.commit()
+    return dropped
+
+
+# Turn the plain reading table into a partitioned one, in a single transaction. The table is
+# locked against reads and writes while its rows are copied, so run this in a quiet period.
+def convert(months_ahead, today=None):
+    db.session.execute(text('LOCK TABLE reading IN ACCESS EXCLUSIVE MODE'))
+
+    # Move the existing table and the names of its constraints and indexes out of the way, so the
+    # new table's can be given the names the migrations know them by
+    db.session.execute(text('ALTER TABLE reading RENAME TO reading_unpartitioned'))
+    for name in ['reading_pkey'] + [name for name, definition in FOREIGN_KEYS]:
+        db.session.execute(text('ALTER TABLE reading_unpartitioned RENAME CONSTRAINT {} TO {}'
+                                .format(name, name.replace('reading_', 'reading_unpartitioned_', 1))))
+    for name, columns in INDEXES:
+        db.session.execute(text('ALTER INDEX IF EXISTS {0} RENAME TO {0}_unpartitioned'.format(name)))
+
+    db.session.execute(text('CREATE TABLE reading (LIKE reading_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)'))
+    db.session.execute(text('ALTER TABLE reading ADD CONSTRAINT reading_pkey PRIMARY KEY (reading_id, timestamp)'))
+    for name, definition in FOREIGN_KEYS:
+        db.session.execute(text('ALTER TABLE reading ADD CONSTRAINT {} {}'.format(name, definition)))
+    db.session.execute(text('ALTER SEQUENCE reading_reading_id_seq OWNED BY reading.reading_id'))
+
+    # The default partition, then partitions for every month that has readings and the months ahead
+    db.session.execute(text('CREATE TABLE {} PARTITION OF reading DEFAULT'.format(DEFAULT_PARTITION)))
+    first, last = db.session.execute(text('SELECT min(timestamp), max(timestamp) FROM reading_unpartitioned')).one()
+    current = month_start(today or date.today())
+    month = month_start(first) if first is not None else current
+    end = max(month_start(last), current) if last is not None else current
+    while month <= add_months(end, months_ahead):
+        create_partition(month)
+        month = add_months(month, 1)
+
+    copied = db.session.execute(text('INSERT INTO reading SELECT * FROM reading_unpartitioned')).rowcount
+    # Indexes on the parent are created on every partition, and are quicker to build after the copy
+    for name, columns in INDEXES:
+        db.session.execute(text('CREATE INDEX {} ON reading ({})'.format(name, columns)))
+    db.session.execute(text('DROP TABLE reading_unpartitioned'))
+    db.session.commit()
+    return copied
@@ -0,0 +1,107 @@
+from app import app, db, sync, stats, archive
+from app.models import User, Device, Reading, Purge
+from app.rollups import delete_device_rollups
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Deleting users and devices along with their readings.
+#
+# The foreign keys from devices to users, and from readings and rollups to devices, are
+# ON DELETE CASCADE and the relationships have passive_deletes, so deleting a user or device is
+# a single DELETE of its row and the database removes the rest, without any of it being loaded
+# into the app. That is still one statement, and transaction, for however many readings there
+# are. So the API can instead start a purge (DELETE with ?async=1): a background thread deletes
+# the readings PURGE_CHUNK_SIZE at a time, committing each chunk and recording progress in the
+# purge table (GET /api/v1.0/purges/<purge_id>), then deletes the row itself as above, which
+# cascades to anything written meanwhile.
+#
+# Either way the row's rollups, cached tiles and statistics and its sync tombstone are dealt
+# with in the transaction that deletes it. Until then a purged user or device still exists;
+# clients learn about the whole of it from the tombstone. A purge interrupted by its process
+# exiting stays 'running' and is finished by 'flask purge resume'.
+
+
+MODELS = {'user': User, 'device': Device}
+
+pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+
+
+def device_ids_of(table_name, row_id):
+    if table_name == 'device':
+        return [row_id]
+    return [device_id for (device_id,) in db.session.query(Device.device_id).filter(Device.user_id == row_id)]
+
+
+# Delete a user or device, and by cascade everything belonging to it, in the current
+# transaction. The caller commits, then calls deleted() with the returned device ids.
+def delete(table_name, row):
+    row_id = row.user_id if table_name == 'user' else row.device_id
+    device_ids = device_ids_of(table_name, row_id)
+    delete_device_rollups(device_ids)
+    stats.devices_changed(device_ids)
+    sync.tombstone(table_name, row_id, row.user_id)
+    db.session.delete(row)
+    return device_ids
+
+
+# Clean up after a committed delete what the database doesn't hold
+def deleted(device_ids):
+    archive.delete_devices(device_ids)
+
+
+# Start purging a user or device in the background, or return the purge already under way
+def start(table_name, row_id, owner_id):
+    purge = Purge.query.filter_by(table_name=table_name, row_id=row_id, status='running').first()
+    if purge is not None:
+        return purge
+    total = Reading.query.filter(Reading.device_id.in_(device_ids_of(table_name, row_id))).count()
+    purge = Purge(table_name=table_name, row_id=row_id, user_id=owner_id, status='running', total=total, deleted=0)
+    db.session.add(purge)
+    db.session.commit()
+    pool.submit(run, purge.purge_id)
+    return purge
+
+
+def run(purge_id):
+    with app.app_context():
+        try:
+            finish(purge_id)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Purge %d failed', purge_id)
+            Purge.query.filter_by(purge_id=purge_id).update({'status': 'failed'}, synchronize_session=False)
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+# Delete a purge's readings chunk by chunk, then its user or device
+def finish(purge_id):
+    purge = Purge.query.get(purge_id)
+    chunk_size = app.config['PURGE_CHUNK_SIZE']
+    while True:
+        # Looked up for every chunk, as a user may add a device while their purge runs
+        device_ids = device_ids_of(purge.table_name, purge.row_id)
+        chunk = db.session.query(Reading.reading_id).filter(Reading.device_id.in_(device_ids)).limit(chunk_size)
+        count = Reading.query.filter(Reading.reading_id.in_(chunk.subquery().select())) \
+                    .delete(synchronize_session=False)
+        purge.deleted += count
+        db.session.commit()
+        if count < chunk_size:
+            break
+
+    device_ids = []
+    row = MODELS[purge.table_name].query.get(purge.row_id)
+    if row is not None:
+        device_ids = delete(purge.table_name, row)
+    purge.status = 'done'
+    db.session.commit()
+    deleted(device_ids)
+
+
+# Finish the purges that were interrupted, one after another. Returns how many there were.
+def resume():
+    purge_ids = [purge_id for (purge_id,) in db.session.query(Purge.purge_id).filter(Purge.status == 'running')]
+    for purge_id in purge_ids:
+        run(purge_id)
+    return len(purge_ids)
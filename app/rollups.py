@@ -0,0 +1,158 @@
+from app import db, tiles, stats
+from app.models import Reading, ReadingRollup
+from app.spatial import cells_per_degree, grid_cell, ROLLUP_ZOOM
+from app.dialects import upsert, least, greatest
+from datetime import datetime, timedelta
+from sqlalchemy import func
+
+
+# Incremental maintenance of the reading_rollup table.
+#
+# Every code path that writes readings reports the rows it added or removed here, in the same
+# transaction, so the rollups always match the raw readings:
+#   add_readings()    after readings have been inserted
+#   remove_readings() after readings have been deleted (and flushed)
+# An update is a remove of the old values followed by an add of the new ones. The changes are
+# passed on to app/tiles.py and app/stats.py so cached tiles and statistics of the readings are
+# invalidated.
+#
+# Readings are passed as dicts of their column values (see reading_values()), as the bulk
+# ingest paths never create ORM objects.
+
+
+ROLLUP_SCALE = cells_per_degree(ROLLUP_ZOOM)
+
+
+# Column values of a Reading needed by the rollups
+def reading_values(reading):
+    return {
+        'device_id': reading.device_id,
+        'celltower_id': reading.celltower_id,
+        'latitude': reading.latitude,
+        'longitude': reading.longitude,
+        'signal_type': reading.signal_type,
+        'signal_value': reading.signal_value,
+        'timestamp': reading.timestamp
+    }
+
+
+def rollup_key(values):
+    return (values['device_id'],
+            values['timestamp'].date(),
+            rollup_cell(values['longitude']),
+            rollup_cell(values['latitude']),
+            values['signal_type'])
+
+
+# The rollup cell a longitude or latitude falls in, of a value in Python or of a column in SQL
+def rollup_cell(value):
+    return grid_cell(value, ROLLUP_SCALE)
+
+
+# Sum up readings into per rollup row [count, sum, min, max] deltas
+def aggregate(readings):
+    deltas = {}
+    for values in readings:
+        key = rollup_key(values)
+        value = int(values['signal_value'])
+        delta = deltas.get(key)
+        if delta is None:
+            deltas[key] = [1, value, value, value]
+        else:
+            delta[0] += 1
+            delta[1] += value
+            delta[2] = min(delta[2], value)
+            delta[3] = max(delta[3], value)
+    return deltas
+
+
+# Fold newly inserted readings into the rollups with a single upsert
+def add_readings(readings):
+    tiles.readings_changed(readings)
+    stats.readings_changed(readings)
+    deltas = aggregate(readings)
+    if not deltas:
+        return
+
+    table = ReadingRollup.__table__
+    insert = upsert(table)
+    insert = insert.on_conflict_do_update(
+        index_elements=[c.name for c in table.primary_key.columns],
+        set_={
+            'count': table.c['count'] + insert.excluded['count'],
+            'sum': table.c['sum'] + insert.excluded['sum'],
+            'min': least(table.c['min'], insert.excluded['min']),
+            'max': greatest(table.c['max'], insert.excluded['max'])
+        })
+    rows = []
+    for (device_id, day, cell_x, cell_y, signal_type), (count, total, minimum, maximum) in deltas.items():
+        rows.append({'device_id': device_id, 'day': day, 'cell_x': cell_x, 'cell_y': cell_y,
+                     'signal_type': signal_type, 'count': count, 'sum': total, 'min': minimum, 'max': maximum})
+    db.session.execute(insert, rows)
+
+
+# Take deleted readings back out of the rollups. The raw readings must already have been
+# deleted (or flushed) as a rollup row whose min or max was removed is re-derived from them.
+# The rollup rows are locked (in key order, so two removes can't deadlock) until the transaction
+# ends, so a concurrent add or remove waits for these changes rather than overwriting them.
+def remove_readings(readings):
+    tiles.readings_changed(readings)
+    stats.readings_changed(readings)
+    for key, (count, total, minimum, maximum) in sorted(aggregate(readings).items()):
+        rollup = ReadingRollup.query.with_for_update().populate_existing().get(key)
+        if rollup is None:
+            continue
+        rollup.count -= count
+        rollup.sum -= total
+        if rollup.count <= 0:
+            db.session.delete(rollup)
+        elif minimum <= rollup.min or maximum >= rollup.max:
+            rollup.min, rollup.max = recompute_min_max(key)
+    # Write the changes now, so a following add_readings() upsert builds on them rather than
+    # being overwritten by them when the session is next flushed
+    db.session.flush()
+
+
+def recompute_min_max(key):
+    device_id, day, cell_x, cell_y, signal_type = key
+    start = datetime(day.year, day.month, day.day)
+    return db.session.query(func.min(Reading.signal_value), func.max(Reading.signal_value)) \
+        .filter(Reading.device_id == device_id,
+                Reading.timestamp >= start,
+                Reading.timestamp < start + timedelta(days=1),
+                Reading.signal_type == signal_type,
+                rollup_cell(Reading.longitude) == cell_x,
+                rollup_cell(Reading.latitude) == cell_y) \
+        .one()
+
+
+# Remove the rollups of devices that are being deleted along with their readings
+def delete_device_rollups(device_ids):
+    tiles.devices_changed(device_ids)
+    ReadingRollup.query.filter(ReadingRollup.device_id.in_(device_ids)).delete(synchronize_session=False)
+
+
+# Recreate every rollup row from the raw readings in one INSERT ... SELECT
+def rebuild():
+    day = func.date(Reading.timestamp)
+    cell_x = rollup_cell(Reading.longitude)
+    cell_y = rollup_cell(Reading.latitude)
+    select = db.session.query(
+                Reading.device_id,
+                day,
+                cell_x,
+                cell_y,
+                Reading.signal_type,
+                func.count(Reading.signal_value),
+                func.sum(Reading.signal_value),
+                func.min(Reading.signal_value),
+                func.max(Reading.signal_value)) \
+            .group_by(Reading.device_id, day, cell_x, cell_y, Reading.signal_type)
+
+    table = ReadingRollup.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['device_id', 'day', 'cell_x', 'cell_y', 'signal_type', 'count', 'sum', 'min', 'max'],
+        select.statement))
+    db.session.commit()
+    return db.session.query(func.count()).select_from(table).scalar()
@@ -0,0 +1,115 @@
+from app import app, db
+from app.models import User, Device, Reading, CellTower
+from werkzeug.http import http_date
+from decimal import Decimal
+import json
+
+
+# Column projection path for the bulk read endpoints.
+#
+# serialize() on the models needs a fully loaded ORM instance per row. For lists of rows a
+# Projection instead selects just the serialized columns as plain tuples, applies a cheap encoder
+# to the few values that aren't already JSON types, and encodes a whole batch of rows in one
+# call to the standard library's C accelerated encoder. The JSON produced is byte-identical to
+# encoding the models' serialize() output with flask.json:
+#   timestamps   str(datetime), which is what str(datetime.fromisoformat(str(...))) comes back to
+#   Numeric      str(Decimal), the same Decimal the ORM would have loaded
+#   other dates  http_date(), as flask.json's encoder renders them
+
+
+def encode_http_date(value):
+    return None if value is None else http_date(value)
+
+
+# A float for a Numeric column as serialize() and the projections will render it once it has
+# been written: Postgres stores the float's shortest repr, and hands it back as that Decimal
+def numeric_text(value):
+    return str(Decimal(repr(float(value))))
+
+
+class Projection:
+    # fields are (key, column, encoder) with encoder None for values that are already JSON types
+    def __init__(self, *fields):
+        self.keys = [key for key, column, encoder in fields]
+        self.columns = [column for key, column, encoder in fields]
+        self.encoders = [(i, encoder) for i, (key, column, encoder) in enumerate(fields) if encoder is not None]
+
+    # Core select of the projected columns, keeping the query's filters and ordering
+    def select(self, query):
+        return query.with_entities(*self.columns).statement
+
+    # Serialized dicts for rows selected with select()
+    def items(self, rows):
+        keys = self.keys
+        encoders = self.encoders
+        items = []
+        for row in rows:
+            values = list(row)
+            for i, encoder in encoders:
+                values[i] = encoder(values[i])
+            items.append(dict(zip(keys, values)))
+        return items
+
+    # Run the query with a server side cursor and yield lists of serialized dicts, batch_size
+    # rows at a time
+    def item_batches(self, query, batch_size):
+        result = db.session.execute(self.select(query), execution_options={'stream_results': True})
+        for rows in result.partitions(batch_size):
+            yield self.items(rows)
+
+    # As item_batches(), but each batch as JSON text: the comma separated items of a JSON array
+    def json_batches(self, query, batch_size):
+        for items in self.item_batches(query, batch_size):
+            yield encode_items(items)
+
+
+# Encode serialized dicts as the comma separated items of a JSON array, as flask.json would
+def encode_items(items):
+    encoder = json.JSONEncoder(ensure_ascii=app.config['JSON_AS_ASCII'],
+                               sort_keys=app.config['JSON_SORT_KEYS'],
+                               separators=(',', ':'))
+    return encoder.encode(items)[1:-1]
+
+
+user_projection = Projection(
+    ('user_id', User.user_id, None),
+    ('first_name', User.first_name, None),
+    ('last_name', User.last_name, None),
+    ('email', User.email, None),
+    ('role', User.role, None),
+    ('login_failure_count', User.login_failure_count, None),
+    ('login_locked_timestamp', User.login_locked_timestamp, encode_http_date),
+    ('timestamp', User.timestamp, str)
+)
+
+device_projection = Projection(
+    ('device_id', Device.device_id, None),
+    ('user_id', Device.user_id, None),
+    ('manufacturer', Device.manufacturer, None),
+    ('model', Device.model, None),
+    ('serial_no', Device.serial_no, None),
+    ('android_version', Device.android_version, None),
+    ('timestamp', Device.timestamp, str)
+)
+
+reading_projection = Projection(
+    ('reading_id', Reading.reading_id, None),
+    ('device_id', Reading.device_id, None),
+    ('celltower_id', Reading.celltower_id, None),
+    ('latitude', Reading.latitude, str),
+    ('longitude', Reading.longitude, str),
+    ('signal_type', Reading.signal_type, None),
+    ('signal_value', Reading.signal_value, None),
+    ('timestamp', Reading.timestamp, str)
+)
+
+celltower_projection = Projection(
+    ('celltower_id', CellTower.celltower_id, None),
+    ('celltower_name', CellTower.celltower_name, None),
+    ('location_area_code', CellTower.location_area_code, None),
+    ('mobile_country_code', CellTower.mobile_country_code, None),
+    ('mobile_network_code', CellTower.mobile_network_code, None),
+    ('latitude', CellTower.latitude, str),
+    ('longitude', CellTower.longitude, str),
+    ('timestamp', CellTower.timestamp, str)
+)
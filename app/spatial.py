@@ -0,0 +1,53 @@
+from sqlalchemy import func, cast, literal, Integer, Float
+from sqlalchemy.orm import QueryableAttribute
+from sqlalchemy.sql import ColumnElement
+import math
+
+
+# Spatial helpers for the map view.
+#
+# Readings are binned into a grid of square cells in lat/lng degrees. The cell size halves with
+# each map zoom level, so cells are nested: every cell at zoom z is exactly four cells at zoom z+1,
+# which means counts and sums for a coarse grid can be built by adding up the cells of a finer one.
+# A cell is identified by its integer (x, y) position, i.e. floor(lng / size), floor(lat / size).
+
+# Approximate on-screen size of a cell in pixels at the zoom level it was chosen for
+BIN_PIXELS = 8
+
+MIN_ZOOM = 0
+MAX_ZOOM = 21
+
+# Zoom level of the grid the daily reading rollups are kept at (cells of roughly 20m). Map views
+# at this zoom or further out can be answered by adding up rollup cells, see app/rollups.py
+ROLLUP_ZOOM = 16
+
+
+# Number of cells per degree at a zoom level. Google maps tiles are 256 pixels wide and cover
+# 360 / 2^zoom degrees of longitude, so a BIN_PIXELS cell is 360 / 2^zoom / 256 * BIN_PIXELS degrees.
+def cells_per_degree(zoom):
+    return 2 ** zoom * 256 / BIN_PIXELS / 360
+
+
+def cell_size(zoom):
+    return 1 / cells_per_degree(zoom)
+
+
+# The cell index (x of a longitude, y of a latitude) a value falls in on a grid of scale cells per
+# degree, of a value in Python or of a column in SQL. Both are worked out in double precision
+# floats, as the archive's NumPy binning is: the Numeric columns multiplied in SQL as they are
+# would be exact, which can put a reading on a cell boundary in a different cell depending on
+# which of the rollups, the raw readings or the archive a cell's figures come from.
+def grid_cell(value, scale):
+    if isinstance(value, (ColumnElement, QueryableAttribute)):
+        return cast(func.floor(cast(value, Float) * cast(literal(scale), Float)), Integer)
+    return math.floor(float(value) * scale)
+
+
+def clamp_zoom(zoom):
+    return max(MIN_ZOOM, min(MAX_ZOOM, zoom))
+
+
+# South west corner and size of cell (x, y) at a zoom level, as (lat, lng, size)
+def cell_bounds(x, y, zoom):
+    size = cell_size(zoom)
+    return (y * size, x * size, size)
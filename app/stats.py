@@ -0,0 +1,170 @@
+from app import app, db, archive
+from app.models import Reading
+from app.cache import TTLCache
+from app.dialects import is_sqlite
+from datetime import datetime
+from sqlalchemy import event, func, literal_column
+from sqlalchemy.orm import Session
+import numpy as np
+
+
+# signal_value statistics of a device's or a celltower's readings over a time range: count,
+# mean, min, max and the 5th, 50th and 95th percentiles, per signal_type and per hour and
+# signal_type.
+#
+# On Postgres they are computed in the database with aggregate and ordered-set functions
+# (percentile_cont), so only the per group figures are returned. SQLite has no percentile
+# functions, so there the readings' values are fetched and the same figures computed with
+# NumPy, sorting once and reading each group's percentiles off by position with the same
+# linear interpolation as percentile_cont. The NumPy path is also used for devices with
+# archived readings in the range (see app/archive.py), which are included. Celltower statistics
+# only cover the readings in the database, as the archive files are per device.
+#
+# Results for ranges that ended in the past are cached for STATS_CACHE_TTL seconds. Writing a
+# reading drops this process's cached results for its device and celltower once it commits,
+# other processes' caches expire with the TTL.
+
+
+PERCENTILES = (('p5', 0.05), ('p50', 0.5), ('p95', 0.95))
+
+ALL = 'all'     # in place of an id, changes to every device's or celltower's readings
+
+cache = TTLCache(app.config['STATS_CACHE_SIZE'], app.config['STATS_CACHE_TTL'])
+
+
+def device_stats(device_id, start, end):
+    return cached_stats(Reading.device_id, device_id, start, end,
+                        lambda: archive.load_readings(device_id, start, end))
+
+
+def celltower_stats(celltower_id, start, end):
+    return cached_stats(Reading.celltower_id, celltower_id, start, end)
+
+
+def cached_stats(column, row_id, start, end, load_archived=None):
+    key = (column.key, row_id, start, end)
+    closed = end is not None and end <= datetime.utcnow()
+    if closed:
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    query = Reading.query.filter(column == row_id)
+    if start is not None:
+        query = query.filter(Reading.timestamp >= start)
+    if end is not None:
+        query = query.filter(Reading.timestamp < end)
+    archived = load_archived() if load_archived else None
+    if archived is None and not is_sqlite():
+        groups = sql_stats(query)
+    else:
+        groups = numpy_stats(query, archived)
+
+    result = {
+        column.key: row_id,
+        'start': None if start is None else str(start),
+        'end': None if end is None else str(end),
+        'by_signal_type': groups[0],
+        'by_hour': groups[1]
+    }
+    if closed:
+        cache.set(key, result)
+    return result
+
+
+def figures(count, total, minimum, maximum, percentiles):
+    result = {'count': count, 'mean': round(float(total) / count, 2), 'min': minimum, 'max': maximum}
+    for (name, fraction), value in zip(PERCENTILES, percentiles):
+        result[name] = round(float(value), 2)
+    return result
+
+
+def sql_stats(query):
+    aggregates = [func.count(Reading.signal_value), func.sum(Reading.signal_value),
+                  func.min(Reading.signal_value), func.max(Reading.signal_value)] + \
+                 [func.percentile_cont(fraction).within_group(Reading.signal_value) for name, fraction in PERCENTILES]
+
+    by_type = query.with_entities(Reading.signal_type, *aggregates) \
+                .group_by(Reading.signal_type).order_by(Reading.signal_type)
+    # A literal, not a bound parameter, so the grouped expression matches the selected one
+    hour = func.date_trunc(literal_column("'hour'"), Reading.timestamp)
+    by_hour = query.with_entities(hour, Reading.signal_type, *aggregates) \
+                .group_by(hour, Reading.signal_type).order_by(hour, Reading.signal_type)
+
+    return ([dict(signal_type=row[0], **figures(row[1], row[2], row[3], row[4], row[5:])) for row in by_type],
+            [dict(hour=str(row[0]), signal_type=row[1], **figures(row[2], row[3], row[4], row[5], row[6:]))
+             for row in by_hour])
+
+
+def numpy_stats(query, archived):
+    rows = query.with_entities(Reading.signal_type, Reading.timestamp, Reading.signal_value).all()
+    signal_types = np.array([row[0] for row in rows], dtype=object)
+    timestamps = np.array([row[1] for row in rows], dtype='datetime64[us]')
+    values = np.array([row[2] for row in rows], dtype=np.float64)
+    if archived is not None:
+        signal_types = np.concatenate([signal_types, np.char.decode(archived['signal_type']).astype(object)])
+        timestamps = np.concatenate([timestamps, archived['timestamp']])
+        values = np.concatenate([values, np.asarray(archived['signal_value'], dtype=np.float64)])
+    if len(values) == 0:
+        return [], []
+
+    type_names, type_codes = np.unique(signal_types, return_inverse=True)
+    hours, hour_codes = np.unique(timestamps.astype('datetime64[h]'), return_inverse=True)
+
+    by_type = [dict(signal_type=type_names[code], **group) for code, group in group_stats(type_codes, values)]
+    by_hour = [dict(hour=str(hours[code // len(type_names)].astype(datetime)), signal_type=type_names[code % len(type_names)],
+                    **group)
+               for code, group in group_stats(hour_codes * len(type_names) + type_codes, values)]
+    return by_type, by_hour
+
+
+# Figures for each group of values, by integer group code, in code order
+def group_stats(codes, values):
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    groups, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+    sums = np.add.reduceat(values, starts)
+    minimums = values[starts]
+    maximums = values[starts + counts - 1]
+
+    percentiles = []
+    for name, fraction in PERCENTILES:
+        position = starts + fraction * (counts - 1)
+        lower = np.floor(position).astype(int)
+        upper = np.ceil(position).astype(int)
+        percentiles.append(values[lower] + (values[upper] - values[lower]) * (position - lower))
+
+    return [(code, figures(int(count), total, int(minimum), int(maximum), group_percentiles))
+            for code, count, total, minimum, maximum, *group_percentiles
+            in zip(groups.tolist(), counts.tolist(), sums.tolist(), minimums.tolist(), maximums.tolist(),
+                   *(p.tolist() for p in percentiles))]
+
+
+# Called from app/rollups.py with the values of readings added or removed in the current transaction
+def readings_changed(readings):
+    changes = db.session.info.setdefault('stats_changes', set())
+    for values in readings:
+        changes.add(('device_id', values['device_id']))
+        if values.get('celltower_id') is not None:
+            changes.add(('celltower_id', values['celltower_id']))
+
+
+# Called from app/purge.py with devices that are about to be deleted. Their readings go by
+# cascade, without being reported, so every celltower's results are dropped as well.
+def devices_changed(device_ids):
+    changes = db.session.info.setdefault('stats_changes', set())
+    changes.update(('device_id', device_id) for device_id in device_ids)
+    changes.add(('celltower_id', ALL))
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    changes = session.info.pop('stats_changes', None)
+    if changes:
+        cache.invalidate_if(lambda result: any((key, result[key]) in changes or (key, ALL) in changes
+                                               for key in ('device_id', 'celltower_id') if key in result))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_changes(session):
+    session.info.pop('stats_changes', None)
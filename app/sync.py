@@ -0,0 +1,167 @@
+from app import db
+from app.models import User, Device, Reading, CellTower, Tombstone
+from app.dialects import is_sqlite, next_change_seq
+from app.serialization import user_projection, device_projection, reading_projection, celltower_projection
+from sqlalchemy import or_, text
+from collections import deque
+from operator import itemgetter
+import heapq
+import threading
+
+
+# Delta sync for the mobile app, GET /api/v1.0/sync?since=<cursor>.
+#
+# Every insert or update of a user, device, reading or celltower stamps the row with the next
+# value of one shared sequence, its change_seq, and every delete through the REST API leaves a
+# Tombstone stamped the same way. The cursor is a change_seq: a sync returns the rows of the
+# caller's scope, and the tombstones, with change_seq > cursor in change_seq order, plus the
+# cursor to send next time. Each table is read through an index on change_seq, so a sync costs
+# in proportion to what changed rather than to the size of the tables.
+#
+# The scope is what the GET endpoints let the caller see: an admin gets everything, a user gets
+# their own user record, their devices, the readings of their devices and all celltowers.
+#
+# change_seq values are taken when rows are written but become visible when their transactions
+# commit, which needn't be in the same order: a transaction holding change_seq 100 can commit
+# after one holding 101. A cursor moved to 101 before 100 is visible would skip 100 for good, so a
+# sync only returns changes up to safe_change_seq(), below which every change is visible.
+#
+# Rows come back serialized as the list endpoints serialize them. Clients should apply them as
+# upserts by id: a row changed several times since the cursor is only returned once, as it is
+# now. Readings moved out of the database by 'flask archive export' or dropped by the partition
+# retention policy are not reported as deleted, clients keep or age out their copies themselves.
+
+
+SOURCES = (
+    ('users', User, user_projection),
+    ('devices', Device, device_projection),
+    ('readings', Reading, reading_projection),
+    ('celltowers', CellTower, celltower_projection)
+)
+
+
+# Samples of (snapshot xmax, change_seq sequence value) not yet known to be safe, oldest first,
+# and the highest change_seq this process knows to be safe
+pending = deque()
+watermark = 0
+watermark_lock = threading.Lock()
+MAX_PENDING = 1000
+
+
+# The highest change_seq below which every change has been committed or rolled back, so is
+# visible or never will be. Changes above it may still be in flight.
+#
+# On Postgres a transaction takes its id before any change_seq (see dialects.next_change_seq),
+# so when the sequence is read, and then a snapshot taken, every change_seq up to the sequence's
+# value belongs to a transaction with an id below the snapshot's xmax. Once a later snapshot's
+# xmin, the oldest transaction still running, has passed that xmax, all of them have ended and
+# the value is safe. Each call samples the sequence and snapshot and applies the samples that
+# have become safe. So the watermark trails the change sequence by about the longest write
+# transaction running meanwhile, and stands still while one runs for long, e.g. 'flask rollups
+# rebuild', or while a session sits idle in a transaction. A process's first call only gets a
+# watermark straight away if nothing was writing at the time; until then its syncs return no
+# changes. SQLite runs one write transaction at a time, so there every change is visible.
+def safe_change_seq():
+    global watermark
+    if is_sqlite():
+        return db.session.query(next_change_seq()).scalar() - 1
+
+    # The sequence must be read before the snapshot is taken, so in two statements
+    value = db.session.execute(text('SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM change_seq')).scalar()
+    xmin, xmax = db.session.execute(text(
+        'SELECT txid_snapshot_xmin(s), txid_snapshot_xmax(s) FROM txid_current_snapshot() AS s')).one()
+    with watermark_lock:
+        if len(pending) < MAX_PENDING:
+            pending.append((xmax, value))
+        else:
+            pending[-1] = (xmax, value)
+        while pending and pending[0][0] <= xmin:
+            watermark = max(watermark, pending.popleft()[1])
+        return watermark
+
+
+# Rows of a model the user can see
+def scoped(model, user):
+    query = model.query
+    if user.role == "ADMIN":
+        return query
+    if model is User:
+        return query.filter(User.user_id == user.user_id)
+    if model is Device:
+        return query.filter(Device.user_id == user.user_id)
+    if model is Reading:
+        owned = db.session.query(Device.device_id).filter(Device.user_id == user.user_id)
+        return query.filter(Reading.device_id.in_(owned.scalar_subquery()))
+    return query
+
+
+def scoped_tombstones(user):
+    query = Tombstone.query
+    if user.role == "ADMIN":
+        return query
+    return query.filter(or_(Tombstone.user_id == user.user_id, Tombstone.user_id.is_(None)))
+
+
+# The first limit changes after since, up to safe, as (change_seq, section, item) sorted by
+# change_seq. Each table only needs to supply its first limit + 1, enough to tell whether there
+# are more.
+def change_lists(user, since, safe, limit):
+    lists = []
+    for section, model, projection in SOURCES:
+        query = scoped(model, user).filter(model.change_seq > since, model.change_seq <= safe) \
+                    .order_by(model.change_seq).limit(limit + 1)
+        rows = db.session.execute(query.with_entities(model.change_seq, *projection.columns).statement).all()
+        items = projection.items(row[1:] for row in rows)
+        lists.append([(row[0], section, item) for row, item in zip(rows, items)])
+
+    query = scoped_tombstones(user).filter(Tombstone.change_seq > since, Tombstone.change_seq <= safe) \
+                .order_by(Tombstone.change_seq).limit(limit + 1)
+    rows = db.session.execute(query.with_entities(Tombstone.change_seq, Tombstone.table_name,
+                                                  Tombstone.row_id).statement).all()
+    lists.append([(change_seq, 'deleted', (table_name, row_id)) for change_seq, table_name, row_id in rows])
+    return heapq.merge(*lists, key=itemgetter(0))
+
+
+# The changes the user can see after the since cursor, at most limit of them:
+#   {"users": [...], "devices": [...], "readings": [...], "celltowers": [...],
+#    "deleted": {"user": [ids], "device": [ids], "reading": [ids], "celltower": [ids]},
+#    "next": <cursor for the next call>, "more": <whether there are changes after next>}
+def changes(user, since, limit):
+    result = {section: [] for section, model, projection in SOURCES}
+    result['deleted'] = {model.__tablename__: [] for section, model, projection in SOURCES}
+    cursor = since
+    count = 0
+    more = False
+    for change_seq, section, item in change_lists(user, since, safe_change_seq(), limit):
+        if count == limit:
+            more = True
+            break
+        if section == 'deleted':
+            table_name, row_id = item
+            result['deleted'][table_name].append(row_id)
+        else:
+            result[section].append(item)
+        cursor = change_seq
+        count += 1
+    result['next'] = cursor
+    result['more'] = more
+    return result
+
+
+# Unlink the readings of a celltower that is being deleted, as changes to them. On Postgres this
+# is one UPDATE, next_change_seq() giving each row its own change_seq. SQLite works out the next change_seq
+# once per statement, so there each reading is updated on its own.
+def unlink_celltower_readings(celltower_id):
+    query = Reading.query.filter(Reading.celltower_id == celltower_id)
+    if is_sqlite():
+        for (reading_id,) in query.with_entities(Reading.reading_id).all():
+            Reading.query.filter(Reading.reading_id == reading_id) \
+                .update({'celltower_id': None, 'change_seq': next_change_seq()}, synchronize_session=False)
+    else:
+        query.update({'celltower_id': None, 'change_seq': next_change_seq()}, synchronize_session=False)
+
+
+# Record the deletion of a row for the clients that could see it (owner_id None for everyone).
+# Added to the session, so it is committed together with the delete.
+def tombstone(table_name, row_id, owner_id):
+    db.session.add(Tombstone(table_name=table_name, row_id=row_id, user_id=owner_id))
@@ -0,0 +1,343 @@
+from app import app, db
+from app.models import Device
+from app.mapdata import reading_bins
+from app.spatial import MAX_ZOOM, cell_size
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import numpy as np
+import math
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+
+# Coverage heatmap tiles for the map view.
+#
+# Each 256 pixel XYZ (Google / Web Mercator) tile is rendered from the same per-cell statistics
+# the map's bins come from (app/mapdata.py, so whole days come from the rollups and archived
+# readings are included): the mean signal_value is interpolated between the cells by inverse
+# distance weighting, weighted by each cell's reading count and cut off TILE_RADIUS pixels from
+# the nearest cell so the surface stays close to where readings were taken, then coloured with
+# the bands of getCircleColor() in templates/index.html. The interpolation is evaluated with
+# NumPy every TILE_SAMPLE pixels, for all cells at once.
+#
+# Rendered tiles are cached on disk, keyed on the user, the date range and the tile:
+#   TILE_CACHE_DIR/<user_id>/<start>_<end>/<z>/<x>/<y>.png
+# Every code path that writes readings reports them to app/rollups.py, which passes them on to
+# readings_changed(). Once the transaction commits, the cached tiles within TILE_RADIUS pixels of
+# the cell each reading is binned into are deleted from the date ranges that include its day, and
+# all of a user's tiles when one of their devices is deleted. A tile render that overlaps an
+# invalidation, i.e. may have read the readings from before it, isn't cached.
+#
+# Serving a cached tile touches its modification time. At most every TILE_CACHE_PRUNE_INTERVAL
+# seconds a write checks the cache's size in the background, and when it is over
+# TILE_CACHE_MAX_BYTES the least recently used tiles are deleted until it is down to 90% of that.
+
+
+TILE_SIZE = 256
+
+# Fraction of TILE_CACHE_MAX_BYTES a prune leaves the cache at
+PRUNE_TO = 0.9
+
+# Colour bands of getCircleColor(): upper bound of each band (inclusive) and its colour
+BAND_EDGES = np.array([10, 20, 25, 30, 35, 40, 45, 55, 65, 100])
+BAND_COLOURS = ['#166281', '#1E85AE', '#4CB6E1', '#8CD0EC', '#BDCAA1',
+                '#EDC356', '#F3A12F', '#F87F08', '#F04F0D', '#E30018']
+ALPHA = 128     # the map draws the bins at 50% opacity
+
+# RGBA per band, plus transparent for values outside every band and pixels with no data
+PALETTE = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] + [ALPHA] for c in BAND_COLOURS] + [[0, 0, 0, 0]],
+                   dtype=np.uint8)
+
+
+# Global pixel coordinates at a zoom level of a lat/lng, and back
+def to_pixels(lat, lng, zoom):
+    scale = TILE_SIZE * 2 ** zoom
+    lat = np.clip(lat, -85.05112878, 85.05112878)
+    x = (np.asarray(lng) + 180) / 360 * scale
+    y = (1 - np.log(np.tan(np.radians(lat)) + 1 / np.cos(np.radians(lat))) / math.pi) / 2 * scale
+    return x, y
+
+
+def from_pixels(x, y, zoom):
+    scale = TILE_SIZE * 2 ** zoom
+    lng = x / scale * 360 - 180
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale))))
+    return lat, lng
+
+
+def valid_tile(zoom, x, y):
+    return 0 <= zoom <= MAX_ZOOM and 0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom
+
+
+# RGBA pixels (TILE_SIZE x TILE_SIZE x 4) of a user's coverage for start <= timestamp < end
+def render(user_id, start, end, zoom, x, y):
+    radius = app.config['TILE_RADIUS']
+    step = app.config['TILE_SAMPLE']
+    left, top = x * TILE_SIZE, y * TILE_SIZE
+
+    # Cells within the cut off of the tile contribute to it
+    north, west = from_pixels(left - radius, top - radius, zoom)
+    south, east = from_pixels(left + TILE_SIZE + radius, top + TILE_SIZE + radius, zoom)
+    bins = reading_bins(user_id, start, end, zoom, (south, west, north, east))
+
+    samples = TILE_SIZE // step
+    weight_sums = np.zeros(samples * samples)
+    value_sums = np.zeros(samples * samples)
+    if bins:
+        lat = np.array([b['lat'] + b['size'] / 2 for b in bins])
+        lng = np.array([b['lng'] + b['size'] / 2 for b in bins])
+        counts = np.array([b['count'] for b in bins], dtype=np.float64)
+        means = np.array([b['mean'] for b in bins], dtype=np.float64)
+        cell_x, cell_y = to_pixels(lat, lng, zoom)
+
+        # Samples are taken at the centre of each step x step block of the tile. As a cell only
+        # reaches the samples within the cut off, each offset from the sample nearest the cells
+        # is handled for all the cells at once and the weights summed per sample.
+        nearest_i = np.floor((cell_x - left) / step).astype(int)
+        nearest_j = np.floor((cell_y - top) / step).astype(int)
+        reach = int(math.ceil(radius / step))
+        for di in range(-reach, reach + 1):
+            for dj in range(-reach, reach + 1):
+                i, j = nearest_i + di, nearest_j + dj
+                dx = left + i * step + step / 2 - cell_x
+                dy = top + j * step + step / 2 - cell_y
+                squared = dx * dx + dy * dy
+                near = (i >= 0) & (i < samples) & (j >= 0) & (j < samples) & (squared <= radius * radius)
+                if not near.any():
+                    continue
+                weights = counts[near] / (squared[near] + 1)
+                index = j[near] * samples + i[near]
+                weight_sums += np.bincount(index, weights=weights, minlength=samples * samples)
+                value_sums += np.bincount(index, weights=weights * means[near], minlength=samples * samples)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = value_sums / weight_sums
+
+    # Band of each sample, transparent outside 0..100 as getCircleColor() has no colour there
+    bands = np.searchsorted(BAND_EDGES, values, side='left')
+    bands[np.isnan(values) | (values < 0) | (values > BAND_EDGES[-1])] = len(BAND_COLOURS)
+    pixels = PALETTE[bands].reshape(TILE_SIZE // step, TILE_SIZE // step, 4)
+    return pixels.repeat(step, axis=0).repeat(step, axis=1)
+
+
+# Minimal PNG encoder for an RGBA uint8 array: one IDAT, no filtering
+def encode_png(pixels):
+    height, width = pixels.shape[:2]
+    rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, width * 4)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) +
+            chunk(b'IEND', b''))
+
+
+def user_directory(user_id):
+    return os.path.join(app.config['TILE_CACHE_DIR'], str(user_id))
+
+
+def range_name(start, end):
+    return '{}_{}'.format(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+
+
+def tile_path(user_id, start, end, zoom, x, y):
+    return os.path.join(user_directory(user_id), range_name(start, end), str(zoom), str(x), '{}.png'.format(y))
+
+
+# Token that changes whenever a user's tiles are invalidated
+def generation(user_id):
+    try:
+        with open(os.path.join(user_directory(user_id), 'generation')) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_atomically(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+# PNG of a tile, from the cache or rendered and cached
+def tile(user_id, start, end, zoom, x, y):
+    path = tile_path(user_id, start, end, zoom, x, y)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+        return data
+    except FileNotFoundError:
+        pass
+    # A user's first render starts their generation, so an invalidation racing it is noticed
+    before = generation(user_id) or new_generation(user_id)
+    data = encode_png(render(user_id, start, end, zoom, x, y))
+    # If readings changed while rendering, this render is served but not cached
+    if generation(user_id) == before:
+        write_atomically(path, data)
+        schedule_prune()
+    return data
+
+
+pruner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tile-prune')
+prune_lock = threading.Lock()
+last_prune = None
+
+
+def schedule_prune():
+    global last_prune
+    with prune_lock:
+        now = time.monotonic()
+        if last_prune is not None and now - last_prune < app.config['TILE_CACHE_PRUNE_INTERVAL']:
+            return
+        last_prune = now
+    pruner.submit(prune, app.config['TILE_CACHE_DIR'], app.config['TILE_CACHE_MAX_BYTES'])
+
+
+# Delete the least recently used tiles under directory while they add up to more than max_bytes.
+# Returns how many were deleted.
+def prune(directory, max_bytes):
+    tiles = []
+    total = 0
+    for parent, _, names in os.walk(directory):
+        for name in names:
+            if not name.endswith('.png'):
+                continue
+            path = os.path.join(parent, name)
+            try:
+                status = os.stat(path)
+            except FileNotFoundError:
+                continue
+            tiles.append((status.st_mtime, status.st_size, path))
+            total += status.st_size
+    if total <= max_bytes:
+        return 0
+    tiles.sort()
+    deleted = 0
+    for _, size, path in tiles:
+        if total <= max_bytes * PRUNE_TO:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    return deleted
+
+
+# Called from app/rollups.py with the values of readings added or removed in the current transaction
+def readings_changed(readings):
+    changes = db.session.info.setdefault('tile_changes', [])
+    changes.extend((values['device_id'], values['timestamp'], float(values['latitude']), float(values['longitude']))
+                   for values in readings)
+
+
+# Called from app/rollups.py with devices that are about to be deleted, while their owners can
+# still be looked up
+def devices_changed(device_ids):
+    owners = db.session.query(Device.user_id).filter(Device.device_id.in_(device_ids)).distinct()
+    db.session.info.setdefault('tile_users', set()).update(user_id for (user_id,) in owners)
+
+
+# Resolve the devices of changed readings to their users while the transaction can still query
+@event.listens_for(Session, 'before_commit')
+def resolve_users(session):
+    changes = session.info.pop('tile_changes', [])
+    users = session.info.pop('tile_users', set())
+    if not changes and not users:
+        return
+    device_ids = {change[0] for change in changes}
+    owners = dict(session.query(Device.device_id, Device.user_id).filter(Device.device_id.in_(device_ids)).all())
+    session.info['tile_invalidations'] = (
+        [(owners.get(device_id), timestamp, lat, lng) for device_id, timestamp, lat, lng in changes], users)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    changes, users = session.info.pop('tile_invalidations', ([], set()))
+    for user_id in users:
+        if user_id is not None:
+            invalidate_user(user_id)
+    by_user = {}
+    for user_id, timestamp, lat, lng in changes:
+        if user_id is not None and user_id not in users:
+            by_user.setdefault(user_id, []).append((timestamp, lat, lng))
+    for user_id, user_changes in by_user.items():
+        invalidate(user_id, user_changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_changes(session):
+    for key in ('tile_changes', 'tile_users', 'tile_invalidations'):
+        session.info.pop(key, None)
+
+
+def new_generation(user_id):
+    token = uuid.uuid4().hex
+    write_atomically(os.path.join(user_directory(user_id), 'generation'), token.encode())
+    return token
+
+
+def invalidate_user(user_id):
+    directory = user_directory(user_id)
+    if os.path.isdir(directory):
+        new_generation(user_id)
+        for name in os.listdir(directory):
+            if name != 'generation':
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+# Tiles a changed reading can show up in at a zoom level. The reading is drawn at the centre of
+# the cell it is binned into and reaches TILE_RADIUS pixels from there, so the tiles within that
+# plus the cell's half diagonal of the reading itself are affected.
+def affected_tiles(lat, lng, zoom):
+    radius = app.config['TILE_RADIUS']
+    size = cell_size(zoom)
+    south = math.floor(lat / size) * size
+    west = math.floor(lng / size) * size
+    left, bottom = to_pixels(south, west, zoom)
+    right, top = to_pixels(south + size, west + size, zoom)
+    reach = radius + math.hypot(float(right - left), float(bottom - top)) / 2
+    x, y = to_pixels(lat, lng, zoom)
+    return [(tile_x, tile_y)
+            for tile_x in range(int((x - reach) // TILE_SIZE), int((x + reach) // TILE_SIZE) + 1)
+            for tile_y in range(int((y - reach) // TILE_SIZE), int((y + reach) // TILE_SIZE) + 1)]
+
+
+# Delete the cached tiles that changed readings, as (timestamp, lat, lng), fall in or near
+def invalidate(user_id, changes):
+    directory = user_directory(user_id)
+    if not os.path.isdir(directory):
+        return
+    new_generation(user_id)
+    for name in os.listdir(directory):
+        try:
+            start, end = (datetime.strptime(part, '%Y-%m-%d') for part in name.split('_'))
+        except ValueError:
+            continue    # the generation file
+        in_range = [(lat, lng) for timestamp, lat, lng in changes if start <= timestamp < end]
+        if not in_range:
+            continue
+        for zoom_name in os.listdir(os.path.join(directory, name)):
+            zoom = int(zoom_name)
+            tiles = set()
+            for lat, lng in in_range:
+                tiles.update(affected_tiles(lat, lng, zoom))
+            for tile_x, tile_y in tiles:
+                try:
+                    os.remove(os.path.join(directory, name, zoom_name, str(tile_x), '{}.png'.format(tile_y)))
+                except FileNotFoundError:
+                    pass
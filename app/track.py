@@ -0,0 +1,68 @@
+from app import db, archive
+from app.models import Device, Reading
+from sqlalchemy import cast, Float
+import numpy as np
+
+
+# The readings of a user's devices over a date range as a track of points for the map view,
+# thinned server side to a budget so a long range doesn't send every reading to the browser.
+#
+# The readings are put in time order and split into runs of consecutive readings, as many runs
+# as the budget has room for three points each. Every run keeps its first reading, so the track
+# still follows the whole route at an even density, and its lowest and highest signal_value
+# readings, so dead spots and peaks survive however hard a range is thinned. The last reading is
+# kept too. Picking them is a sort and a few array operations over all the runs at once, so a
+# month of readings is thinned in a few tens of milliseconds; fetching them is the larger cost.
+# Archived readings (see app/archive.py) are included.
+
+
+# Returns the number of readings in the range and the thinned points, in time order
+def track(user_id, start, end, budget):
+    timestamps, latitudes, longitudes, values = load_readings(user_id, start, end)
+    order = np.argsort(timestamps, kind='stable')
+    keep = order[thin(values[order], budget)]
+
+    points = []
+    for timestamp, lat, lng, value in zip(timestamps[keep].astype('datetime64[s]').astype(str).tolist(),
+                                           latitudes[keep].tolist(), longitudes[keep].tolist(),
+                                           values[keep].tolist()):
+        points.append({'timestamp': timestamp, 'lat': lat, 'lng': lng, 'value': value})
+    return len(values), points
+
+
+# Indexes of the values (in time order) to keep for at most budget points, ascending
+def thin(values, budget):
+    count = len(values)
+    if count <= budget:
+        return np.arange(count)
+    runs = max(1, (budget - 1) // 3)
+    codes = np.arange(count) * runs // count
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    ends = np.append(starts[1:], count)
+
+    # Sorted by value within each run, the first and last of a run are its lowest and highest
+    by_value = np.lexsort((values, codes))
+    return np.unique(np.concatenate([starts, by_value[starts], by_value[ends - 1], [count - 1]]))
+
+
+# Column arrays of the readings of a user's devices with start <= timestamp < end
+def load_readings(user_id, start, end):
+    rows = db.session.query(Reading.timestamp, cast(Reading.latitude, Float), cast(Reading.longitude, Float),
+                            Reading.signal_value) \
+                .join(Device, Device.device_id == Reading.device_id) \
+                .filter(Device.user_id == user_id, Reading.timestamp >= start, Reading.timestamp < end).all()
+    columns = [np.array([row[0] for row in rows], dtype='datetime64[us]'),
+               np.array([row[1] for row in rows], dtype=np.float64),
+               np.array([row[2] for row in rows], dtype=np.float64),
+               np.array([row[3] for row in rows], dtype=np.int64)]
+
+    device_ids = [device_id for (device_id,) in Device.query.with_entities(Device.device_id)
+                                                      .filter(Device.user_id == user_id)]
+    for device_id in device_ids:
+        archived = archive.load_readings(device_id, start, end)
+        if archived is not None:
+            columns = [np.concatenate([columns[0], archived['timestamp']]),
+                       np.concatenate([columns[1], archived['latitude'].astype(np.float64)]),
+                       np.concatenate([columns[2], archived['longitude'].astype(np.float64)]),
+                       np.concatenate([columns[3], archived['signal_value'].astype(np.int64)])]
+    return columns
@@ -1,14 +1,16 @@
-from flask import render_template, flash, redirect, request, abort, url_for
+from flask import render_template, flash, redirect, request, abort, url_for, Response
 from flask.json import jsonify
-from app import app, db
+from app import app, db, archive, tiles, track, overview
 from app.models import User, Device, Reading, CellTower
 from app.forms import LoginForm
+from app.geolocation import locate_celltowers, celltower_key
+from app.mapdata import reading_bins
+from app.spatial import clamp_zoom
 from flask_login import current_user, login_user, logout_user, login_required
 from werkzeug.urls import url_parse
+from sqlalchemy import or_
 from datetime import datetime, timedelta
 from time import strftime
-import requests
-import json
 
 
 
@@ -25,73 +27,151 @@ def index():
     if request.method == 'GET':
         view_date = datetime.now().strftime('%Y-%m-%d')
         view_user = current_user
-        return render_template('index.html', title='SignalTracker', users=users, view_user=view_user, view_date=view_date)
+        return render_template('index.html', title='SignalTracker', users=users, view_user=view_user, view_date=view_date,
+                                    view_end_date=view_date)
         
     if request.method == 'POST':
         view_date = request.form['datepicker']
+        # The last day of the range, the same day as the first if not given
+        view_end_date = request.form.get('datepickerEnd') or view_date
         view_user = User.query.get(request.form['selectUser'])
+        try:
+            start = datetime.strptime(view_date, "%Y-%m-%d")
+            end = datetime.strptime(view_end_date, "%Y-%m-%d") + timedelta(days=1)
+        except ValueError:
+            abort(400)  # bad date
+        if end <= start:
+            flash('The end date is before the start date')
+            return render_template('index.html', title='SignalTracker', users=users, view_user=view_user,
+                                        view_date=view_date, view_end_date=view_end_date)
 
         # Get the users device
         device = Device.query.filter(Device.user_id == view_user.user_id).one_or_none()
         
-        # Get the readings and celltowers
-        view_date_plus_one_day = datetime.strptime(view_date, "%Y-%m-%d") + timedelta(days=1)
+        # Count the readings and get their celltowers. The readings themselves are fetched by the
+        # map, already binned or thinned, from map_bins() and map_track() below.
         readings = Reading.query.filter(Reading.device_id == device.device_id, 
-                                    Reading.timestamp >= view_date, Reading.timestamp < str(view_date_plus_one_day)).all()
+                                    Reading.timestamp >= start, Reading.timestamp < end)
+        reading_count = readings.count()
+
+        # Older days may have been moved out of the database into the archive files
+        archived_count, archived_celltower_ids = archive.summary(device.device_id, start, end)
+        reading_count += archived_count
 
         # Get the celltowers for the readings
-        celltowers = CellTower.query.filter(CellTower.celltower_id.in_([reading.celltower_id for reading in readings])).all()
+        celltower_ids = readings.with_entities(Reading.celltower_id).distinct()
+        celltowers = CellTower.query.filter(or_(CellTower.celltower_id.in_(celltower_ids),
+                                                CellTower.celltower_id.in_(archived_celltower_ids))).all()
         
+        # Get the approx GPS location of each celltower
+        locations = locate_celltowers(celltowers)
         map_markers = []
-        geolocation_url = 'http://opencellid.org/cell/get'
-
         for celltower in celltowers:
-            query = {
-                "key": app.config['OPENCELLID_API_KEY'],
-                "mcc": celltower.mobile_country_code,
-                "mnc": celltower.mobile_network_code,
-                "lac": celltower.location_area_code,
-                "cellid": celltower.celltower_name,
-                "format": "json"
-            }
-
-            response = requests.get(geolocation_url, params=query)
-            if response.status_code == 200:
-                location = json.loads(response.text)
+            location = locations.get(celltower_key(celltower))
+            if location is not None:
                 map_markers.append({
                     "celltower_name": celltower.celltower_name,
-                    "lat": location["lat"],
-                    "lng": location["lon"]
+                    "lat": location[0],
+                    "lng": location[1]
                 })
 
-        # Google geolocate as an alternative to Opencellid
-        # geolocation_url = 'https://www.googleapis.com/geolocation/v1/geolocate?key={}'.format(app.config['MAPS_API_KEY'])
-
-        # # Get the approx GPS location of each celltower 
-        # for celltower in celltowers:
-        #         query = {
-        #             "cellTowers": [
-        #                 {
-        #                     "cellId": celltower.celltower_name,
-        #                     "locationAreaCode": celltower.location_area_code,
-        #                     "mobileCountryCode": celltower.mobile_country_code,
-        #                     "mobileNetworkCode": celltower.mobile_network_code
-        #                 }
-        #             ]
-        #         }
-
-        #         response = requests.post(geolocation_url, json=query)
-        #         if response.status_code == 200:
-        #             location = json.loads(response.text)
-        #             map_markers.append({
-        #                 "celltower_name": celltower.celltower_name,
-        #                 "lat": location["location"]["lat"],
-        #                 "lng": location["location"]["lng"]
-        #             })
-        
-
         return render_template('index.html', title='SignalTracker', users=users, view_user=view_user, view_date=view_date,
-                                    device=device, readings=readings, map_markers=map_markers, maps_api_key=app.config['MAPS_API_KEY'])
+                                    view_end_date=view_end_date, end_date=end.strftime('%Y-%m-%d'),
+                                    device=device, reading_count=reading_count, map_markers=map_markers, maps_api_key=app.config['MAPS_API_KEY'])
+
+
+# The ?start=YYYY-MM-DD and optional ?end=YYYY-MM-DD (exclusive, one day after start by default)
+# of the map view's requests
+def map_range():
+    if 'start' not in request.args:
+        abort(400)  # missing args
+    try:
+        start = datetime.strptime(request.args['start'], "%Y-%m-%d")
+        end = datetime.strptime(request.args['end'], "%Y-%m-%d") if 'end' in request.args else start + timedelta(days=1)
+    except ValueError:
+        abort(400)  # bad date
+    if end <= start:
+        abort(400)  # empty range
+    return start, end
+
+
+# Readings for the map view binned into a grid sized for the map's zoom level, see app/mapdata.py
+# Expects ?user_id=, ?start=YYYY-MM-DD and ?zoom=, optionally ?end=YYYY-MM-DD, and optionally the
+# map viewport as ?south=&west=&north=&east= so only the visible bins are returned
+@app.route('/map/bins', methods=['GET'])
+@login_required
+def map_bins():
+    user_id = request.args.get('user_id', type=int)
+    zoom = request.args.get('zoom', type=int)
+    if user_id is None or zoom is None:
+        abort(400)  # missing args
+
+    # A non-admin level user is only permitted to view their own readings
+    if current_user.role != 'ADMIN' and user_id != current_user.user_id:
+        abort(403)  # forbidden
+
+    start, end = map_range()
+    bounds = [request.args.get(name, type=float) for name in ('south', 'west', 'north', 'east')]
+    if None in bounds:
+        bounds = None
+
+    zoom = clamp_zoom(zoom)
+    return jsonify({'zoom': zoom, 'bins': reading_bins(user_id, start, end, zoom, bounds)})
+
+
+# Readings for the map view as a track of points in time order, thinned to at most
+# MAP_TRACK_BUDGET points, see app/track.py. Expects ?user_id= and ?start=YYYY-MM-DD, and
+# optionally ?end=YYYY-MM-DD
+@app.route('/map/track', methods=['GET'])
+@login_required
+def map_track():
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None:
+        abort(400)  # missing args
+
+    # A non-admin level user is only permitted to view their own readings
+    if current_user.role != 'ADMIN' and user_id != current_user.user_id:
+        abort(403)  # forbidden
+
+    start, end = map_range()
+    count, points = track.track(user_id, start, end, app.config['MAP_TRACK_BUDGET'])
+    return jsonify({'count': count, 'points': points})
+
+
+# Coverage heatmap tile of a user's readings, see app/tiles.py. Expects ?user_id= and ?start=YYYY-MM-DD,
+# and optionally ?end=YYYY-MM-DD (exclusive, one day after start by default)
+@app.route('/map/tiles/<int:zoom>/<int:x>/<int:y>.png', methods=['GET'])
+@login_required
+def map_tile(zoom, x, y):
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None:
+        abort(400)  # missing args
+    if not tiles.valid_tile(zoom, x, y):
+        abort(404)  # no such tile
+
+    # A non-admin level user is only permitted to view their own readings
+    if current_user.role != 'ADMIN' and user_id != current_user.user_id:
+        abort(403)  # forbidden
+
+    start, end = map_range()
+
+    # Browsers revalidate tiles with If-None-Match, as they change when readings are written
+    response = Response(tiles.tile(user_id, start, end, zoom, x, y), mimetype='image/png')
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+# Admin overview of every user's activity, a page of OVERVIEW_PAGE_SIZE users at a time from
+# ?after=<user_id>, see app/overview.py
+@app.route('/admin/users', methods=['GET'])
+@login_required
+def users_overview():
+    if current_user.role != 'ADMIN':
+        abort(403)  # forbidden
+    after = request.args.get('after', type=int)
+    users, next_after = overview.activity_page(after, app.config['OVERVIEW_PAGE_SIZE'])
+    return render_template('users.html', title='Users', users=users, next_after=next_after)
 
 
 # User login route
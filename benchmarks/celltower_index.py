@@ -0,0 +1,75 @@
+"""Query latency of the in-process celltower spatial index, against brute force.
+
+Builds app/celltower_index.py's grid from synthetic celltowers (scattered around Irvine, as in
+benchmarks/datagen.py) and times k-nearest and map viewport queries at random points in the
+area, next to a linear scan of every tower for the same queries. The answers of the two are
+checked to agree. No database is needed. Results are printed as JSON.
+
+    python -m benchmarks.celltower_index --celltowers 300000 --cell-size 0.01
+"""
+import argparse
+import json
+import random
+from benchmarks.common import load_app, default_database_uri, time_calls
+from benchmarks.datagen import generate_celltowers, ORIGIN, AREA_DEGREES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--celltowers', type=int, default=300000)
+    parser.add_argument('--cell-size', type=float, default=0.01, help='grid cell size in degrees')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--viewport', type=float, default=0.05, help='height of the viewport in degrees')
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--output', help='write the results to this file as well as stdout')
+    args = parser.parse_args()
+
+    load_app(default_database_uri())
+    from app.celltower_index import GridIndex, distance
+
+    towers = [(c['celltower_id'], c['latitude'], c['longitude']) for c in generate_celltowers(args.celltowers)]
+    index = GridIndex(args.cell_size)
+    for celltower_id, lat, lng in towers:
+        index.add(celltower_id, lat, lng)
+
+    rnd = random.Random(1)
+    def point():
+        return ORIGIN[0] + rnd.uniform(-AREA_DEGREES, AREA_DEGREES), ORIGIN[1] + rnd.uniform(-AREA_DEGREES, AREA_DEGREES) * 2
+
+    def viewport():
+        lat, lng = point()
+        return lat, lng, lat + args.viewport, lng + args.viewport * 2
+
+    def scan_nearest(lat, lng):
+        return sorted((distance(lat, lng, t_lat, t_lng), celltower_id) for celltower_id, t_lat, t_lng in towers)[:args.k]
+
+    def scan_within(south, west, north, east):
+        return sorted(c for c, lat, lng in towers if south <= lat <= north and west <= lng <= east)
+
+    for _ in range(10):
+        lat, lng = point()
+        if [c for d, c in index.nearest(lat, lng, args.k)] != [c for d, c in scan_nearest(lat, lng)]:
+            raise SystemExit('nearest disagrees with the linear scan at {}, {}'.format(lat, lng))
+        box = viewport()
+        if index.within(*box) != scan_within(*box):
+            raise SystemExit('within disagrees with the linear scan for {}'.format(box))
+
+    scan_repeat = max(1, args.repeat // 100)
+    results = {
+        'celltowers': len(index),
+        'cells': len(index.cells),
+        'nearest': time_calls(lambda: index.nearest(*point(), args.k), args.repeat),
+        'nearest_scan': time_calls(lambda: scan_nearest(*point()), scan_repeat),
+        'within': time_calls(lambda: index.within(*viewport()), args.repeat),
+        'within_scan': time_calls(lambda: scan_within(*viewport()), scan_repeat)
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import statistics
+import tempfile
+import time
+import yaml
+
+
+# Shared set up for the benchmarks.
+#
+# The app reads its configuration from a secrets file when it is imported, so the benchmarks
+# write a throwaway one pointing at the database under test (a local SQLite file by default)
+# and hand it to the app through SIGNALTRACKER_SECRETS.
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+API_KEY = 'benchmark-api-key'
+
+
+def default_database_uri():
+    return 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'signaltracker_benchmark.db')
+
+
+# Import and configure the app against database_uri, returning (app, db)
+def load_app(database_uri):
+    secrets = {
+        'database': {'uri': database_uri},
+        'secret_key': 'benchmark-secret-key',
+        'api_key': API_KEY,
+        'maps_api_key': 'benchmark-maps-api-key',
+        'opencellid_api_key': 'benchmark-opencellid-api-key'
+    }
+    secrets_file = os.path.join(tempfile.mkdtemp(prefix='signaltracker_benchmark_'), 'secrets.yaml')
+    with open(secrets_file, 'w') as f:
+        yaml.safe_dump(secrets, f)
+    os.environ['SIGNALTRACKER_SECRETS'] = secrets_file
+
+    from app import app, db
+    app.config['SQLALCHEMY_ECHO'] = False
+    return app, db
+
+
+# Drop and recreate every table from app/models.py
+def reset_schema(db):
+    db.drop_all()
+    db.create_all()
+
+
+# Call fn repeat times and return latency figures in milliseconds
+def time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return latency_figures(samples)
+
+
+# Median, 95th percentile, min and max of latency samples in milliseconds
+def latency_figures(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'min_ms': round(samples[0], 3),
+        'max_ms': round(samples[-1], 3)
+    }
@@ -0,0 +1,74 @@
+"""Compare two benchmarks.routes result files, e.g. from before and after a change.
+
+Prints each scenario's median latency, SQL statements and peak memory side by side, and exits
+with status 1 if any scenario got slower than the threshold or runs more SQL statements.
+
+    python -m benchmarks.compare before.json after.json
+    python -m benchmarks.compare before.json after.json --threshold 0.2
+"""
+import argparse
+import json
+import sys
+
+
+FIGURES = (
+    ('median_ms', 'median ms'),
+    ('sql_statements', 'sql'),
+    ('peak_memory_kb', 'peak kB')
+)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(before, after):
+    if not before:
+        return ''
+    return '{:+.0%}'.format((after - before) / before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fractional increase in median latency counted as a regression')
+    args = parser.parse_args()
+
+    before = load(args.before)
+    after = load(args.after)
+    print('before: {} ({})'.format(before.get('commit'), before.get('database')))
+    print('after:  {} ({})'.format(after.get('commit'), after.get('database')))
+    if before.get('parameters') != after.get('parameters'):
+        print('warning: the runs used different parameters')
+    print()
+
+    header = ['scenario']
+    for _, title in FIGURES:
+        header += [title, '', '']
+    rows = [header]
+    regressions = []
+    for name, new in after['scenarios'].items():
+        old = before['scenarios'].get(name)
+        if old is None:
+            continue
+        row = [name]
+        for key, _ in FIGURES:
+            row += [str(old[key]), str(new[key]), change(old[key], new[key])]
+        rows.append(row)
+        if new['median_ms'] > old['median_ms'] * (1 + args.threshold) or new['sql_statements'] > old['sql_statements']:
+            regressions.append(name)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+    if regressions:
+        print('\nregressions: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+
+# Synthetic data for the benchmarks.
+#
+# Each user has one device (as the map view assumes). Celltowers are scattered around Irvine on
+# the UK networks. Readings follow drive-test style tracks: each device makes a number of trips
+# a day from a random start point near Irvine, moving a few metres between readings (one every
+# few seconds) with a slowly wandering heading, and each reading is attributed to one of the
+# celltowers. The same seed always produces the same data.
+
+ORIGIN = (55.63429, -4.64361)       # Irvine, the default centre of the map view
+AREA_DEGREES = 0.5                  # spread of trip start points around the origin
+END_DATE = datetime(2021, 7, 1)     # readings are generated for the days before this
+PASSWORD = 'benchmark-password'     # password of every generated user
+
+
+def generate_users(count):
+    for user_id in range(1, count + 1):
+        yield {
+            'user_id': user_id,
+            'first_name': 'Bench',
+            'last_name': 'User{}'.format(user_id),
+            'email': 'user{}@example.com'.format(user_id),
+            'role': 'USER'
+        }
+
+
+def generate_devices(user_ids, seed=1):
+    rnd = random.Random(seed)
+    for user_id in user_ids:
+        yield {
+            'device_id': user_id,
+            'user_id': user_id,
+            'manufacturer': rnd.choice(('samsung', 'Google', 'OnePlus', 'motorola')),
+            'model': 'Model {}'.format(rnd.randint(1, 20)),
+            'serial_no': 'SERIAL{:06d}'.format(user_id),
+            'android_version': str(rnd.randint(8, 12))
+        }
+
+
+def generate_celltowers(count, seed=1):
+    rnd = random.Random(seed)
+    for celltower_id in range(1, count + 1):
+        yield {
+            'celltower_id': celltower_id,
+            'celltower_name': str(100000 + celltower_id),
+            'location_area_code': str(rnd.randint(1000, 1100)),
+            'mobile_country_code': '234',
+            'mobile_network_code': rnd.choice(('10', '15', '20', '30')),
+            'latitude': round(ORIGIN[0] + rnd.uniform(-AREA_DEGREES, AREA_DEGREES), 6),
+            'longitude': round(ORIGIN[1] + rnd.uniform(-AREA_DEGREES, AREA_DEGREES) * 2, 6)
+        }
+
+
+# Generate reading rows (dicts of Reading column values) for the given devices, spread over
+# the days before end_date
+def generate_readings(device_ids, celltower_ids, readings_per_device, days=30, end_date=END_DATE, seed=1):
+    rnd = random.Random(seed)
+    start_date = end_date - timedelta(days=days)
+    trips_per_day = 4
+    per_trip = max(1, readings_per_device // (days * trips_per_day))
+
+    for device_id in device_ids:
+        remaining = readings_per_device
+        day = 0
+        while remaining > 0:
+            trip_start = start_date + timedelta(days=day % days, hours=rnd.uniform(6, 20))
+            lat = ORIGIN[0] + rnd.uniform(-AREA_DEGREES, AREA_DEGREES)
+            lng = ORIGIN[1] + rnd.uniform(-AREA_DEGREES, AREA_DEGREES) * 2
+            heading = rnd.uniform(0, 2 * math.pi)
+            signal = rnd.randint(10, 60)
+            celltower_id = rnd.choice(celltower_ids)
+            timestamp = trip_start
+            for _ in range(min(per_trip, remaining)):
+                heading += rnd.gauss(0, 0.2)
+                step = rnd.uniform(0.00005, 0.0003)   # roughly 5-30m
+                lat += step * math.cos(heading)
+                lng += step * math.sin(heading) * 1.8
+                signal = min(100, max(0, signal + rnd.randint(-3, 3)))
+                if rnd.random() < 0.01:
+                    celltower_id = rnd.choice(celltower_ids)
+                timestamp += timedelta(seconds=rnd.uniform(1, 5))
+                yield {
+                    'device_id': device_id,
+                    'celltower_id': celltower_id,
+                    'latitude': round(lat, 7),
+                    'longitude': round(lng, 7),
+                    'signal_type': rnd.choice(('LTE', 'LTE', 'LTE', 'WCDMA', 'GSM')),
+                    'signal_value': signal,
+                    'timestamp': timestamp
+                }
+            remaining -= per_trip
+            day += 1
+
+
+# Insert rows into table in chunks with executemany
+def insert_rows(connection, table, rows, chunk_size=10000):
+    chunk = []
+    count = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            connection.execute(table.insert(), chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        connection.execute(table.insert(), chunk)
+        count += len(chunk)
+    return count
+
+
+# Load users, their devices, celltowers and readings_per_device readings for each device.
+# Returns the number of readings loaded.
+def populate(db, users, celltowers, readings_per_device, days=30, pwd_hash='x'):
+    tables = db.metadata.tables
+    with db.engine.begin() as connection:
+        connection.execute(tables['user'].insert(), [dict(user, pwd_hash=pwd_hash) for user in generate_users(users)])
+        connection.execute(tables['device'].insert(), list(generate_devices(range(1, users + 1))))
+        connection.execute(tables['celltower'].insert(), list(generate_celltowers(celltowers)))
+        rows = generate_readings(range(1, users + 1), list(range(1, celltowers + 1)), readings_per_device, days=days)
+        return insert_rows(connection, tables['reading'], rows)
@@ -0,0 +1,71 @@
+"""Rows per second of the list endpoints' JSON serialization, ORM serialize() against projection.
+
+Loads synthetic readings, then encodes the whole reading table as the JSON array that
+GET /api/v1.0/readings streams, both the old way (ORM instances, serialize() and flask.json
+per row) and through reading_projection from app/serialization.py. The two outputs are checked
+to be byte-identical. Results are printed as JSON.
+
+    python -m benchmarks.serialization --readings 200000
+"""
+import argparse
+import json
+import time
+from benchmarks.common import load_app, reset_schema, default_database_uri
+from benchmarks.datagen import populate
+
+
+def serialize_path(query, batch_size):
+    from flask import json
+    query = query.execution_options(stream_results=True).yield_per(batch_size)
+    return '[' + ','.join(json.dumps(row.serialize(), separators=(',', ':')) for row in query) + ']'
+
+
+def projection_path(query, batch_size):
+    from app.serialization import reading_projection
+    return '[' + ','.join(reading_projection.json_batches(query, batch_size)) + ']'
+
+
+def measure(fn, query, batch_size, rows, repeat):
+    best = None
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn(query, batch_size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return output, {'seconds': round(best, 3), 'rows_per_second': round(rows / best)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=default_database_uri(), help='SQLAlchemy database uri')
+    parser.add_argument('--readings', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this file as well as stdout')
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    with app.app_context():
+        from app.models import Reading
+
+        reset_schema(db)
+        loaded = populate(db, 10, 100, args.readings // 10)
+        query = Reading.query.order_by(Reading.reading_id)
+
+        results = {'database': db.engine.dialect.name, 'readings': loaded}
+        old, results['serialize'] = measure(serialize_path, query, args.batch_size, loaded, args.repeat)
+        db.session.remove()
+        new, results['projection'] = measure(projection_path, query, args.batch_size, loaded, args.repeat)
+        results['identical'] = old == new
+        results['speedup'] = round(results['serialize']['seconds'] / results['projection']['seconds'], 2)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""added next_change_seq function
+
+Revision ID: 5e1f0b9c7a24
+Revises: c63159ff777d
+Create Date: 2026-10-17 19:40:12.204518
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1f0b9c7a24'
+down_revision = 'c63159ff777d'
+branch_labels = None
+depends_on = None
+
+
+# Every change_seq is now taken through this function, which gives the transaction its id before
+# taking the sequence value, see safe_change_seq() in app/sync.py
+def upgrade():
+    op.execute("""
+        CREATE OR REPLACE FUNCTION next_change_seq() RETURNS bigint LANGUAGE plpgsql VOLATILE AS $$
+        BEGIN
+            PERFORM txid_current();
+            RETURN nextval('change_seq');
+        END
+        $$
+    """)
+
+
+def downgrade():
+    op.execute('DROP FUNCTION next_change_seq()')
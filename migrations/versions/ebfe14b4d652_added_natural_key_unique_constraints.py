@@ -0,0 +1,119 @@
+"""added natural key unique constraints
+
+Revision ID: ebfe14b4d652
+Revises: 841a0fc661ee
+Create Date: 2026-10-17 13:12:40.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ebfe14b4d652'
+down_revision = '841a0fc661ee'
+branch_labels = None
+depends_on = None
+
+
+# Duplicates created by concurrent uploads are merged into the lowest id of each group before
+# the constraints are added: readings (and for devices their rollups) are repointed at the
+# surviving row and the other rows are deleted. The merge tables are (old_id, new_id) for every
+# row of a duplicate group, the survivor included.
+#
+# Devices are only duplicates of each other when they belong to the same user (or both to no
+# user). A serial_no held by the devices of more than one user can't be merged without moving readings between users,
+# so the upgrade stops and lists them, to be sorted out by hand before it is run again.
+
+def check_shared_serial_nos():
+    shared = {}
+    rows = op.get_bind().execute(sa.text("""
+        SELECT DISTINCT serial_no, user_id FROM device
+        WHERE serial_no IN (SELECT serial_no FROM device GROUP BY serial_no
+                            HAVING count(DISTINCT coalesce(user_id, -1)) > 1)
+        ORDER BY serial_no, user_id
+    """))
+    for serial_no, user_id in rows:
+        shared.setdefault(serial_no, []).append('none' if user_id is None else str(user_id))
+    if shared:
+        raise RuntimeError('Devices of different users share a serial_no, which must be unique: ' +
+                           '; '.join('{} (user_ids {})'.format(serial_no, ', '.join(user_ids))
+                                     for serial_no, user_ids in shared.items()))
+
+
+def merge_devices():
+    op.execute("""
+        CREATE TEMPORARY TABLE device_merge AS
+        SELECT d.device_id AS old_id,
+               (SELECT min(k.device_id) FROM device k
+                WHERE coalesce(k.user_id, -1) = coalesce(d.user_id, -1) AND k.serial_no = d.serial_no) AS new_id
+        FROM device d
+        WHERE (coalesce(d.user_id, -1), d.serial_no) IN
+              (SELECT coalesce(user_id, -1), serial_no FROM device GROUP BY user_id, serial_no HAVING count(*) > 1)
+    """)
+    op.execute("""
+        UPDATE reading
+        SET device_id = (SELECT new_id FROM device_merge WHERE old_id = reading.device_id)
+        WHERE device_id IN (SELECT old_id FROM device_merge WHERE old_id <> new_id)
+    """)
+    # Rollup rows of the merged devices are summed into the survivor's
+    op.execute("""
+        CREATE TEMPORARY TABLE rollup_merge AS
+        SELECT m.new_id AS device_id, r.day, r.cell_x, r.cell_y, r.signal_type,
+               sum(r.count) AS count, sum(r.sum) AS sum, min(r.min) AS min, max(r.max) AS max
+        FROM reading_rollup r JOIN device_merge m ON r.device_id = m.old_id
+        GROUP BY m.new_id, r.day, r.cell_x, r.cell_y, r.signal_type
+    """)
+    op.execute("DELETE FROM reading_rollup WHERE device_id IN (SELECT old_id FROM device_merge)")
+    op.execute("""
+        INSERT INTO reading_rollup (device_id, day, cell_x, cell_y, signal_type, count, sum, min, max)
+        SELECT device_id, day, cell_x, cell_y, signal_type, count, sum, min, max FROM rollup_merge
+    """)
+    op.execute("DELETE FROM device WHERE device_id IN (SELECT old_id FROM device_merge WHERE old_id <> new_id)")
+    op.execute("DROP TABLE rollup_merge")
+    op.execute("DROP TABLE device_merge")
+
+
+def merge_celltowers():
+    op.execute("""
+        CREATE TEMPORARY TABLE celltower_merge AS
+        SELECT c.celltower_id AS old_id,
+               (SELECT min(k.celltower_id) FROM celltower k
+                WHERE k.mobile_country_code = c.mobile_country_code
+                  AND k.mobile_network_code = c.mobile_network_code
+                  AND k.location_area_code = c.location_area_code
+                  AND k.celltower_name = c.celltower_name) AS new_id
+        FROM celltower c
+    """)
+    op.execute("DELETE FROM celltower_merge WHERE old_id = new_id")
+    op.execute("""
+        UPDATE reading
+        SET celltower_id = (SELECT new_id FROM celltower_merge WHERE old_id = reading.celltower_id)
+        WHERE celltower_id IN (SELECT old_id FROM celltower_merge)
+    """)
+    op.execute("DELETE FROM celltower WHERE celltower_id IN (SELECT old_id FROM celltower_merge)")
+    op.execute("DROP TABLE celltower_merge")
+
+
+def upgrade():
+    check_shared_serial_nos()
+    merge_devices()
+    merge_celltowers()
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index('ix_device_serial_no', table_name='device')
+    op.create_index(op.f('ix_device_serial_no'), 'device', ['serial_no'], unique=True)
+    with op.batch_alter_table('celltower') as batch_op:
+        batch_op.create_unique_constraint('uq_celltower_natural_key', ['mobile_country_code', 'mobile_network_code',
+                                                                       'location_area_code', 'celltower_name'])
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # Merged duplicates are not split back out
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('celltower') as batch_op:
+        batch_op.drop_constraint('uq_celltower_natural_key', type_='unique')
+    op.drop_index(op.f('ix_device_serial_no'), table_name='device')
+    op.create_index('ix_device_serial_no', 'device', ['serial_no'], unique=False)
+    # ### end Alembic commands ###
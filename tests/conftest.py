@@ -0,0 +1,115 @@
+import base64
+import functools
+import os
+import tempfile
+import pytest
+import yaml
+from sqlalchemy import event
+
+
+# The app reads its configuration from a secrets file when it is imported, so the tests write a
+# throwaway one, with a SQLite database and data directories under a temporary directory, and
+# hand it to the app through SIGNALTRACKER_SECRETS before anything imports it.
+#
+# SIGNALTRACKER_TEST_DATABASE can instead give the uri of a Postgres database to run against,
+# which the Postgres only tests (marked requires_postgres) need. Its tables are dropped.
+
+TEMP_DIR = tempfile.mkdtemp(prefix='signaltracker_tests_')
+API_KEY = 'test-api-key'
+PASSWORD = 'test-password'
+
+secrets = {
+    'database': {'uri': os.environ.get('SIGNALTRACKER_TEST_DATABASE',
+                                       'sqlite:///' + os.path.join(TEMP_DIR, 'test.db'))},
+    'secret_key': 'test-secret-key',
+    'api_key': API_KEY,
+    'maps_api_key': 'test-maps-api-key',
+    'opencellid_api_key': 'test-opencellid-api-key',
+    'readings_archive_dir': os.path.join(TEMP_DIR, 'archive'),
+    'tile_cache_dir': os.path.join(TEMP_DIR, 'tile_cache'),
+    'opencellid_db_dir': os.path.join(TEMP_DIR, 'opencellid')
+}
+secrets_file = os.path.join(TEMP_DIR, 'secrets.yaml')
+with open(secrets_file, 'w') as f:
+    yaml.safe_dump(secrets, f)
+os.environ['SIGNALTRACKER_SECRETS'] = secrets_file
+
+from app import app as flask_app, db
+
+requires_postgres = pytest.mark.skipif(not secrets['database']['uri'].startswith('postgresql'),
+                                       reason='needs Postgres, set SIGNALTRACKER_TEST_DATABASE')
+
+
+def api_headers(email):
+    credentials = base64.b64encode('{}:{}'.format(email, PASSWORD).encode()).decode()
+    return {'Authorization': 'Basic ' + credentials, 'x-api-key': API_KEY}
+
+
+# Hashing is deliberately slow, so every test user shares the one hash
+@functools.lru_cache()
+def password_hash():
+    from passlib.apps import custom_app_context as pwd_context
+    return pwd_context.hash(PASSWORD)
+
+
+# The app with a freshly created, empty schema, inside an app context
+@pytest.fixture
+def app():
+    from app import sync, celltower_index, stats
+    from app.api_routes import credential_cache
+    from app.geolocation import location_cache
+
+    flask_app.config['TESTING'] = True
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    credential_cache.clear()
+    location_cache.clear()
+    stats.cache.clear()
+    # The change sequence starts again with the schema
+    sync.pending.clear()
+    sync.watermark = 0
+    celltower_index.index = None
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# The SQL statements a test runs, as they are sent to the database
+@pytest.fixture
+def statements(app):
+    executed = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', count)
+
+
+# An admin, two users with a device each and a celltower. Returns their ids, as the objects
+# themselves are detached once a request ends the session.
+@pytest.fixture
+def data(app):
+    from app.models import User, Device, CellTower
+
+    users = []
+    for email, role in (('admin@example.com', 'ADMIN'), ('user@example.com', 'USER'), ('other@example.com', 'USER')):
+        users.append(User(first_name=role.title(), last_name='Test', email=email, role=role, pwd_hash=password_hash()))
+    db.session.add_all(users)
+    db.session.commit()
+
+    devices = [Device(user_id=user.user_id, manufacturer='Test', model='Test', serial_no='serial-{}'.format(user.user_id),
+                      android_version='11') for user in users[1:]]
+    celltower = CellTower(celltower_name='12345', location_area_code='100', mobile_country_code='234',
+                          mobile_network_code='10', latitude=55.6, longitude=-4.6)
+    db.session.add_all(devices + [celltower])
+    db.session.commit()
+    return {'admin': users[0].user_id, 'user': users[1].user_id, 'other': users[2].user_id,
+            'device': devices[0].device_id, 'other_device': devices[1].device_id, 'celltower': celltower.celltower_id}
@@ -0,0 +1,37 @@
+from app import db
+from app.models import Device, Reading
+from conftest import api_headers
+
+
+def reading_of(device_id, celltower_id):
+    reading = Reading(device_id=device_id, celltower_id=celltower_id,
+                      latitude=55.6, longitude=-4.6, signal_type='LTE', signal_value=50)
+    db.session.add(reading)
+    db.session.commit()
+    return reading.reading_id
+
+
+def request(client, method, reading_id, headers=(), **kwargs):
+    db.session.remove()
+    return client.open('/api/v1.0/readings/{}'.format(reading_id), method=method,
+                       headers=dict(api_headers('user@example.com'), **dict(headers)), **kwargs).status_code
+
+
+# As before the single query checks: getting a reading without a device is a 404 and one whose
+# device has no user a 409, while updating or deleting either is a 409
+def test_statuses_of_readings_without_an_owner(client, data):
+    no_device = reading_of(None, data['celltower'])
+    device = Device(user_id=None, manufacturer='Test', model='Test', serial_no='orphan', android_version='11')
+    db.session.add(device)
+    db.session.commit()
+    no_user = reading_of(device.device_id, data['celltower'])
+
+    assert request(client, 'GET', no_device) == 404
+    assert request(client, 'GET', no_device, headers={'If-None-Match': '"1"'}) == 404
+    assert request(client, 'GET', no_user, headers={'If-None-Match': '"1"'}) == 409
+    assert request(client, 'GET', no_user) == 409
+    assert request(client, 'PUT', no_device, json={'signal_value': 1}) == 409
+    assert request(client, 'DELETE', no_device) == 409
+    assert request(client, 'DELETE', no_user) == 409
+    assert request(client, 'GET', reading_of(data['other_device'], data['celltower'])) == 403
+    assert request(client, 'GET', no_device + 1000) == 404
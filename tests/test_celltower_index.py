@@ -0,0 +1,44 @@
+from sqlalchemy.orm import Session
+from app import db, celltower_index
+from app.models import CellTower
+from conftest import requires_postgres
+
+
+def new_celltower(session, name, lat, lng):
+    celltower = CellTower(celltower_name=name, location_area_code='100', mobile_country_code='234',
+                          mobile_network_code='10', latitude=lat, longitude=lng)
+    session.add(celltower)
+    session.flush()
+    return celltower.celltower_id
+
+
+def nearest(lat, lng):
+    db.session.remove()
+    celltower_index.changed()
+    return [celltower_id for distance, celltower_id in celltower_index.nearest(lat, lng, 1)]
+
+
+def test_picks_up_towers_written_after_it_was_built(app, data):
+    assert nearest(55.6, -4.6) == [data['celltower']]
+    added = new_celltower(db.session, '54321', 51.5, -0.1)
+    db.session.commit()
+    assert nearest(51.5, -0.1) == [added]
+
+
+# A tower that commits after one with a higher change_seq must still be indexed
+@requires_postgres
+def test_towers_committed_out_of_order_are_not_skipped(app, data):
+    nearest(0, 0)
+    first, second = Session(bind=db.engine), Session(bind=db.engine)
+    try:
+        slow = new_celltower(first, 'slow', 10, 10)        # takes the lower change_seq
+        fast = new_celltower(second, 'fast', 20, 20)
+        second.commit()
+        nearest(20, 20)
+
+        first.commit()
+        assert nearest(10, 10) == [slow]
+        assert nearest(20, 20) == [fast]
+    finally:
+        first.close()
+        second.close()
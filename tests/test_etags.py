@@ -0,0 +1,78 @@
+from app import db
+from app.models import Reading
+from conftest import api_headers
+
+
+# The response is read in full, as the streamed celltower list holds its request context until it is
+def request(client, method, url, headers=(), email='user@example.com', **kwargs):
+    db.session.remove()
+    response = client.open(url, method=method, headers=dict(api_headers(email), **dict(headers)), **kwargs)
+    response.get_data()
+    return response
+
+
+def new_reading(data, device):
+    reading = Reading(device_id=data[device], celltower_id=data['celltower'],
+                      latitude=55.6, longitude=-4.6, signal_type='LTE', signal_value=50)
+    db.session.add(reading)
+    db.session.commit()
+    return '/api/v1.0/readings/{}'.format(reading.reading_id)
+
+
+def test_if_none_match(client, data):
+    url = new_reading(data, 'device')
+    etag = request(client, 'GET', url).headers['ETag']
+
+    response = request(client, 'GET', url, {'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == b''
+
+    assert request(client, 'PUT', url, json={'signal_value': 60}).status_code == 200
+    response = request(client, 'GET', url, {'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['signal_value'] == 60
+
+
+def test_if_none_match_is_checked_after_ownership(client, data):
+    url = new_reading(data, 'other_device')
+    etag = request(client, 'GET', url, email='other@example.com').headers['ETag']
+    assert request(client, 'GET', url, {'If-None-Match': etag}).status_code == 403
+
+    url = '/api/v1.0/devices/{}'.format(data['other_device'])
+    etag = request(client, 'GET', url, email='other@example.com').headers['ETag']
+    assert request(client, 'GET', url, {'If-None-Match': etag}, email='other@example.com').status_code == 304
+    assert request(client, 'GET', url, {'If-None-Match': etag}).status_code == 403
+
+
+def test_if_match(client, data):
+    url = new_reading(data, 'device')
+    stale = request(client, 'GET', url).headers['ETag']
+    current = request(client, 'PUT', url, json={'signal_value': 60}).headers['ETag']
+
+    assert request(client, 'PUT', url, {'If-Match': stale}, json={'signal_value': 70}).status_code == 412
+    assert request(client, 'DELETE', url, {'If-Match': stale}).status_code == 412
+    assert request(client, 'GET', url).get_json()['signal_value'] == 60
+
+    current = request(client, 'PUT', url, {'If-Match': current}, json={'signal_value': 70}).headers['ETag']
+    assert request(client, 'DELETE', url, {'If-Match': current}).status_code == 204
+
+
+def test_celltower_list_version(client, data):
+    url = '/api/v1.0/celltowers'
+    etag = request(client, 'GET', url).headers['ETag']
+    assert request(client, 'GET', url, {'If-None-Match': etag}).status_code == 304
+
+    response = request(client, 'POST', url, json={
+        'celltower_name': '54321', 'location_area_code': '100', 'mobile_country_code': '234',
+        'mobile_network_code': '10', 'latitude': 51.5, 'longitude': -0.1})
+    added = response.get_json()['celltower_id']
+    response = request(client, 'GET', url, {'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    assert request(client, 'DELETE', '{}/{}'.format(url, added), email='admin@example.com').status_code == 204
+    response = request(client, 'GET', url, {'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [celltower['celltower_id'] for celltower in response.get_json()] == [data['celltower']]
@@ -0,0 +1,87 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pytest
+from app.geolocation import locate_celltowers, celltower_key, location_cache
+from app.models import CellTower, CellTowerLocation
+
+
+# Stand-in for the OpenCellID cell/get API. Knows the cells in CELLS, answers 404 for any other
+# (or status for every cell, when it is set) and records the query of every request.
+class OpenCellIdHandler(BaseHTTPRequestHandler):
+    CELLS = {('234', '10', '100', '12345'): (55.6, -4.6)}
+    status = None
+    queries = []
+
+    def do_GET(self):
+        query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+        self.queries.append(query)
+        location = self.CELLS.get((query['mcc'], query['mnc'], query['lac'], query['cellid']))
+        if self.status is not None or location is None:
+            self.send_response(self.status or 404)
+            self.end_headers()
+            return
+        body = json.dumps({'lat': location[0], 'lon': location[1]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def opencellid(app):
+    OpenCellIdHandler.queries = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OpenCellIdHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = app.config['OPENCELLID_URL']
+    app.config['OPENCELLID_URL'] = 'http://127.0.0.1:{}/cell/get'.format(server.server_port)
+    yield OpenCellIdHandler.queries
+    app.config['OPENCELLID_URL'] = url
+    server.shutdown()
+    server.server_close()
+
+
+def celltower(name):
+    return CellTower(celltower_name=name, location_area_code='100', mobile_country_code='234',
+                     mobile_network_code='10', latitude=0, longitude=0)
+
+
+def test_locates_celltowers_with_opencellid(app, opencellid):
+    known, unknown = celltower('12345'), celltower('99999')
+
+    locations = locate_celltowers([known, unknown])
+
+    assert locations == {celltower_key(known): (55.6, -4.6)}
+    assert sorted(query['cellid'] for query in opencellid) == ['12345', '99999']
+    assert opencellid[0]['key'] == app.config['OPENCELLID_API_KEY']
+    stored = {row.celltower_name: row for row in CellTowerLocation.query.all()}
+    assert stored['12345'].found and float(stored['12345'].latitude) == 55.6
+    assert not stored['99999'].found
+
+
+def test_answers_repeat_lookups_without_opencellid(app, opencellid):
+    locate_celltowers([celltower('12345'), celltower('99999')])
+    del opencellid[:]
+
+    # From the in-process cache, then from the celltower_location table
+    assert locate_celltowers([celltower('12345'), celltower('99999')]) == {celltower_key(celltower('12345')): (55.6, -4.6)}
+    location_cache.clear()
+    assert locate_celltowers([celltower('12345'), celltower('99999')]) == {celltower_key(celltower('12345')): (55.6, -4.6)}
+    assert opencellid == []
+
+
+def test_retries_failed_lookups(app, opencellid):
+    OpenCellIdHandler.status = 500
+    try:
+        assert locate_celltowers([celltower('12345')]) == {}
+    finally:
+        OpenCellIdHandler.status = None
+    assert CellTowerLocation.query.count() == 0
+
+    assert locate_celltowers([celltower('12345')]) == {celltower_key(celltower('12345')): (55.6, -4.6)}
+    assert len(opencellid) == 2
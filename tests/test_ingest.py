@@ -0,0 +1,75 @@
+import time
+import pytest
+from app import db, ingest
+from app.models import Reading
+from conftest import api_headers
+
+
+@pytest.fixture
+def queue(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'READINGS_INGEST_MODE', 'queue')
+    monkeypatch.setitem(app.config, 'READINGS_INGEST_QUEUE_SIZE', 3)
+    monkeypatch.setitem(app.config, 'READINGS_INGEST_BATCH', 2)
+    monkeypatch.setitem(app.config, 'READINGS_INGEST_INTERVAL', 60)
+    yield app.config
+    # Stop the writer before the schema goes, and leave the module ready to start another
+    ingest.stop()
+    ingest.stopping = False
+    ingest.writer = None
+    ingest.pending.clear()
+
+
+def post(client, data, signal_value=50):
+    return client.post('/api/v1.0/readings', headers=api_headers('user@example.com'), json={
+        'device_id': data['device'], 'celltower_id': data['celltower'],
+        'latitude': 55.6, 'longitude': -4.6, 'signal_type': 'LTE', 'signal_value': signal_value})
+
+
+def written():
+    db.session.remove()
+    return Reading.query.count()
+
+
+def wait_for(count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while written() != count and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return written()
+
+
+def test_queued_readings_are_acknowledged(client, data, queue):
+    response = post(client, data)
+    assert response.status_code == 202
+    body = response.get_json()
+    assert 'reading_id' not in body
+    assert (body['device_id'], body['latitude'], body['signal_value']) == (data['device'], '55.6', 50)
+    assert written() == 0
+
+
+def test_full_queue_is_refused(client, data, queue):
+    queue['READINGS_INGEST_BATCH'] = 10
+    assert [post(client, data).status_code for _ in range(4)] == [202, 202, 202, 429]
+    assert written() == 0
+
+
+def test_flushed_once_a_batch_is_waiting(client, data, queue):
+    assert post(client, data).status_code == 202
+    time.sleep(0.1)
+    assert written() == 0
+    assert post(client, data).status_code == 202
+    assert wait_for(2) == 2
+
+
+def test_flushed_once_the_interval_has_passed(client, data, queue):
+    queue['READINGS_INGEST_INTERVAL'] = 0.2
+    assert post(client, data).status_code == 202
+    assert wait_for(1) == 1
+
+
+def test_flushed_on_stop(client, data, queue):
+    queue['READINGS_INGEST_BATCH'] = 10
+    for signal_value in range(3):
+        assert post(client, data, signal_value).status_code == 202
+    ingest.stop()
+    assert written() == 3
+    assert post(client, data).status_code == 429
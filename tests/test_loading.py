@@ -0,0 +1,35 @@
+import logging
+import pytest
+from app import app as flask_app
+from app.loading import UnboundedLoadError
+from app.models import User, Device
+
+
+def test_unbounded_relationship_loads_raise_while_testing(app, data):
+    device = Device.query.get(data['device'])
+    with pytest.raises(UnboundedLoadError):
+        device.readings.all()
+    with pytest.raises(UnboundedLoadError):
+        list(device.readings)
+    with pytest.raises(UnboundedLoadError):
+        for _ in User.query.get(data['user']).devices:
+            pass
+
+
+def test_bounded_relationship_loads(app, data):
+    device = Device.query.get(data['device'])
+    assert device.readings.limit(10).all() == []
+    assert device.readings[:10] == []
+    assert device.readings.count() == 0
+    assert device.readings.first() is None
+    assert device.readings.paginate(page=1, per_page=10, error_out=False).items == []
+
+
+def test_unbounded_loads_are_logged_once(app, data, monkeypatch, caplog):
+    monkeypatch.setattr(flask_app, 'testing', False)
+    device = Device.query.get(data['device'])
+    with caplog.at_level(logging.WARNING, logger=flask_app.logger.name):
+        assert device.readings.all() == []
+        assert list(device.readings) == []
+    assert [record.getMessage() for record in caplog.records] == \
+        ['Unbounded load of Reading, add a limit or paginate'] * 2
@@ -0,0 +1,35 @@
+import random
+from datetime import datetime, timedelta
+from app import db
+from app.mapdata import reading_bins
+from app.spatial import cells_per_degree, grid_cell, ROLLUP_ZOOM
+from conftest import api_headers
+
+
+def test_grid_cell_of_a_value_and_a_column_agree(app):
+    for zoom in (3, 11, ROLLUP_ZOOM, 20):
+        scale = cells_per_degree(zoom)
+        for value in (0, 1 / scale, -1 / scale, 123 / scale, -4567 / scale, 55.6, -4.6, 179.9999999):
+            assert db.session.query(grid_cell(db.literal(value), scale)).scalar() == grid_cell(value, scale)
+
+
+# A day's bins from the rollups and from the raw readings put readings on cell boundaries alike
+def test_rollup_and_raw_bins_agree(client, data):
+    rnd = random.Random(2)
+    scale = cells_per_degree(ROLLUP_ZOOM)
+    for _ in range(40):
+        response = client.post('/api/v1.0/readings', headers=api_headers('user@example.com'), json={
+            'device_id': data['device'], 'celltower_id': data['celltower'],
+            'latitude': round(rnd.randint(int(55 * scale), int(56 * scale)) / scale, 7),
+            'longitude': round(rnd.randint(int(-5 * scale), int(-4 * scale)) / scale, 7),
+            'signal_type': 'LTE', 'signal_value': rnd.randint(0, 100)})
+        assert response.status_code == 201
+
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    for zoom in (ROLLUP_ZOOM - 4, ROLLUP_ZOOM):
+        from_rollups = reading_bins(data['user'], today, today + timedelta(days=1), zoom)
+        # A start that isn't midnight makes the raw readings answer
+        from_readings = reading_bins(data['user'], today + timedelta(microseconds=1), today + timedelta(days=1), zoom)
+        assert sorted(from_rollups, key=lambda b: (b['lat'], b['lng'])) == \
+            sorted(from_readings, key=lambda b: (b['lat'], b['lng']))
+        assert sum(b['count'] for b in from_rollups) == 40
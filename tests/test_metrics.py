@@ -0,0 +1,37 @@
+import pytest
+from app import metrics
+from conftest import api_headers
+
+
+@pytest.fixture
+def token(app):
+    app.config['METRICS_TOKEN'] = 'test-metrics-token'
+    yield 'test-metrics-token'
+    app.config['METRICS_TOKEN'] = None
+
+
+def test_metrics_are_off_without_a_token(client):
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_need_the_token(client, token):
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer ' + token})
+    assert response.status_code == 200
+    assert b'# TYPE signaltracker_http_requests_total counter' in response.data
+
+
+def sql_statements_of(endpoint):
+    histogram = metrics.http_request_sql_statements
+    name = histogram.name + '_sum' + metrics.format_labels(histogram.labels, (endpoint, 'GET'))
+    return dict(histogram.samples()).get(name, 0)
+
+
+def test_sql_of_streamed_responses_is_counted(client, data):
+    before = sql_statements_of('/api/v1.0/readings')
+    response = client.get('/api/v1.0/readings', headers=api_headers('admin@example.com'))
+    assert response.status_code == 200
+    response.get_data()
+    # The authentication lookup, then the readings queried while the body streams
+    assert sql_statements_of('/api/v1.0/readings') - before >= 2
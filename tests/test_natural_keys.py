@@ -0,0 +1,53 @@
+from app import db
+from app.dialects import insert_or_select
+from app.models import Device, CellTower
+from conftest import api_headers
+
+CELLTOWER = {'celltower_name': '12345', 'location_area_code': '100', 'mobile_country_code': '234',
+             'mobile_network_code': '10', 'latitude': 51.5, 'longitude': -0.1}
+
+
+def request(client, method, url, json, email='user@example.com'):
+    db.session.remove()
+    return client.open(url, method=method, headers=api_headers(email), json=json)
+
+
+def test_insert_or_select_returns_the_existing_row(app, data):
+    key = ['mobile_country_code', 'mobile_network_code', 'location_area_code', 'celltower_name']
+    columns = [CellTower.celltower_id, CellTower.latitude]
+    existing = insert_or_select(CellTower.__table__, CELLTOWER, key, columns)
+    assert existing.celltower_id == data['celltower']
+    assert float(existing.latitude) == 55.6
+    added = insert_or_select(CellTower.__table__, dict(CELLTOWER, celltower_name='54321'), key, columns)
+    assert added.celltower_id != data['celltower']
+    assert float(added.latitude) == 51.5
+    assert CellTower.query.count() == 2
+
+
+def test_creating_an_existing_device_returns_it(client, data):
+    device = {'user_id': data['user'], 'manufacturer': 'Other', 'model': 'Other',
+              'serial_no': 'serial-{}'.format(data['user']), 'android_version': '12'}
+    response = request(client, 'POST', '/api/v1.0/devices', device)
+    assert response.status_code == 201
+    assert response.get_json()['device_id'] == data['device']
+    assert response.get_json()['manufacturer'] == 'Test'
+    assert Device.query.filter_by(user_id=data['user']).count() == 1
+
+
+def test_creating_an_existing_celltower_returns_it(client, data):
+    response = request(client, 'POST', '/api/v1.0/celltowers', CELLTOWER)
+    assert response.status_code == 201
+    assert response.get_json()['celltower_id'] == data['celltower']
+    assert float(response.get_json()['latitude']) == 55.6
+    assert CellTower.query.count() == 1
+
+
+def test_updates_onto_an_existing_key_conflict(client, data):
+    url = '/api/v1.0/devices/{}'.format(data['device'])
+    serial_no = 'serial-{}'.format(data['other'])
+    assert request(client, 'PUT', url, {'serial_no': serial_no}, 'admin@example.com').status_code == 409
+
+    other = request(client, 'POST', '/api/v1.0/celltowers', dict(CELLTOWER, celltower_name='54321')).get_json()
+    url = '/api/v1.0/celltowers/{}'.format(other['celltower_id'])
+    assert request(client, 'PUT', url, {'celltower_name': '12345'}, 'admin@example.com').status_code == 409
+    assert request(client, 'PUT', url, {'celltower_name': '99999'}, 'admin@example.com').status_code == 200
@@ -0,0 +1,70 @@
+import gzip
+import os
+import shutil
+import pytest
+from app import opencellid
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'opencellid.csv')
+
+
+@pytest.fixture
+def database(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'OPENCELLID_DB_DIR', str(tmp_path / 'opencellid'))
+    monkeypatch.setattr(opencellid, 'loaded_from', None)
+    opencellid.loaded.clear()
+    return tmp_path
+
+
+def test_lookup_finds_imported_cells(database):
+    # A chunk size of 2 spreads the rows, and a cell's duplicates, over several chunks
+    assert opencellid.import_dump(FIXTURE, chunk_size=2) == (4, 2)
+    locations = opencellid.lookup([('234', '10', '100', '12345'), ('234', '15', '16000000', '268435455'),
+                                   ('310', '260', '200', '1'), ('234', '10', '100', '12346')])
+    expected = {
+        ('234', '10', '100', '12345'): (55.5, -4.5),       # the row with the most samples
+        ('234', '15', '16000000', '268435455'): (51.5072, -0.1275),
+        ('310', '260', '200', '1'): (37.7749, -122.4194),
+        ('234', '10', '100', '12346'): (55.7, -4.7),
+    }
+    # The coordinates are stored as float32, good to about a metre
+    assert locations.keys() == expected.keys()
+    for key, location in expected.items():
+        assert locations[key] == pytest.approx(location, abs=1e-5)
+
+
+def test_lookup_leaves_out_unknown_keys(database):
+    opencellid.import_dump(FIXTURE)
+    assert opencellid.lookup([('234', '10', '100', '1'),          # unknown cell
+                              ('234', '10', '101', '12345'),      # unknown area
+                              ('999', '10', '100', '12345'),      # unknown country
+                              ('234', '10', '100', '99'),         # skipped on import
+                              ('234', None, '100', '12345'),
+                              ('234', '-1', '100', '12345')]) == {}
+
+
+def test_lookup_without_a_database(database):
+    assert opencellid.lookup([('234', '10', '100', '12345')]) == {}
+
+
+def test_reimport_is_noticed(database):
+    gzipped = str(database / 'dump.csv.gz')
+    with open(FIXTURE, 'rb') as source, gzip.open(gzipped, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    opencellid.import_dump(gzipped)
+    assert ('310', '260', '200', '1') in opencellid.lookup([('310', '260', '200', '1')])
+
+    headerless = str(database / 'dump.csv')
+    with open(FIXTURE) as f:
+        rows = f.readlines()[1:]
+    with open(headerless, 'w') as f:
+        f.writelines(row for row in rows if not row.startswith('GSM,310,'))
+    assert opencellid.import_dump(headerless) == (3, 2)
+    assert opencellid.lookup([('310', '260', '200', '1')]) == {}
+
+
+def test_import_after_a_crashed_swap(database):
+    opencellid.import_dump(FIXTURE)
+    os.makedirs(str(database / 'opencellid.old' / '234'))
+    assert opencellid.import_dump(FIXTURE) == (4, 2)
+    assert not os.path.exists(str(database / 'opencellid.old'))
+    assert ('310', '260', '200', '1') in opencellid.lookup([('310', '260', '200', '1')])
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from app import db
+from app.models import Device, Reading
+from conftest import api_headers
+
+
+def get(client, url, email='admin@example.com'):
+    db.session.remove()
+    return client.get(url, headers=api_headers(email))
+
+
+def add_readings(client, data, device_id, timestamps):
+    response = client.post('/api/v1.0/readings/batch', headers=api_headers('admin@example.com'), json=[{
+        'device_id': device_id, 'celltower_id': data['celltower'], 'latitude': 55.6, 'longitude': -4.6,
+        'signal_type': 'LTE', 'signal_value': 50, 'timestamp': timestamp.isoformat()} for timestamp in timestamps])
+    assert [result['status'] for result in response.get_json()] == [201] * len(timestamps)
+
+
+def test_activity(client, data):
+    second = Device(user_id=data['user'], manufacturer='Test', model='Test', serial_no='second', android_version='11')
+    db.session.add(second)
+    db.session.commit()
+    recent = datetime.utcnow().replace(microsecond=0) - timedelta(hours=1)
+    add_readings(client, data, data['device'], [datetime(2026, 1, 1, 10), datetime(2026, 1, 2, 11)])
+    add_readings(client, data, second.device_id, [recent])
+
+    items = get(client, '/api/v1.0/overview/users').get_json()['items']
+    assert [item['email'] for item in items] == ['admin@example.com', 'user@example.com', 'other@example.com']
+    admin, user, other = items
+    assert (admin['devices'], admin['readings'], admin['first_reading'], admin['readings_24h']) == (0, 0, None, 0)
+    assert (user['devices'], user['readings'], user['readings_24h']) == (2, 3, 1)
+    assert (user['first_reading'], user['last_reading']) == ('2026-01-01 10:00:00', str(recent))
+    assert (other['devices'], other['readings'], other['last_reading']) == (1, 0, None)
+
+    # Readings gone from the table, as archived ones are, still count, their times known to the day
+    Reading.query.filter(Reading.timestamp < datetime(2026, 1, 2)).delete()
+    db.session.commit()
+    user = get(client, '/api/v1.0/overview/users').get_json()['items'][1]
+    assert (user['readings'], user['first_reading']) == (3, '2026-01-01 00:00:00')
+
+
+def test_paging(client, data):
+    first = get(client, '/api/v1.0/overview/users?limit=2').get_json()
+    assert [item['user_id'] for item in first['items']] == [data['admin'], data['user']]
+    assert first['next_after'] == data['user']
+    second = get(client, '/api/v1.0/overview/users?limit=2&after={}'.format(first['next_after'])).get_json()
+    assert [item['user_id'] for item in second['items']] == [data['other']]
+    assert second['next_after'] is None
+
+    for query in ('limit=0', 'limit=x', 'after=x'):
+        assert get(client, '/api/v1.0/overview/users?' + query).status_code == 400
+    assert get(client, '/api/v1.0/overview/users', 'user@example.com').status_code == 403
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.models import Reading
+from conftest import api_headers
+
+
+@pytest.fixture
+def reading_ids(data):
+    readings = [Reading(device_id=data['device'] if i % 2 else data['other_device'], celltower_id=data['celltower'],
+                        latitude=55.6, longitude=-4.6, signal_type='LTE', signal_value=i,
+                        timestamp=datetime(2026, 1, 1) + timedelta(hours=i)) for i in range(7)]
+    db.session.add_all(readings)
+    db.session.commit()
+    return [reading.reading_id for reading in readings]
+
+
+def get(client, url):
+    db.session.remove()
+    return client.get(url, headers=api_headers('admin@example.com'))
+
+
+def test_keyset_pages(client, reading_ids):
+    seen = []
+    url = '/api/v1.0/readings?limit=3'
+    while True:
+        page = get(client, url).get_json()
+        assert len(page['items']) <= 3
+        seen.extend(item['reading_id'] for item in page['items'])
+        if page['next_after'] is None:
+            break
+        assert page['next_after'] == seen[-1]
+        url = '/api/v1.0/readings?limit=3&after={}'.format(page['next_after'])
+    assert seen == reading_ids
+
+
+def test_limit_is_capped(app, client, reading_ids, monkeypatch):
+    monkeypatch.setitem(app.config, 'LIST_MAX_LIMIT', 2)
+    page = get(client, '/api/v1.0/readings?limit=100').get_json()
+    assert [item['reading_id'] for item in page['items']] == reading_ids[:2]
+    assert page['next_after'] == reading_ids[1]
+
+
+def test_after_alone_pages_with_the_default_limit(client, reading_ids):
+    page = get(client, '/api/v1.0/readings?after={}'.format(reading_ids[4])).get_json()
+    assert [item['reading_id'] for item in page['items']] == reading_ids[5:]
+    assert page['next_after'] is None
+
+
+def test_without_paging_parameters_the_whole_list_is_streamed(app, client, data, reading_ids, monkeypatch):
+    monkeypatch.setitem(app.config, 'LIST_STREAM_BATCH', 2)
+    response = get(client, '/api/v1.0/readings')
+    assert response.status_code == 200
+    assert response.is_streamed
+    items = response.get_json()
+    assert [item['reading_id'] for item in items] == reading_ids
+    assert items[0] == Reading.query.get(reading_ids[0]).serialize()
+
+    users = get(client, '/api/v1.0/users').get_json()
+    assert [user['email'] for user in users] == ['admin@example.com', 'user@example.com', 'other@example.com']
+
+
+def test_filters(client, data, reading_ids):
+    url = '/api/v1.0/readings?limit=10&device_id={}&start=2026-01-01T02:00:00&end=2026-01-01T05:00:00'
+    page = get(client, url.format(data['device'])).get_json()
+    assert [item['signal_value'] for item in page['items']] == [3]
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=-1', 'limit=many', 'after=last', 'limit=2&after=',
+                                   'start=yesterday'])
+def test_bad_parameters(client, reading_ids, query):
+    assert get(client, '/api/v1.0/readings?' + query).status_code == 400
@@ -0,0 +1,55 @@
+from datetime import date, datetime
+from sqlalchemy import text
+from app import db, partitions
+from app.models import Reading
+from conftest import requires_postgres
+
+
+pytestmark = requires_postgres
+
+TODAY = date(2026, 3, 15)
+
+
+def add_reading(data, timestamp):
+    reading = Reading(device_id=data['device'], celltower_id=data['celltower'], latitude=55.6, longitude=-4.6,
+                      signal_type='LTE', signal_value=50, timestamp=timestamp)
+    db.session.add(reading)
+    db.session.commit()
+    return reading.reading_id
+
+
+def partition_of(reading_id):
+    return db.session.execute(text('SELECT tableoid::regclass::text FROM reading WHERE reading_id = :id'),
+                              {'id': reading_id}).scalar()
+
+
+def constraint_names(table):
+    return set(db.session.execute(text('SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass)'),
+                                  {'table': table}).scalars())
+
+
+def test_convert(app, data):
+    january = add_reading(data, datetime(2026, 1, 10))
+    march = add_reading(data, datetime(2026, 3, 1))
+
+    assert partitions.convert(months_ahead=2, today=TODAY) == 2
+
+    assert partitions.is_partitioned()
+    assert partitions.partition_months() == [date(2026, month, 1) for month in range(1, 6)]
+    assert partition_of(january) == 'reading_y2026m01'
+    assert partition_of(march) == 'reading_y2026m03'
+    # Under the names the migrations drop and recreate them by
+    assert constraint_names('reading') == {'reading_pkey', 'reading_device_id_fkey', 'reading_celltower_id_fkey'}
+
+
+def test_readings_without_a_partition_go_to_the_default_one(app, data):
+    partitions.convert(months_ahead=0, today=TODAY)
+    later = add_reading(data, datetime(2026, 8, 20))
+    earlier = add_reading(data, datetime(2020, 1, 1))
+    assert partition_of(later) == partitions.DEFAULT_PARTITION
+
+    # Moved out when its month gets a partition, and deleted once past the retention period
+    partitions.create_ahead(months_ahead=6, today=TODAY)
+    assert partition_of(later) == 'reading_y2026m08'
+    partitions.drop_expired(retention_months=12, today=TODAY)
+    assert db.session.query(Reading.reading_id).filter(Reading.reading_id == earlier).first() is None
@@ -0,0 +1,65 @@
+import time
+from app import db
+from app.models import User, Device, Reading, ReadingRollup, Tombstone
+from conftest import api_headers
+
+
+def request(client, method, url, email='user@example.com', **kwargs):
+    db.session.remove()
+    return client.open(url, method=method, headers=api_headers(email), **kwargs)
+
+
+def add_readings(client, data, count):
+    response = request(client, 'POST', '/api/v1.0/readings/batch', json=[{
+        'device_id': data['device'], 'celltower_id': data['celltower'], 'latitude': 55.6 + i / 1000,
+        'longitude': -4.6, 'signal_type': 'LTE', 'signal_value': i} for i in range(count)])
+    assert [result['status'] for result in response.get_json()] == [201] * count
+
+
+def finished(client, response, email='user@example.com', timeout=5):
+    url = response.headers['Location']
+    deadline = time.monotonic() + timeout
+    while True:
+        progress = request(client, 'GET', url, email).get_json()
+        if progress['status'] != 'running' or time.monotonic() > deadline:
+            return progress
+        time.sleep(0.02)
+
+
+def test_async_device_purge(app, client, data, monkeypatch):
+    monkeypatch.setitem(app.config, 'PURGE_CHUNK_SIZE', 3)
+    add_readings(client, data, 10)
+    assert ReadingRollup.query.filter_by(device_id=data['device']).count() > 0
+
+    response = request(client, 'DELETE', '/api/v1.0/devices/{}?async=1'.format(data['device']))
+    assert response.status_code == 202
+    assert response.get_json()['table_name'] == 'device'
+    assert response.get_json()['total'] == 10
+
+    progress = finished(client, response)
+    assert (progress['status'], progress['deleted'], progress['total']) == ('done', 10, 10)
+    # Only its owner (or an admin) may follow a purge
+    assert request(client, 'GET', response.headers['Location'], 'other@example.com').status_code == 403
+
+    db.session.remove()
+    assert Device.query.get(data['device']) is None
+    assert Reading.query.count() == 0
+    assert ReadingRollup.query.count() == 0
+    assert [(t.table_name, t.row_id, t.user_id) for t in Tombstone.query] == [('device', data['device'], data['user'])]
+    sync = request(client, 'GET', '/api/v1.0/sync?since=0').get_json()
+    assert sync['deleted']['device'] == [data['device']]
+
+
+def test_async_user_purge(client, data):
+    add_readings(client, data, 5)
+    response = request(client, 'DELETE', '/api/v1.0/users/{}?async=1'.format(data['user']), 'admin@example.com')
+    assert response.status_code == 202
+    assert finished(client, response, 'admin@example.com')['status'] == 'done'
+
+    db.session.remove()
+    assert User.query.get(data['user']) is None
+    assert Device.query.filter_by(user_id=data['user']).count() == 0
+    assert Reading.query.count() == 0
+    assert ReadingRollup.query.count() == 0
+    assert Device.query.get(data['other_device']) is not None
+    assert ('user', data['user']) in [(t.table_name, t.row_id) for t in Tombstone.query]
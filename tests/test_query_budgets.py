@@ -0,0 +1,59 @@
+import pytest
+from app import db
+from app.models import Reading
+from conftest import api_headers
+
+
+# The number of SQL statements each of the reading and device endpoints may run, including the
+# authentication lookup and the writes to the rollups and tombstones, as counted on SQLite. See
+# app/authorization.py for how ownership is checked in one query. A change that adds a statement
+# to one of these paths has to raise its budget here.
+BUDGETS = {
+    ('GET', 'reading'): 2,
+    ('POST', 'reading'): 6,
+    ('PUT', 'reading'): 7,
+    ('DELETE', 'reading'): 8,
+    ('GET', 'device'): 2,
+    ('POST', 'device'): 3,
+    ('PUT', 'device'): 4,
+    ('DELETE', 'device'): 8,
+}
+
+
+@pytest.fixture
+def reading_id(data):
+    reading = Reading(device_id=data['device'], celltower_id=data['celltower'],
+                      latitude=55.6, longitude=-4.6, signal_type='LTE', signal_value=50)
+    db.session.add(reading)
+    db.session.commit()
+    return reading.reading_id
+
+
+# Make a request as a served one would be, with a session of its own, check it succeeded and that
+# it ran no more statements than its budget
+def check_budget(client, statements, method, kind, url, status, **kwargs):
+    db.session.remove()
+    del statements[:]
+    response = client.open(url, method=method, headers=api_headers('user@example.com'), **kwargs)
+    assert response.status_code == status
+    assert len(statements) <= BUDGETS[(method, kind)], '\n'.join(statements)
+
+
+def test_reading_endpoints(client, data, reading_id, statements):
+    url = '/api/v1.0/readings/{}'.format(reading_id)
+    check_budget(client, statements, 'GET', 'reading', url, 200)
+    check_budget(client, statements, 'POST', 'reading', '/api/v1.0/readings', 201, json={
+        'device_id': data['device'], 'celltower_id': data['celltower'],
+        'latitude': 55.7, 'longitude': -4.5, 'signal_type': 'LTE', 'signal_value': 40})
+    check_budget(client, statements, 'PUT', 'reading', url, 200, json={'signal_value': 60})
+    check_budget(client, statements, 'DELETE', 'reading', url, 204)
+
+
+def test_device_endpoints(client, data, statements):
+    device_id, user_id = data['device'], data['user']
+    url = '/api/v1.0/devices/{}'.format(device_id)
+    check_budget(client, statements, 'GET', 'device', url, 200)
+    check_budget(client, statements, 'POST', 'device', '/api/v1.0/devices', 201, json={
+        'user_id': user_id, 'manufacturer': 'Test', 'model': 'Test', 'serial_no': 'new', 'android_version': '12'})
+    check_budget(client, statements, 'PUT', 'device', url, 200, json={'android_version': '12'})
+    check_budget(client, statements, 'DELETE', 'device', url, 204)
@@ -0,0 +1,74 @@
+from datetime import datetime
+from app import db
+from app.models import Reading
+from conftest import api_headers
+
+URL = '/api/v1.0/readings/batch'
+
+
+def reading(data, **values):
+    item = {'device_id': data['device'], 'celltower_id': data['celltower'],
+            'latitude': 55.6, 'longitude': -4.6, 'signal_type': 'LTE', 'signal_value': 50}
+    item.update(values)
+    return item
+
+
+def post(client, items, email='user@example.com'):
+    db.session.remove()
+    return client.post(URL, headers=api_headers(email), json=items)
+
+
+def test_statuses_per_item(client, data):
+    response = post(client, [
+        reading(data),
+        reading(data, signal_value='loud'),
+        {'device_id': data['device']},
+        'not a reading',
+        reading(data, device_id=data['device'] + 100),
+        reading(data, celltower_id=data['celltower'] + 100),
+        reading(data, device_id=data['other_device']),
+        reading(data, signal_type='X' * 100),
+    ])
+    assert response.status_code == 200
+    assert [(result['index'], result['status']) for result in response.get_json()] == \
+        [(0, 201), (1, 400), (2, 400), (3, 400), (4, 400), (5, 400), (6, 403), (7, 400)]
+    assert Reading.query.count() == 1
+
+
+def test_admin_may_add_readings_for_any_device(client, data):
+    response = post(client, [reading(data), reading(data, device_id=data['other_device'])], 'admin@example.com')
+    assert [result['status'] for result in response.get_json()] == [201, 201]
+
+
+def test_valid_readings_are_inserted_with_one_statement(client, data, statements):
+    response = post(client, [reading(data, signal_value=value) for value in range(20)] + [reading(data, latitude='x')])
+    assert [result['status'] for result in response.get_json()] == [201] * 20 + [400]
+    inserts = [statement for statement in statements if statement.startswith('INSERT INTO reading ')]
+    assert len(inserts) == 1
+    assert sorted(value for (value,) in db.session.query(Reading.signal_value)) == list(range(20))
+
+
+def test_empty_and_non_list_bodies(client, data):
+    response = post(client, [])
+    assert response.status_code == 200
+    assert response.get_json() == []
+    assert post(client, reading(data)).status_code == 400
+    assert post(client, 'readings').status_code == 400
+
+
+def test_client_timestamps(client, data):
+    before = datetime.utcnow()
+    response = post(client, [
+        reading(data, timestamp='2020-01-01T00:00:00', signal_value=1),
+        reading(data, timestamp='2020-01-01T02:30:00+02:00', signal_value=2),
+        reading(data, timestamp='2020-01-01T00:45:00Z', signal_value=3),
+        reading(data, signal_value=4),
+        reading(data, timestamp='yesterday', signal_value=5),
+        reading(data, timestamp=1577836800, signal_value=6),
+    ])
+    assert [result['status'] for result in response.get_json()] == [201, 201, 201, 201, 400, 400]
+    timestamps = dict(db.session.query(Reading.signal_value, Reading.timestamp))
+    assert timestamps[1] == datetime(2020, 1, 1, 0, 0)
+    assert timestamps[2] == datetime(2020, 1, 1, 0, 30)
+    assert timestamps[3] == datetime(2020, 1, 1, 0, 45)
+    assert before <= timestamps[4] <= datetime.utcnow()
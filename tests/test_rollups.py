@@ -0,0 +1,40 @@
+import random
+from app import db
+from app.models import ReadingRollup
+from app.rollups import rebuild, rollup_cell, ROLLUP_SCALE
+from conftest import api_headers
+
+
+def rollups():
+    return {(row.device_id, row.day, row.cell_x, row.cell_y, row.signal_type): (row.count, row.sum, row.min, row.max)
+            for row in ReadingRollup.query}
+
+
+def test_rollup_cell_of_a_value_and_a_column_agree(app):
+    for value in (0, 1 / ROLLUP_SCALE, -1 / ROLLUP_SCALE, 55.6, -4.6, 179.9999999):
+        assert db.session.query(rollup_cell(db.literal(value))).scalar() == rollup_cell(value)
+
+
+def test_incremental_rollups_match_a_rebuild(client, data):
+    rnd = random.Random(1)
+    headers = api_headers('user@example.com')
+    reading_ids = []
+    for i in range(60):
+        # Every third reading on a cell boundary
+        longitude = rnd.randint(-1000, 1000) / ROLLUP_SCALE if i % 3 == 0 else rnd.uniform(-5, -4)
+        response = client.post('/api/v1.0/readings', headers=headers, json={
+            'device_id': data['device'], 'celltower_id': data['celltower'],
+            'latitude': round(rnd.uniform(55, 56), 7), 'longitude': round(longitude, 7),
+            'signal_type': 'LTE', 'signal_value': rnd.randint(0, 100)})
+        assert response.status_code == 201
+        reading_ids.append(response.get_json()['reading_id'])
+    for reading_id in reading_ids[:10]:
+        assert client.delete('/api/v1.0/readings/{}'.format(reading_id), headers=headers).status_code == 204
+    for reading_id in reading_ids[10:20]:
+        response = client.put('/api/v1.0/readings/{}'.format(reading_id), headers=headers,
+                              json={'signal_value': 5, 'longitude': -4.5})
+        assert response.status_code == 200
+
+    maintained = rollups()
+    rebuild()
+    assert rollups() == maintained
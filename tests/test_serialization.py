@@ -0,0 +1,37 @@
+from datetime import datetime
+import pytest
+from flask import json
+from app import db
+from app.models import User, Device, Reading, CellTower
+from app.serialization import user_projection, device_projection, reading_projection, celltower_projection
+
+
+@pytest.fixture
+def rows(data):
+    user = User.query.get(data['other'])
+    user.first_name = 'Zoë'
+    user.login_failure_count = 3
+    user.login_locked_timestamp = datetime(2026, 3, 4, 5, 6, 7)
+    db.session.add(CellTower(celltower_name='54321', location_area_code='7', mobile_country_code='310',
+                             mobile_network_code='260', latitude=-33.8688, longitude=151.2093))
+    for i, (latitude, longitude) in enumerate([(55.6, -4.6), (0, 0), (-0.000001, 179.999999), (51.5072, -0.1275)]):
+        db.session.add(Reading(device_id=data['device'], celltower_id=data['celltower'], latitude=latitude,
+                               longitude=longitude, signal_type='LTE', signal_value=i,
+                               timestamp=datetime(2026, 1, 1, 12, 0, 0, 123456 * i)))
+    db.session.commit()
+    db.session.remove()
+
+
+# The projections' JSON is byte-identical to encoding serialize() of every row with flask.json
+@pytest.mark.parametrize('model, key, projection', [
+    (User, User.user_id, user_projection),
+    (Device, Device.device_id, device_projection),
+    (Reading, Reading.reading_id, reading_projection),
+    (CellTower, CellTower.celltower_id, celltower_projection),
+])
+def test_projection_matches_serialize(app, rows, model, key, projection):
+    query = model.query.order_by(key)
+    expected = '[' + ','.join(json.dumps(row.serialize(), separators=(',', ':')) for row in query) + ']'
+    assert '[' + ','.join(projection.json_batches(query, 2)) + ']' == expected
+    assert projection.items(db.session.execute(projection.select(query)).all()) == \
+        [json.loads(json.dumps(row.serialize())) for row in query]
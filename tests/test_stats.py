@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+import random
+import pytest
+from app import db, stats
+from app.models import Reading
+from conftest import api_headers, requires_postgres
+
+START = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def readings(data):
+    rnd = random.Random(3)
+    for i in range(300):
+        db.session.add(Reading(device_id=data['device'], celltower_id=data['celltower'], latitude=55.6, longitude=-4.6,
+                               signal_type=rnd.choice(['GSM', 'LTE', 'UMTS']), signal_value=rnd.randint(0, 100),
+                               timestamp=START + timedelta(minutes=rnd.randint(0, 179))))
+    db.session.commit()
+    return Reading.query.filter(Reading.device_id == data['device'])
+
+
+# percentile_cont: linear interpolation between the closest ranks
+def percentile_cont(values, fraction):
+    values = sorted(values)
+    position = fraction * (len(values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def expected(values):
+    result = {'count': len(values), 'mean': round(sum(values) / len(values), 2), 'min': min(values), 'max': max(values)}
+    for name, fraction in stats.PERCENTILES:
+        result[name] = round(percentile_cont(values, fraction), 2)
+    return result
+
+
+def test_numpy_stats(readings):
+    by_type, by_hour = stats.numpy_stats(readings, None)
+    rows = readings.all()
+    assert by_type == [dict(signal_type=signal_type,
+                            **expected([r.signal_value for r in rows if r.signal_type == signal_type]))
+                       for signal_type in ('GSM', 'LTE', 'UMTS')]
+    groups = sorted({(r.timestamp.replace(minute=0, second=0, microsecond=0), r.signal_type) for r in rows})
+    assert by_hour == [dict(hour=str(hour), signal_type=signal_type,
+                            **expected([r.signal_value for r in rows
+                                        if r.signal_type == signal_type and r.timestamp.hour == hour.hour]))
+                       for hour, signal_type in groups]
+
+
+@requires_postgres
+def test_sql_and_numpy_stats_agree(readings):
+    assert stats.sql_stats(readings) == stats.numpy_stats(readings, None)
+
+
+def test_device_stats_endpoint(client, data, readings):
+    url = '/api/v1.0/devices/{}/stats?start=2026-01-01T01:00:00&end=2026-01-01T02:00:00'.format(data['device'])
+    db.session.remove()
+    result = client.get(url, headers=api_headers('user@example.com')).get_json()
+    hour = [r for r in readings.all() if START + timedelta(hours=1) <= r.timestamp < START + timedelta(hours=2)]
+    assert [group['signal_type'] for group in result['by_signal_type']] == ['GSM', 'LTE', 'UMTS']
+    assert sum(group['count'] for group in result['by_signal_type']) == len(hour)
+    assert result['by_signal_type'][1] == dict(signal_type='LTE', **expected(
+        [r.signal_value for r in hour if r.signal_type == 'LTE']))
+
+    # A reading added to the (closed, so cached) range is counted from then on
+    response = client.post('/api/v1.0/readings/batch', headers=api_headers('user@example.com'), json=[{
+        'device_id': data['device'], 'celltower_id': data['celltower'], 'latitude': 55.6, 'longitude': -4.6,
+        'signal_type': 'LTE', 'signal_value': 100, 'timestamp': '2026-01-01T01:30:00'}])
+    assert response.get_json()[0]['status'] == 201
+    result = client.get(url, headers=api_headers('user@example.com')).get_json()
+    assert sum(group['count'] for group in result['by_signal_type']) == len(hour) + 1
+
+    assert client.get(url.replace('end=2026-01-01T02', 'end=2026-01-01T00'),
+                      headers=api_headers('user@example.com')).status_code == 400
+    assert client.get(url, headers=api_headers('other@example.com')).status_code == 403
@@ -0,0 +1,63 @@
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Device
+from conftest import api_headers, requires_postgres
+
+
+def sync(client, since, email='user@example.com'):
+    db.session.remove()
+    response = client.get('/api/v1.0/sync?since={}'.format(since), headers=api_headers(email))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def new_device(session, user_id, serial_no):
+    device = Device(user_id=user_id, manufacturer='Test', model='Test', serial_no=serial_no, android_version='11')
+    session.add(device)
+    session.flush()
+    return device.device_id
+
+
+def test_sync_returns_what_changed_after_the_cursor(client, data):
+    first = sync(client, 0)
+    assert [user['user_id'] for user in first['users']] == [data['user']]
+    assert [device['device_id'] for device in first['devices']] == [data['device']]
+    assert not first['more']
+
+    assert sync(client, first['next'])['devices'] == []
+    response = client.put('/api/v1.0/devices/{}'.format(data['device']), headers=api_headers('user@example.com'),
+                          json={'android_version': '12'})
+    assert response.status_code == 200
+    response = client.delete('/api/v1.0/devices/{}'.format(data['device']), headers=api_headers('user@example.com'))
+    assert response.status_code == 204
+
+    second = sync(client, first['next'])
+    assert second['deleted']['device'] == [data['device']]
+    assert second['next'] > first['next']
+
+
+# A change that commits after one with a higher change_seq must not be skipped by a cursor that
+# has already moved past it
+@requires_postgres
+def test_changes_committed_out_of_order_are_not_skipped(app, client, data):
+    cursor = sync(client, 0, 'admin@example.com')['next']
+
+    first, second = Session(bind=db.engine), Session(bind=db.engine)
+    try:
+        slow = new_device(first, data['user'], 'slow')      # takes the lower change_seq
+        fast = new_device(second, data['user'], 'fast')
+        second.commit()
+
+        seen = []
+        result = sync(client, cursor, 'admin@example.com')
+        seen += [device['device_id'] for device in result['devices']]
+        assert slow not in seen
+        cursor = result['next']
+
+        first.commit()
+        result = sync(client, cursor, 'admin@example.com')
+        seen += [device['device_id'] for device in result['devices']]
+        assert sorted(seen) == sorted([slow, fast])
+    finally:
+        first.close()
+        second.close()
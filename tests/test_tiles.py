@@ -0,0 +1,43 @@
+import math
+import os
+import random
+from app import tiles
+from app.spatial import cell_size
+from app.tiles import TILE_SIZE
+
+
+# Every tile within TILE_RADIUS pixels of the centre of the reading's cell, which is where it is drawn
+def drawn_in(app, lat, lng, zoom):
+    radius = app.config['TILE_RADIUS']
+    size = cell_size(zoom)
+    x, y = tiles.to_pixels((math.floor(lat / size) + 0.5) * size, (math.floor(lng / size) + 0.5) * size, zoom)
+    x, y = float(x), float(y)
+    found = set()
+    for tile_x in range(int((x - radius) // TILE_SIZE), int((x + radius) // TILE_SIZE) + 1):
+        for tile_y in range(int((y - radius) // TILE_SIZE), int((y + radius) // TILE_SIZE) + 1):
+            nearest_x = min(max(x, tile_x * TILE_SIZE), (tile_x + 1) * TILE_SIZE)
+            nearest_y = min(max(y, tile_y * TILE_SIZE), (tile_y + 1) * TILE_SIZE)
+            if math.hypot(x - nearest_x, y - nearest_y) <= radius:
+                found.add((tile_x, tile_y))
+    return found
+
+
+def test_invalidation_covers_the_tiles_a_reading_is_drawn_in(app):
+    random.seed(1)
+    for _ in range(2000):
+        lat, lng, zoom = random.uniform(-80, 80), random.uniform(-180, 180), random.randint(0, 12)
+        assert drawn_in(app, lat, lng, zoom) <= set(tiles.affected_tiles(lat, lng, zoom))
+
+
+def test_prune_deletes_the_least_recently_used_tiles(tmp_path):
+    for age in range(10):
+        path = tmp_path / '1' / 'range' / '3' / str(age) / '0.png'
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (1000 - age, 1000 - age))
+    (tmp_path / '1' / 'generation').write_bytes(b'x' * 1000)
+
+    assert tiles.prune(str(tmp_path), 1000) == 0
+    assert tiles.prune(str(tmp_path), 500) == 6
+    assert [age for age in range(10) if (tmp_path / '1' / 'range' / '3' / str(age) / '0.png').exists()] == [0, 1, 2, 3]
+    assert (tmp_path / '1' / 'generation').exists()